@@ -158,6 +158,12 @@ class DBManager(QMainWindow):
 		self.info.setDirty()
 		self.table.setDirty()
 		self.preview.setDirty()
+
+		# read again the metadata of the tables
+		db = self.tree.currentDatabase()
+		if db != None:
+			db.connector.metadataCache.invalidate()
+
 		self.refreshItem()
 
 	def runSqlWindow(self):
@@ -344,7 +350,15 @@ class DBManager(QMainWindow):
 		self.dock.setObjectName("DB_Manager_DBView")
 		self.dock.setFeatures(QDockWidget.DockWidgetMovable)
 		self.tree = DBTree(self)
-		self.dock.setWidget(self.tree)
+		self.treeFilter = QLineEdit()
+		self.treeFilter.setToolTip("Filter the tables by name, start with ^ to match only the beginning of the name")
+		self.connect(self.treeFilter, SIGNAL("textChanged(const QString &)"), self.tree.setFilterText)
+		treeWidget = QWidget()
+		treeLayout = QVBoxLayout(treeWidget)
+		treeLayout.setContentsMargins(0, 0, 0, 0)
+		treeLayout.addWidget(self.treeFilter)
+		treeLayout.addWidget(self.tree)
+		self.dock.setWidget(treeWidget)
 		self.addDockWidget(Qt.LeftDockWidgetArea, self.dock)
 
 		# create status bar
@@ -28,6 +28,7 @@ from .db_plugins.plugin import BaseError, DbError, Table
 from .dlg_db_error import DlgDbError
 
 import qgis.core
+from bisect import bisect_left
 
 try:
 	from . import resources_rc
@@ -40,9 +41,17 @@ class TreeItem(QObject):
 		self.populated = False
 		self.itemData = data
 		self.childItems = []
+		self._row = 0	# position in the parent's children, see row()
+		self._firstChangedRow = None	# children from this row on must be renumbered
 		if parent: 
 			parent.appendChild(self)
 
+		# background population (see populateInBackground)
+		self._populateTask = None
+		self.fetchedRows = None
+		self.populateError = None
+		self.catalogRow = None	# the row this item was created from
+
 	def childRemoved(self, child):
 		self.itemChanged()	
 
@@ -56,21 +65,106 @@ class TreeItem(QObject):
 		self.populated = True
 		return True
 
+	def populateInBackground(self, db, method, *args):
+		""" call method(*args) in a worker thread, a placeholder child is shown
+			until the returned rows are available. Then the "childrenFetched"
+			signal is emitted and the model creates the children by createChild() """
+		LoadingItem(self)
+		from .db_plugins.tasks import CatalogTask
+		self._populateTask = CatalogTask(db, method, *args)
+		self.connect(self._populateTask, SIGNAL("finished()"), self._populateTaskFinished)
+		self._populateTask.start()
+
+	def _populateTaskFinished(self):
+		task = self.sender()
+		if task != self._populateTask:
+			return	# canceled
+		task.deleteLater()
+		self._populateTask = None
+
+		rows = task.result()
+		self.fetchedRows = list(rows) if rows != None else []
+		self.populateError = task.error()
+		self.emit( SIGNAL("childrenFetched"), self )
+
+	def isLoading(self):
+		return self._populateTask != None or self.fetchedRows != None
+
+	def cancelPopulate(self):
+		""" stop the background population of this item and its children """
+		if self._populateTask != None:
+			from .db_plugins.tasks import discardTask
+			self.disconnect(self._populateTask, SIGNAL("finished()"), self._populateTaskFinished)
+			discardTask(self._populateTask)
+			self._populateTask = None
+		self.fetchedRows = None
+		for child in self.childItems:
+			child.cancelPopulate()
+
+	def readCatalog(self):
+		""" return the catalog rows the children are created from """
+		return None
+
+	def canRefreshByDiff(self):
+		""" return whether the children can be updated comparing them with
+			the rows returned by readCatalog() instead of being re-created """
+		return False
+
+	def childDataFromRow(self, row):
+		""" return the db object (schema, table, ...) for a catalog row """
+		return None
+
+	def childItemFromData(self, data):
+		return None
+
+	def createChild(self, row, pos=None, data=None):
+		""" create a child item from a catalog row and insert it at 'pos' """
+		if data == None:
+			data = self.childDataFromRow(row)
+		child = self.childItemFromData(data)
+		if child == None:
+			return None
+		child.catalogRow = row
+		self.insertChild(pos if pos != None else len(self.childItems), child)
+		return child
+
+	def replaceItemData(self, data, row):
+		""" use a new db object for the item, it was read again from the catalog """
+		old = self.itemData
+		if old != None:
+			self.disconnect(old, SIGNAL("changed"), self.itemChanged)
+			self.disconnect(old, SIGNAL("deleted"), self.itemRemoved)
+			old.deleteLater()
+		self.itemData = data
+		self.catalogRow = row
+		self.connect(data, SIGNAL("changed"), self.itemChanged)
+		self.connect(data, SIGNAL("deleted"), self.itemRemoved)
+
 	def getItemData(self):
 		return self.itemData
 
 	def appendChild(self, child):
+		child._row = len(self.childItems)
 		self.childItems.append(child)
 		self.connect(child, SIGNAL("itemRemoved"), self.childRemoved)
+
+	def insertChild(self, row, child):
+		child.setParent(self)
+		self.childItems.insert(row, child)
+		self._childRowsChanged(row)
+		self.connect(child, SIGNAL("itemRemoved"), self.childRemoved)
 	
 	def child(self, row):
 		return self.childItems[row]
 
 	def removeChild(self, row):
 		if row >= 0 and row < len(self.childItems):
-			self.childItems[row].itemData.deleteLater()
+			self.childItems[row].cancelPopulate()
+			if self.childItems[row].itemData != None:
+				self.childItems[row].itemData.deleteLater()
 			self.disconnect(self.childItems[row], SIGNAL("itemRemoved"), self.childRemoved)
 			del self.childItems[row]
+			self._childRowsChanged(row)
 	
 	def childCount(self):
 		return len(self.childItems)
@@ -79,12 +173,25 @@ class TreeItem(QObject):
 		return 1
 	
 	def row(self):
-		if self.parent():
-			for row, item in enumerate(self.parent().childItems):
-				if item is self:
-					return row
+		parent = self.parent()
+		if parent:
+			parent._updateChildRows()
+			return self._row
 		return 0
 
+	def _childRowsChanged(self, row):
+		""" children were inserted or removed at row, the following ones
+			will be renumbered the next time row() is called """
+		if self._firstChangedRow == None or row < self._firstChangedRow:
+			self._firstChangedRow = row
+
+	def _updateChildRows(self):
+		if self._firstChangedRow == None:
+			return
+		for row in range(self._firstChangedRow, len(self.childItems)):
+			self.childItems[row]._row = row
+		self._firstChangedRow = None
+
 	def data(self, column):
 		return "" if column == 0 else None
 	
@@ -97,6 +204,19 @@ class TreeItem(QObject):
 		return pathList << self.data(0)
 
 
+class LoadingItem(TreeItem):
+	""" placeholder shown while the children of an item are being read """
+
+	def __init__(self, parent=None):
+		TreeItem.__init__(self, None, parent)
+		self.populated = True
+
+	def data(self, column):
+		if column == 0:
+			return u"Loading..."
+		return None
+
+
 class PluginItem(TreeItem):
 	def __init__(self, dbplugin, parent=None):
 		TreeItem.__init__(self, dbplugin, parent)
@@ -157,18 +277,38 @@ class ConnectionItem(TreeItem):
 		self.connect(database, SIGNAL("changed"), self.itemChanged)
 		self.connect(database, SIGNAL("deleted"), self.itemRemoved)
 
-		schemas = database.schemas()
-		if schemas != None:
-			for s in schemas:
-				SchemaItem(s, self)
-		else:
-			tables = database.tables()
-			for t in tables:
-				TableItem(t, self)
-
+		self.hasSchemas = False
+		self._database = database
+		self.populateInBackground( database, self.readCatalog )
 		self.populated = True
 		return True
 
+	def readCatalog(self):
+		""" read the schemas, or the tables if the database doesn't support schemas """
+		connector = self.getItemData().database().connector
+		rows = connector.getSchemas()
+		self.hasSchemas = rows != None
+		if rows == None:
+			rows = connector.getTables()
+			# it runs in background, read the table metadata in advance too
+			connector.prefetchSchemaMetadata( None, len(rows) )
+		return rows
+
+	def canRefreshByDiff(self):
+		# the children refer to the database object, it changes when reconnecting
+		return self.populated and self.getItemData().database() == self._database
+
+	def childDataFromRow(self, row):
+		database = self.getItemData().database()
+		if self.hasSchemas:
+			return database.schemasFactory(row, database)
+		return database.tablesFactory(row, database)
+
+	def childItemFromData(self, data):
+		if self.hasSchemas:
+			return SchemaItem( data, None )
+		return TableItem( data, None )
+
 	def isConnected(self):
 		return self.getItemData().database() != None
 
@@ -197,12 +337,29 @@ class SchemaItem(TreeItem):
 		if self.populated:
 			return True
 
-		for t in self.getItemData().tables():
-			TableItem(t, self)
-
+		self.populateInBackground( self.getItemData().database(), self.readCatalog )
 		self.populated = True
 		return True
 
+	def readCatalog(self):
+		schema = self.getItemData()
+		connector = schema.database().connector
+		rows = connector.getTables( schema.name )
+		# it runs in background, read the table metadata in advance too
+		connector.prefetchSchemaMetadata( schema.name, len(rows) )
+		return rows
+
+	def canRefreshByDiff(self):
+		return self.populated
+
+	def childDataFromRow(self, row):
+		schema = self.getItemData()
+		database = schema.database()
+		return database.tablesFactory(row, database, schema)
+
+	def childItemFromData(self, data):
+		return TableItem( data, None )
+
 
 class TableItem(TreeItem):
 	def __init__(self, table, parent):
@@ -261,6 +418,8 @@ class TableItem(TreeItem):
 
 
 class DBModel(QAbstractItemModel):
+	POPULATE_CHUNK_SIZE = 200	# children added at once when populating in background
+
 	def __init__(self, parent=None):
 		QAbstractItemModel.__init__(self, parent)
 		self.treeView = parent
@@ -270,6 +429,8 @@ class DBModel(QAbstractItemModel):
 		if self.isImportVectorAvail:
 			self.connect(self, SIGNAL("importVector"), self.importVector)
 
+		self._itemsToFill = []	# items whose children are being added
+
 		self.rootItem = TreeItem(None, None)
 		for dbtype in supportedDbTypes():
 			dbpluginclass = createDbPlugin( dbtype )
@@ -403,6 +564,16 @@ class DBModel(QAbstractItemModel):
 		parentItem = parent.internalPointer() if parent.isValid() else self.rootItem
 		return parentItem.childCount() > 0 or not parentItem.populated
 
+	def canFetchMore(self, parent):
+		# let the proxy models know about the children without populating the item
+		parentItem = parent.internalPointer() if parent.isValid() else self.rootItem
+		return not parentItem.populated
+
+	def fetchMore(self, parent):
+		parentItem = parent.internalPointer() if parent.isValid() else self.rootItem
+		if not parentItem.populated:
+			self._refreshIndex( parent, True )
+
 
 	def setData(self, index, value, role):
 		if role != Qt.EditRole or index.column() != 0:
@@ -445,12 +616,24 @@ class DBModel(QAbstractItemModel):
 			item = index.internalPointer() if index.isValid() else self.rootItem
 			prevPopulated = item.populated
 			if prevPopulated:
-				self.removeRows(0, self.rowCount(index), index)
+				self.emit( SIGNAL("itemRefreshed"), item )
+			if prevPopulated and not item.isLoading() and item.canRefreshByDiff():
+				try:
+					self._diffRefresh(index, item)
+					self._onDataChanged( index )
+					return
+				except BaseError, e:
+					pass	# re-create all the children
+
+			if prevPopulated:
+				item.cancelPopulate()
+				if item.childCount() > 0:
+					self.removeRows(0, item.childCount(), index)
 				item.populated = False
 			if prevPopulated or force:
 				if item.populate():
 					for child in item.childItems:
-						self.connect(child, SIGNAL("itemChanged"), self.refreshItem)
+						self._connectChild( child )
 					self._onDataChanged( index )
 				else:
 					self.emit( SIGNAL("notPopulated"), index )
@@ -462,6 +645,156 @@ class DBModel(QAbstractItemModel):
 		finally:
 			QApplication.restoreOverrideCursor()
 
+	def _connectChild(self, child):
+		self.connect(child, SIGNAL("itemChanged"), self.refreshItem)
+		self.connect(child, SIGNAL("childrenFetched"), self._childrenFetched)
+
+	def _itemIndex(self, item):
+		if item == self.rootItem:
+			return QModelIndex()
+		return self.createIndex(item.row(), 0, item)
+
+	def _childrenFetched(self, item):
+		""" the rows read in background are available, replace the
+			placeholder with the children items """
+		index = self._itemIndex(item)
+		if item.childCount() > 0:
+			self.removeRows(0, item.childCount(), index)
+
+		if item.populateError != None:
+			item.fetchedRows = None
+			item.populated = False
+			DlgDbError.showError(item.populateError, self.treeView)
+			self.emit( SIGNAL("notPopulated"), index )
+			return
+
+		self._itemsToFill.append( item )
+		if len(self._itemsToFill) == 1:
+			QTimer.singleShot(0, self._fillItems)
+
+	def _fillItems(self):
+		""" add the children to the items, a chunk of rows at a time
+			to let the GUI respond meanwhile """
+		while len(self._itemsToFill) > 0 and self._itemsToFill[0].fetchedRows == None:
+			self._itemsToFill.pop(0)	# canceled
+		if len(self._itemsToFill) <= 0:
+			return
+
+		item = self._itemsToFill[0]
+		rows = item.fetchedRows[:self.POPULATE_CHUNK_SIZE]
+		del item.fetchedRows[:self.POPULATE_CHUNK_SIZE]
+
+		if len(rows) > 0:
+			first = item.childCount()
+			self.beginInsertRows(self._itemIndex(item), first, first + len(rows) - 1)
+			for row in rows:
+				child = item.createChild(row)
+				if child != None:
+					self._connectChild( child )
+			self.endInsertRows()
+
+		if len(item.fetchedRows) <= 0:
+			item.fetchedRows = None
+			self._itemsToFill.pop(0)
+		if len(self._itemsToFill) > 0:
+			QTimer.singleShot(0, self._fillItems)
+
+	def cancelPopulate(self, index):
+		""" stop loading the children of the item, they will be read
+			again when the item is expanded """
+		item = index.internalPointer() if index.isValid() else self.rootItem
+		if not item.isLoading():
+			return
+		item.cancelPopulate()
+		if item.childCount() > 0:
+			self.removeRows(0, item.childCount(), index)
+		item.populated = False
+
+	def _diffRefresh(self, index, item):
+		""" read the catalog again and compare its rows with the children of
+			the item: only the new, deleted or changed children are updated """
+		rows = item.readCatalog()
+		rows = list(rows) if rows != None else []
+		datas = map(item.childDataFromRow, rows)
+
+		# children which look the same, compare what the tree shows of them
+		# instead of the whole catalog rows, which contain statistics too
+		byState = {}
+		for child in item.childItems:
+			if child.catalogRow != None and child.getItemData() != None:
+				byState.setdefault( child.getItemData().catalogState(), [] ).append( child )
+		matched = [None] * len(rows)	# child for each catalog row
+		for i, data in enumerate(datas):
+			state = data.catalogState()
+			if byState.has_key( state ) and len(byState[state]) > 0:
+				matched[i] = byState[state].pop(0)
+				matched[i].catalogRow = rows[i]
+				data.deleteLater()	# the child keeps its db object
+		unchanged = set( map(id, filter(None, matched)) )
+
+		# the other children are changed or deleted, find them by the catalog key
+		byKey = {}
+		for child in item.childItems:
+			if id(child) not in unchanged and child.getItemData() != None:
+				byKey[ child.getItemData().catalogKey() ] = child
+		newData = {}
+		updated = []
+		for i, row in enumerate(rows):
+			if matched[i] != None:
+				continue
+			data = datas[i]
+			child = byKey.pop( data.catalogKey(), None )
+			if child != None:
+				self._updateChild(child, data, row)
+				matched[i] = child
+				updated.append( child )
+			else:
+				newData[i] = data
+
+		# remove the deleted children
+		keep = set( map(id, filter(None, matched)) )
+		for pos in range(item.childCount()-1, -1, -1):
+			if id(item.child(pos)) not in keep:
+				self.removeRows(pos, 1, index)
+
+		# insert the new ones keeping the catalog order
+		for i in range(len(rows)):
+			if newData.has_key( i ):
+				pos = min(i, item.childCount())
+				self.beginInsertRows(index, pos, pos)
+				child = item.createChild(rows[i], pos, newData[i])
+				self._connectChild( child )
+				self.endInsertRows()
+
+		if len(updated) > 0:
+			self.emit( SIGNAL("layoutAboutToBeChanged()") )
+			self.emit( SIGNAL("layoutChanged()") )
+
+		# refresh the expanded children which aren't changed
+		for child in item.childItems:
+			if id(child) in unchanged:
+				if child.canRefreshByDiff() and not child.isLoading():
+					self._diffRefresh( self._itemIndex(child), child )
+				elif isinstance(child, TableItem):
+					child.getItemData().clearMetadata()
+
+	def _updateChild(self, child, data, row):
+		""" the catalog row of a child is changed, use the new db object """
+		if isinstance(child, TableItem):
+			# the table definition could be changed
+			old = child.getItemData()
+			old.database().connector.metadataCache.invalidate( (old.schemaName(), old.name) )
+			data.database().connector.metadataCache.invalidate( (data.schemaName(), data.name) )
+
+		elif child.populated:
+			# the tables refer to the old schema object, read them again
+			child.cancelPopulate()
+			if child.childCount() > 0:
+				self.removeRows(0, child.childCount(), self._itemIndex(child))
+			child.populated = False
+
+		child.replaceItemData(data, row)
+
 	def _onDataChanged(self, indexFrom, indexTo=None):
 		if indexTo == None: indexTo = indexFrom
 		self.emit( SIGNAL('dataChanged(const QModelIndex &, const QModelIndex &)'), indexFrom, indexTo)
@@ -600,3 +933,135 @@ class DBModel(QAbstractItemModel):
 		finally:
 			inLayer.deleteLater()
 
+
+class TableNameIndex:
+	""" case-insensitive index of the table names of a database,
+		it is searched by prefix or by substring """
+
+	def __init__(self, names):
+		entries = []
+		for schema, name in names:
+			schema = unicode(schema) if schema != None else None
+			entries.append( (unicode(name).lower(), schema, unicode(name)) )
+		self.entries = sorted( entries )
+		self.keys = map(lambda x: x[0], self.entries)
+
+	def search(self, text):
+		""" return the (schema, name) of the tables whose name contains text,
+			a leading '^' matches only the names starting with the text """
+		text = unicode(text).lower()
+		if text.startswith(u'^'):
+			text = text[1:]
+			first = bisect_left( self.keys, text )
+			last = bisect_left( self.keys, text + u'\uffff' )
+			found = self.entries[first:last]
+		else:
+			found = filter(lambda x: text in x[0], self.entries)
+		return set( map(lambda x: (x[1], x[2]), found) )
+
+
+class DBFilterProxyModel(QSortFilterProxyModel):
+	""" show only the tables whose name matches the filter text and their parents,
+		the matches are looked up in a name index built once per database
+		so the unrelated items aren't populated """
+
+	def __init__(self, sourceModel, parent=None):
+		QSortFilterProxyModel.__init__(self, parent)
+		self.setSourceModel( sourceModel )
+		self.filterText = u""
+		self._indexes = {}	# database: TableNameIndex
+		self._matches = {}	# database: (tables, schemas) matching the filter text
+		self.connect(sourceModel, SIGNAL("itemRefreshed"), self._itemRefreshed)
+
+	def setFilterText(self, text):
+		self.filterText = unicode(text).strip()
+		self._matches = {}
+		self.invalidateFilter()
+
+	def _itemRefreshed(self, item):
+		""" the catalog could be changed, build the name index again """
+		db = None
+		if isinstance(item, (ConnectionItem, SchemaItem, TableItem)):
+			db = item.getItemData().database()
+		if db == None:
+			self._indexes = {}
+			self._matches = {}
+		else:
+			self._indexes.pop( db, None )
+			self._matches.pop( db, None )
+
+		if self.filterText != u"":
+			self.invalidateFilter()
+
+	def matches(self, db):
+		""" return the (schema, name) of the matching tables and the schemas
+			containing them, or None if the database can't be searched """
+		if self._matches.has_key( db ):
+			return self._matches[db]
+
+		if not self._indexes.has_key( db ):
+			QApplication.setOverrideCursor(Qt.WaitCursor)
+			try:
+				self._indexes[db] = TableNameIndex( db.connector.getTableNames() )
+			except BaseError, e:
+				self._indexes[db] = None
+			finally:
+				QApplication.restoreOverrideCursor()
+
+		index = self._indexes[db]
+		if index == None:
+			self._matches[db] = None
+		else:
+			tables = index.search( self.filterText )
+			self._matches[db] = ( tables, set( map(lambda x: x[0], tables) ) )
+		return self._matches[db]
+
+	def filterAcceptsRow(self, sourceRow, sourceParent):
+		if self.filterText == u"":
+			return True
+
+		parentItem = sourceParent.internalPointer() if sourceParent.isValid() else self.sourceModel().rootItem
+		if sourceRow >= parentItem.childCount():
+			return True
+		return self._acceptsItem( parentItem.child(sourceRow) )
+
+	def _acceptsItem(self, item):
+		if isinstance(item, TableItem):
+			table = item.getItemData()
+			matches = self.matches( table.database() )
+			if matches == None:
+				return True
+			schema = table.schemaName()
+			schema = unicode(schema) if schema != None else None
+			return (schema, unicode(table.name)) in matches[0]
+
+		elif isinstance(item, SchemaItem):
+			schema = item.getItemData()
+			matches = self.matches( schema.database() )
+			return matches == None or unicode(schema.name) in matches[1]
+
+		elif isinstance(item, ConnectionItem):
+			db = item.getItemData().database()
+			if db == None:
+				return True	# not connected yet, it can contain matching tables
+			matches = self.matches( db )
+			return matches == None or len(matches[0]) > 0
+
+		elif isinstance(item, PluginItem):
+			if not item.populated:
+				return True
+			for child in item.childItems:
+				if self._acceptsItem( child ):
+					return True
+			return False
+
+		return True
+
+	def getItem(self, index):
+		return self.sourceModel().getItem( self.mapToSource(index) )
+
+	def refreshItem(self, item):
+		self.sourceModel().refreshItem(item)
+
+	def cancelPopulate(self, index):
+		self.sourceModel().cancelPopulate( self.mapToSource(index) )
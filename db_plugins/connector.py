@@ -27,17 +27,415 @@ from qgis.core import QgsDataSourceURI
 
 from .plugin import DbError, ConnectionError
 
-class DBConnector:
+import thread, threading, time
+
+
+class DBConnectionPool:
+	""" pool of database connections.
+		Connections are created by 'factory' when needed, up to 'maxsize'.
+		A connection is validated by 'check' before being leased, and the idle
+		ones exceeding 'minsize' are closed after 'idletimeout' seconds.
+		A lease waits up to 'timeout' seconds for a connection to be released
+		when the pool is full. """
+
+	def __init__(self, factory, check=None, minsize=1, maxsize=5, idletimeout=300, timeout=30):
+		self.factory = factory
+		self.check = check
+		self.minsize = max(0, minsize)
+		self.maxsize = max(1, maxsize, self.minsize)
+		self.idletimeout = idletimeout
+		self.timeout = timeout
+
+		self._idle = []		# list of (connection, time of release)
+		self._leased = {}	# leased connection id -> pool generation
+		self._pending = 0	# connections being opened
+		self._generation = 0
+		self._cond = threading.Condition()
+
+	def __del__(self):
+		self.closeAll()
+
+	def size(self):
+		return len(self._idle) + len(self._leased) + self._pending
+
+	def acquire(self, timeout=None):
+		""" lease a connection, wait until one is released if the pool is full.
+			Raise ConnectionError if none is released within 'timeout' seconds
+			(the pool timeout by default) """
+		if timeout == None:
+			timeout = self.timeout
+		self._cond.acquire()
+		try:
+			deadline = time.time() + timeout
+			while True:
+				self._closeExpired()
+
+				while len(self._idle) > 0:
+					conn, released = self._idle.pop()
+					if self.check == None or self.check(conn):
+						self._leased[ id(conn) ] = self._generation
+						return conn
+					self._close(conn)
+
+				if len(self._leased) + self._pending < self.maxsize:
+					break
+
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					raise ConnectionError( u"no free connection in the pool (max %d)" % self.maxsize )
+				self._cond.wait(remaining)
+
+			# reserve the slot, then open the connection outside the lock
+			self._pending += 1
+		finally:
+			self._cond.release()
+
+		conn = None
+		try:
+			conn = self.factory()
+		finally:
+			self._cond.acquire()
+			try:
+				self._pending -= 1
+				if conn != None:
+					self._leased[ id(conn) ] = self._generation
+				self._cond.notify()
+			finally:
+				self._cond.release()
+
+		return conn
+
+	def release(self, conn, discard=False):
+		""" give back a leased connection, close it if it's broken or stale """
+		self._cond.acquire()
+		try:
+			generation = self._leased.pop( id(conn), None )
+			if discard or generation != self._generation:
+				self._close(conn)
+			else:
+				self._idle.append( (conn, time.time()) )
+			self._closeExpired()
+			self._cond.notify()
+		finally:
+			self._cond.release()
+
+	def clear(self):
+		""" close the idle connections, the leased ones will be closed when released """
+		self._cond.acquire()
+		try:
+			self._generation += 1
+			for conn, released in self._idle:
+				self._close(conn)
+			self._idle = []
+			self._cond.notifyAll()
+		finally:
+			self._cond.release()
+
+	def closeAll(self):
+		self.clear()
+
+	def _closeExpired(self):
+		if self.idletimeout == None or self.idletimeout < 0:
+			return
+		now = time.time()
+		# the most recently released connections are at the end of the list
+		while len(self._idle) + len(self._leased) > self.minsize and len(self._idle) > 0:
+			conn, released = self._idle[0]
+			if now - released < self.idletimeout:
+				break
+			del self._idle[0]
+			self._close(conn)
+
+	def _close(self, conn):
+		try:
+			conn.close()
+		except Exception:
+			pass
+
+
+class DBMetadataCache:
+	""" cache of the table metadata (fields, indexes, constraints, ...).
+		Rows are stored by table (schema, name) and kind, they expire after
+		'ttl' seconds; a 'ttl' of 0 disables the cache. """
+
+	def __init__(self, ttl=300):
+		self.ttl = ttl
+		self._tables = {}	# (schema, table) -> { kind: (time, rows) }
+		self._prefetched = {}	# schema -> time of the metadata prefetch
+		self._lock = threading.Lock()
+
+	def _key(self, table):
+		schema, name = DBConnector.getSchemaTableName(table)
+		return (unicode(schema) if schema != None else None, unicode(name))
+
+	def get(self, table, kind):
+		""" return the cached rows or None if they're not cached or expired """
+		if self.ttl <= 0:
+			return None
+		self._lock.acquire()
+		try:
+			entry = self._tables.get( self._key(table), {} ).get( kind )
+			if entry == None or time.time() - entry[0] > self.ttl:
+				return None
+			return entry[1]
+		finally:
+			self._lock.release()
+
+	def put(self, table, kind, rows):
+		if self.ttl <= 0:
+			return
+		self._lock.acquire()
+		try:
+			self._tables.setdefault( self._key(table), {} )[ kind ] = (time.time(), rows)
+		finally:
+			self._lock.release()
+
+	def invalidate(self, table=None, kind=None):
+		""" drop the cached metadata of a table (only of one kind if specified),
+			or all the cached metadata if table is None """
+		self._lock.acquire()
+		try:
+			if table == None:
+				self._tables.clear()
+				self._prefetched.clear()
+			elif kind == None:
+				self._tables.pop( self._key(table), None )
+			else:
+				self._tables.get( self._key(table), {} ).pop( kind, None )
+		finally:
+			self._lock.release()
+
+	def invalidateSchema(self, schema):
+		""" drop the cached metadata of all the tables in a schema """
+		schema = unicode(schema) if schema != None else None
+		self._lock.acquire()
+		try:
+			for key in self._tables.keys():
+				if key[0] == schema:
+					del self._tables[ key ]
+			self._prefetched.pop( schema, None )
+		finally:
+			self._lock.release()
+
+	def isPrefetched(self, schema):
+		""" return whether the metadata of all the tables in the schema
+			were read recently (see DBConnector.prefetchTablesMetadata) """
+		if self.ttl <= 0:
+			return False
+		schema = unicode(schema) if schema != None else None
+		fetchtime = self._prefetched.get( schema )
+		return fetchtime != None and time.time() - fetchtime <= self.ttl
+
+	def setPrefetched(self, schema):
+		schema = unicode(schema) if schema != None else None
+		self._prefetched[ schema ] = time.time()
+
+
+def cachedMetadata(kind):
+	""" decorator for the connector methods returning metadata of a table,
+		the returned rows are stored in the metadata cache """
+	def decorator(method):
+		def wrapper(self, table):
+			rows = self.metadataCache.get(table, kind)
+			if rows == None:
+				rows = method(self, table)
+				if rows != None:
+					self.metadataCache.put(table, kind, rows)
+			return rows
+		wrapper.__name__ = method.__name__
+		wrapper.__doc__ = method.__doc__
+		return wrapper
+	return decorator
+
+def invalidatesMetadata(method):
+	""" decorator for the connector methods changing the structure of the
+		table passed as first argument, its cached metadata are dropped """
+	def wrapper(self, table, *args, **kwargs):
+		try:
+			return method(self, table, *args, **kwargs)
+		finally:
+			self.metadataCache.invalidate(table)
+	wrapper.__name__ = method.__name__
+	wrapper.__doc__ = method.__doc__
+	return wrapper
+
+
+class DBConnector(object):
 	def __init__(self, uri):
-		self.connection = None
+		self._connection = None
 		self._uri = uri
 
+		# connection pool (see _createPool), None means one connection only
+		self.pool = None
+		self._threadConnections = {}
+		self._guiThread = thread.get_ident()
+
+		settings = QSettings()
+		ttl = settings.value("/DB_Manager/metadataCache/ttl", 300).toInt()[0]
+		self.metadataCache = DBMetadataCache( ttl )
+		# larger schemas aren't prefetched, see prefetchSchemaMetadata()
+		self.prefetchMaxTables = settings.value("/DB_Manager/metadataCache/prefetchMaxTables", 500).toInt()[0]
+
 	def __del__(self):
 		pass	#print "DBConnector.__del__", self._uri.connectionInfo()
-		if self.connection != None: 
-			self.connection.close()
-		self.connection = None
+		if self.pool != None:
+			for conn in self._threadConnections.values():
+				self.pool.release( conn, True )
+			self._threadConnections = {}
+			self.pool.closeAll()
+			self.pool = None
+
+		if self._connection != None: 
+			self._connection.close()
+		self._connection = None
+
+
+	def _getConnection(self):
+		if self.pool == None:
+			# a thread can use its own connection, see bindThreadConnection()
+			return self._threadConnections.get( thread.get_ident(), self._connection )
+
+		# in pooled mode every thread leases its own connection, so a long
+		# running query doesn't block the queries run by the other threads
+		tid = thread.get_ident()
+		conn = self._threadConnections.get( tid )
+		if conn != None:
+			return conn
+		if tid == self._guiThread:
+			# the GUI thread has a connection of its own, out of the pool,
+			# so it never waits for the connections leased by the tasks
+			if self._connection == None:
+				self._connection = self._connect()
+			return self._connection
+		conn = self.pool.acquire()
+		self._threadConnections[ tid ] = conn
+		return conn
+
+	def _setConnection(self, conn):
+		self._connection = conn
+
+	connection = property(_getConnection, _setConnection)
+
+	def _connect(self):
+		""" open and return a new connection to the database """
+		raise Exception("DBConnector._connect() is an abstract method")
+
+	def _checkConnection(self, conn):
+		""" return whether the connection can be still used """
+		return True
+
+	def _createPool(self):
+		""" switch to the pooled mode if enabled in settings """
+		settings = QSettings()
+		settings.beginGroup( "/DB_Manager/connectionPool" )
+		enabled = settings.value( "enabled", True ).toBool()
+		minsize = settings.value( "minSize", 1 ).toInt()[0]
+		maxsize = settings.value( "maxSize", 5 ).toInt()[0]
+		idletimeout = settings.value( "idleTimeout", 300 ).toInt()[0]
+		timeout = settings.value( "timeout", 30 ).toInt()[0]
+		settings.endGroup()
+
+		if not enabled:
+			self.connection = self._connect()
+			return False
+
+		self.pool = DBConnectionPool( self._connect, self._checkConnection, minsize, maxsize, idletimeout, timeout )
+		self._guiThread = thread.get_ident()
+		self._getConnection()	# open the GUI thread connection, fail early on errors
+		return True
+
+	def isPooled(self):
+		return self.pool != None
+
+	def releaseThreadConnection(self):
+		""" give back to the pool the connection leased by the current thread """
+		if self.pool == None:
+			return
+		conn = self._threadConnections.pop( thread.get_ident(), None )
+		if conn == None:
+			return
+
+		discard = False
+		try:
+			# don't keep transactions opened on idle connections
+			conn.rollback()
+		except self.error_types(), e:
+			discard = True
+		self.pool.release( conn, discard )
+
+	def leaseConnection(self, timeout=None):
+		""" get a connection reserved to the caller until releaseConnection()
+			is called. It's a new connection if not in pooled mode, the only
+			one is left to the GUI thread. In pooled mode wait up to 'timeout'
+			seconds (the pool timeout by default) for a free connection """
+		if self.pool == None:
+			return self._connect()
+		return self.pool.acquire(timeout)
+
+	def releaseConnection(self, conn):
+		if conn == None:
+			return
+		if self.pool == None:
+			if conn != self._connection:
+				try:
+					conn.close()
+				except self.error_types(), e:
+					pass
+			return
+		discard = False
+		try:
+			conn.rollback()
+		except self.error_types(), e:
+			discard = True
+		self.pool.release( conn, discard )
+
+	def bindThreadConnection(self, conn):
+		""" make the current thread use a connection got by leaseConnection()
+			(or a new one opened by _connect) """
+		self.releaseThreadConnection()
+		self._threadConnections[ thread.get_ident() ] = conn
+
+	def unbindThreadConnection(self):
+		""" stop using the bound connection in the current thread, without releasing it """
+		self._threadConnections.pop( thread.get_ident(), None )
+
+	def resetPool(self):
+		""" drop all the pooled connections, new ones will be opened on demand """
+		if self.pool == None:
+			return False
+		self.releaseThreadConnection()
+		self.pool.clear()
+		if self._connection != None:
+			# the GUI thread connection is opened again on demand too
+			try:
+				self._connection.close()
+			except self.error_types(), e:
+				pass
+			self._connection = None
+		return True
+
+
+	def prefetchTablesMetadata(self, schema=None):
+		""" read by few queries the metadata of all the tables in the schema
+			and store them in the metadata cache. Return False if it's not
+			supported, so the metadata are read table by table """
+		return False
 
+	def prefetchSchemaMetadata(self, schema=None, tableCount=None):
+		""" prefetch the metadata of the tables in the schema unless they were
+			prefetched recently or the schema has more than prefetchMaxTables
+			tables. It reads the whole schema catalog, call it from a task
+			running in background. Return whether they were prefetched """
+		if self.metadataCache.ttl <= 0 or self.metadataCache.isPrefetched(schema):
+			return False
+		if tableCount != None and tableCount > self.prefetchMaxTables:
+			return False
+		try:
+			ret = self.prefetchTablesMetadata(schema)
+		except DbError:
+			ret = False
+		self.metadataCache.setPrefetched(schema)
+		return ret
 
 	def uri(self):
 		return QgsDataSourceURI( self._uri.uri() )
@@ -60,6 +458,38 @@ class DBConnector:
 		return False
 
 
+	def getGeometryColumnType(self, table, geom_column):
+		""" return the geometry type name (e.g. 'MULTIPOLYGON') of the
+			column, None if it's unknown """
+		return None
+
+	# functions returning a geometry as WKT, GeoJSON or WKB
+	GEOMETRY_OUTPUT_FUNCTIONS = { 'wkt': 'ST_AsText', 'geojson': 'ST_AsGeoJSON', 'wkb': 'ST_AsBinary', 'transform': 'ST_Transform' }
+
+	def getQueryColumns(self, sql):
+		""" return the names of the columns returned by the query, without
+			reading its rows """
+		c = self._execute(None, u"SELECT * FROM (%s\n) AS _subq LIMIT 0" % sql)
+		columns = self._get_cursor_columns(c)
+		self._close_cursor(c)
+		self._commit()
+		return columns if columns != None else []
+
+	def iterQueryRows(self, sql, chunksize=1000):
+		""" run the query and yield its rows in chunks of chunksize rows,
+			so only a chunk is in memory at a time """
+		c = self._execute(self._get_cursor(), sql)
+		try:
+			while True:
+				rows = self._fetchmany(c, chunksize)
+				if len(rows) <= 0:
+					break
+				yield rows
+		finally:
+			self._close_cursor(c)
+			self._commit()
+
+
 	def execution_error_types(self):
 		raise Exception("DBConnector.execution_error_types() is an abstract method")
 
@@ -130,6 +560,18 @@ class DBConnector:
 			self._rollback()
 			raise DbError(e)
 
+	def _fetchmany(self, c, size):
+		try:
+			return c.fetchmany(size)
+
+		except self.connection_error_types(), e:
+			raise ConnectionError(e)
+
+		except self.execution_error_types(), e:
+			# do the rollback to avoid a "current transaction aborted, commands ignored" errors
+			self._rollback( c.connection )
+			raise DbError(e)
+
 	def _fetchone(self, c):
 		try:
 			return c.fetchone()
@@ -143,32 +585,47 @@ class DBConnector:
 			raise DbError(e)
 
 
-	def _commit(self):
+	def _commit(self, connection=None):
+		if connection == None:
+			connection = self.connection
 		try:
-			self.connection.commit()
+			connection.commit()
 
 		except self.connection_error_types(), e:
 			raise ConnectionError(e)
 
 		except self.execution_error_types(), e:
 			# do the rollback to avoid a "current transaction aborted, commands ignored" errors
-			self._rollback()
+			self._rollback(connection)
 			raise DbError(e)
 
 
-	def _rollback(self):
+	def _rollback(self, connection=None):
+		if connection == None:
+			connection = self.connection
 		try:
-			self.connection.rollback()
+			connection.rollback()
 
 		except self.connection_error_types(), e:
 			raise ConnectionError(e)
 
 		except self.execution_error_types(), e:
 			# do the rollback to avoid a "current transaction aborted, commands ignored" errors
-			self._rollback()
+			self._rollback(connection)
 			raise DbError(e)
 
 
+	def cancel(self, connection=None):
+		""" interrupt the query running on the connection """
+		return False
+
+	def setStatementTimeout(self, msecs):
+		""" abort the queries run by the current thread which take more than
+			msecs milliseconds, until the end of the transaction.
+			Return False if it's not supported """
+		return False
+
+
 	def _get_cursor_columns(self, c):
 		try:
 			if c.description:
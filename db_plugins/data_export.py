@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+Name                 : DB Manager
+Description          : Database manager plugin for QuantumGIS
+Date                 : May 23, 2011
+copyright            : (C) 2011 by Giuseppe Sucameli
+email                : brush.tyler@gmail.com
+
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from PyQt4.QtCore import *
+
+from .plugin import BaseError
+
+import csv
+import json
+
+class ExportCanceled(BaseError):
+	pass
+
+
+class DataExporter(QObject):
+	""" write the rows of a query to a file reading them in chunks, so that
+		the memory used doesn't grow with the number of rows.
+
+		Subclasses implement writeFile(). The "progress" signal is emitted
+		with the number of written rows after each chunk.
+	"""
+
+	# whether a geometry column must be set
+	REQUIRES_GEOMETRY = False
+
+	def __init__(self, db, sql, fileName, geomColumn=None, srid=-1):
+		QObject.__init__(self)
+		self.db = db
+		self.connector = db.connector
+		self.sql = unicode(sql).strip().rstrip(u";")	# it's used as subquery
+		self.fileName = unicode(fileName)
+		self.geomColumn = unicode(geomColumn) if geomColumn else None
+		self.srid = srid
+
+		settings = QSettings()
+		self.chunkSize = max(1, settings.value("/DB_Manager/export/chunkSize", 5000).toInt()[0])
+
+		self.exportedCount = 0
+		self._canceled = False
+
+	def cancel(self):
+		""" stop the export after the current chunk """
+		self._canceled = True
+
+	def isCanceled(self):
+		return self._canceled
+
+	def run(self):
+		""" export the rows, return their number. The file is removed
+			if the export fails or is canceled """
+		self.exportedCount = 0
+		try:
+			self.writeFile()
+
+		except ExportCanceled:
+			self._abort()
+
+		except (IOError, OSError), e:
+			self._abort()
+			raise BaseError( unicode(e) )
+
+		except:
+			self._abort()
+			raise
+
+		return self.exportedCount
+
+	def _abort(self):
+		try:
+			# the query may be still running
+			self.connector._rollback()
+		except BaseError:
+			pass
+		if QFile.exists(self.fileName):
+			QFile.remove(self.fileName)
+
+	def writeFile(self):
+		raise Exception("DataExporter.writeFile() is an abstract method")
+
+	def columns(self):
+		return self.connector.getQueryColumns(self.sql)
+
+	def selectSql(self, columns, geomOutput, outSrid=None):
+		""" return the query selecting the columns, the geometry column is
+			converted to the output format (e.g. 'wkt') and reprojected to
+			outSrid if set """
+		functions = self.connector.GEOMETRY_OUTPUT_FUNCTIONS
+		fields = []
+		for col in columns:
+			quoted = self.connector.quoteId(col)
+			if col == self.geomColumn:
+				geom = quoted
+				if outSrid != None and self.srid > 0 and self.srid != outSrid:
+					geom = u"%s(%s, %d)" % (functions['transform'], geom, outSrid)
+				fields.append( u"%s(%s) AS %s" % (functions[ geomOutput ], geom, quoted) )
+			else:
+				fields.append( quoted )
+		return u"SELECT %s FROM (%s\n) AS _subq" % (u", ".join(fields), self.sql)
+
+	def iterRows(self, sql):
+		""" yield the rows of the query, emit the progress after each chunk """
+		for rows in self.connector.iterQueryRows(sql, self.chunkSize):
+			if self._canceled:
+				raise ExportCanceled( u"export canceled" )
+			for row in rows:
+				yield row
+			self.exportedCount += len(rows)
+			self.emit( SIGNAL("progress"), self.exportedCount )
+
+	@classmethod
+	def textValue(self, value):
+		if value == None:
+			return u""
+		if isinstance(value, buffer):
+			return unicode(str(value).encode('hex'))
+		return unicode(value)
+
+
+class CsvExporter(DataExporter):
+	""" export to CSV with a header, the geometries are written as WKT """
+
+	def writeFile(self):
+		columns = self.columns()
+		sql = self.selectSql(columns, 'wkt')
+
+		f = open(self.fileName, 'wb')
+		try:
+			if hasattr(self.connector, 'copyTo'):
+				# let the server write the CSV
+				self.connector.copyTo( sql, _CopyProgressFile(self, f) )
+			else:
+				writer = csv.writer(f)
+				writer.writerow( map(lambda x: unicode(x).encode('utf-8'), columns) )
+				for row in self.iterRows(sql):
+					writer.writerow( map(lambda x: self.textValue(x).encode('utf-8'), row) )
+		finally:
+			f.close()
+
+class _CopyProgressFile:
+	""" file object passed to COPY TO STDOUT, it counts the written rows
+		and stops the copy if the export is canceled """
+
+	def __init__(self, exporter, f):
+		self.exporter = exporter
+		self.f = f
+		self._header = True
+		self._lastCount = 0
+
+	def write(self, data):
+		if self.exporter._canceled:
+			raise ExportCanceled( u"export canceled" )
+		self.f.write(data)
+
+		# COPY writes a row at a time, the first one is the header
+		if self._header:
+			self._header = False
+			return
+		self.exporter.exportedCount += 1
+		if self.exporter.exportedCount - self._lastCount >= self.exporter.chunkSize:
+			self._lastCount = self.exporter.exportedCount
+			self.exporter.emit( SIGNAL("progress"), self.exporter.exportedCount )
+
+
+class GeoJsonExporter(DataExporter):
+	""" export to a GeoJSON feature collection, the columns other than
+		the geometry one are the properties of the features. The geometries
+		are reprojected to WGS 84, the crs GeoJSON readers assume """
+
+	REQUIRES_GEOMETRY = True
+
+	def writeFile(self):
+		columns = self.columns()
+		sql = self.selectSql(columns, 'geojson', 4326)
+		geomIndex = columns.index(self.geomColumn) if self.geomColumn in columns else -1
+
+		f = open(self.fileName, 'wb')
+		try:
+			f.write('{"type": "FeatureCollection", "features": [\n')
+			first = True
+			for row in self.iterRows(sql):
+				props = {}
+				for i, value in enumerate(row):
+					if i != geomIndex:
+						props[ columns[i] ] = self.jsonValue(value)
+				geom = row[geomIndex] if geomIndex >= 0 and row[geomIndex] != None else 'null'
+				if not first:
+					f.write(',\n')
+				first = False
+				f.write( '{"type": "Feature", "geometry": %s, "properties": %s}' % (geom, json.dumps(props)) )
+			f.write('\n]}\n')
+		finally:
+			f.close()
+
+	@classmethod
+	def jsonValue(self, value):
+		if value == None or isinstance(value, (bool, int, long, float)):
+			return value
+		return self.textValue(value)
+
+
+class SpatiaLiteExporter(DataExporter):
+	""" export to a table of a new SpatiaLite database, named as the file """
+
+	def writeFile(self):
+		from pyspatialite import dbapi2 as sqlite
+
+		columns = self.columns()
+		sql = self.selectSql(columns, 'wkb')
+		fields = filter(lambda x: x != self.geomColumn, columns)
+		tableName = unicode(QFileInfo(self.fileName).completeBaseName())
+
+		if QFile.exists(self.fileName):
+			QFile.remove(self.fileName)
+		conn = sqlite.connect( self.fileName )
+		try:
+			c = conn.cursor()
+			quoteId = self.connector.quoteId
+			c.execute( u"SELECT InitSpatialMetadata()" )
+			c.execute( u"CREATE TABLE %s (%s)" % (quoteId(tableName), u", ".join( map(quoteId, fields) )) )
+			if self.geomColumn != None and self.geomColumn in columns:
+				c.execute( u"SELECT AddGeometryColumn(%s, %s, %d, 'GEOMETRY', 2)" % (self.connector.quoteString(tableName), self.connector.quoteString(self.geomColumn), self.srid) )
+
+			values = map(lambda x: u"GeomFromWKB(?, %d)" % self.srid if x == self.geomColumn else u"?", columns)
+			insert = u"INSERT INTO %s (%s) VALUES (%s)" % (quoteId(tableName), u", ".join( map(quoteId, columns) ), u", ".join( values ))
+
+			# insert the rows in chunks, all in one transaction
+			chunk = []
+			for row in self.iterRows(sql):
+				chunk.append( map(self.sqliteValue, row) )
+				if len(chunk) >= self.chunkSize:
+					c.executemany(insert, chunk)
+					chunk = []
+			if len(chunk) > 0:
+				c.executemany(insert, chunk)
+			conn.commit()
+
+		except sqlite.Error, e:
+			raise BaseError(e)
+
+		finally:
+			conn.close()
+
+	@classmethod
+	def sqliteValue(self, value):
+		if value == None or isinstance(value, (int, long, float, unicode, str, buffer)):
+			return value
+		return unicode(value)
+
+
+EXPORT_FORMATS = [
+	( "CSV", "*.csv", CsvExporter ),
+	( "GeoJSON", "*.geojson", GeoJsonExporter ),
+	( "SpatiaLite", "*.sqlite", SpatiaLiteExporter )
+]
@@ -0,0 +1,570 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+Name                 : DB Manager
+Description          : Database manager plugin for QuantumGIS
+Date                 : May 23, 2011
+copyright            : (C) 2011 by Giuseppe Sucameli
+email                : brush.tyler@gmail.com
+
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+from qgis.core import QGis, QgsFeature, QgsRectangle, QgsCoordinateTransform, QgsVectorLayer
+
+from .plugin import BaseError
+
+import time
+import hashlib
+import struct
+
+class VectorLayerImporter(QObject):
+	""" import the features of a vector layer into a table, loading them
+		by batches (a transaction each) instead of inserting them one at a
+		time as QgsVectorLayerImport does. The primary key and the spatial
+		index are created once the features are loaded.
+
+		Subclasses implement writeRows() to bulk load a batch of rows.
+		Each batch is committed unless COMMIT_EVERY_BATCH is False, then
+		the whole load is one transaction and it's rolled back if the
+		import fails or is canceled. A table created by the import is
+		dropped when none of the loaded features is kept.
+
+		After each committed batch a checkpoint (the last imported feature id
+		and the number of imported features) is stored in the settings, so
+		a failed or canceled import can be resumed by setResume(True).
+		That's done only for the layers read by OGR, which returns the
+		features by increasing id.
+		The "progress" signal is emitted after each batch with the number
+		of imported features and the features imported per second.
+	"""
+
+	# geometry type names and dimensions by QGis wkb type
+	GEOMETRY_TYPES = {
+		QGis.WKBPoint: ('POINT', 2),
+		QGis.WKBLineString: ('LINESTRING', 2),
+		QGis.WKBPolygon: ('POLYGON', 2),
+		QGis.WKBMultiPoint: ('MULTIPOINT', 2),
+		QGis.WKBMultiLineString: ('MULTILINESTRING', 2),
+		QGis.WKBMultiPolygon: ('MULTIPOLYGON', 2),
+		QGis.WKBPoint25D: ('POINT', 3),
+		QGis.WKBLineString25D: ('LINESTRING', 3),
+		QGis.WKBPolygon25D: ('POLYGON', 3),
+		QGis.WKBMultiPoint25D: ('MULTIPOINT', 3),
+		QGis.WKBMultiLineString25D: ('MULTILINESTRING', 3),
+		QGis.WKBMultiPolygon25D: ('MULTIPOLYGON', 3)
+	}
+
+	# geometry types of the features, by multi-part type
+	SINGLE_PART_TYPES = { 'MULTIPOINT': 'POINT', 'MULTILINESTRING': 'LINESTRING', 'MULTIPOLYGON': 'POLYGON' }
+
+	COMMIT_EVERY_BATCH = True
+	# whether many layers can be loaded at the same time into the db
+	PARALLEL_LOAD = True
+	# whether the primary key is added after the load or created with the table
+	PRIMARY_KEY_AFTER_LOAD = True
+
+	def __init__(self, db, layer, table, geomColumn=None, pkColumn=None, outCrs=None, createTable=True, overwrite=False, spatialIndex=False):
+		QObject.__init__(self)
+		self.db = db
+		self.connector = db.connector
+		self.layer = layer
+		self.table = table	# (schema, name)
+		self.geomColumn = unicode(geomColumn) if geomColumn and layer.hasGeometryType() else None
+		self.pkColumn = unicode(pkColumn) if pkColumn else None
+		self.createTable = createTable
+		self.overwrite = overwrite
+		self.spatialIndex = spatialIndex
+
+		# reproject the geometries if the output crs differs from the layer one
+		self.transform = None
+		crs = layer.crs()
+		if outCrs != None and outCrs.isValid():
+			if crs.isValid() and outCrs.srsid() != crs.srsid():
+				self.transform = QgsCoordinateTransform(crs, outCrs)
+			crs = outCrs
+		self.srid = crs.postgisSrid() if crs.isValid() else -1
+
+		settings = QSettings()
+		self.batchSize = settings.value("/DB_Manager/import/batchSize", 5000).toInt()[0]
+
+		self.columns = []	# columns of the rows passed to writeRows()
+		self._attrIndexes = []	# layer attributes written, in the order of the columns
+		self._writeFeatureId = False	# whether the first column is the feature id
+
+		self.singlePart = False
+		self._geometryParts = None	# 'multi' or 'single' to convert the geometries to
+
+		self.resume = False
+		self.importedCount = 0
+		self._loadedCount = 0	# features loaded by this run
+		self._committedCount = 0	# features loaded by this run and committed
+		self._canceled = False
+
+	def cancel(self):
+		""" stop the import after the current batch, the batches
+			already committed are kept (see COMMIT_EVERY_BATCH) """
+		self._canceled = True
+
+	def isCanceled(self):
+		return self._canceled
+
+	def featureCount(self):
+		return self.layer.dataProvider().featureCount()
+
+	def setServerTransform(self, enable):
+		""" reproject the geometries by the database instead of doing it
+			here, return whether they will be. Not supported by default """
+		return False
+
+	def setSinglePart(self, singlePart):
+		""" create a single-part geometry column instead of a multi-part one,
+			the geometries can be both single and multi-part in a layer """
+		self.singlePart = singlePart
+
+	def setResume(self, resume):
+		""" load only the features after the checkpoint into the
+			existing table, see checkpoint() """
+		self.resume = resume and self.canResume()
+
+	def canResume(self):
+		""" return whether the import can be resumed, the features after the
+			checkpoint are found by their id so they must be read by
+			increasing id """
+		return self.layer.dataProvider().name() == "ogr"
+
+
+	def _checkpointKey(self):
+		ident = u"%s|%s|%s" % (self.db.publicUri().uri(), self.connector.quoteId(self.table), self.layer.source())
+		return u"/DB_Manager/import/checkpoints/%s" % hashlib.md5( ident.encode('utf-8') ).hexdigest()
+
+	def checkpoint(self):
+		""" return the (last feature id, imported features) of a previous
+			import of the layer into the table which didn't complete,
+			None if there's no such import """
+		if not self.canResume():
+			return None
+		settings = QSettings()
+		settings.beginGroup( self._checkpointKey() )
+		lastFeatureId, ok = settings.value("lastFeatureId").toLongLong()
+		if not ok:
+			return None
+		return (lastFeatureId, settings.value("count", 0).toInt()[0])
+
+	def saveCheckpoint(self, lastFeatureId):
+		settings = QSettings()
+		settings.beginGroup( self._checkpointKey() )
+		settings.setValue("table", self.connector.quoteId(self.table))
+		settings.setValue("source", self.layer.source())
+		settings.setValue("lastFeatureId", lastFeatureId)
+		settings.setValue("count", self.importedCount)
+
+	def clearCheckpoint(self):
+		settings = QSettings()
+		settings.remove( self._checkpointKey() )
+
+
+	def run(self):
+		""" import the layer, return the number of imported features """
+		provider = self.layer.dataProvider()
+		fields = provider.fields()
+
+		resumeFrom = self.checkpoint() if self.resume else None
+		if resumeFrom != None:
+			lastFeatureId, self.importedCount = resumeFrom
+		else:
+			lastFeatureId, self.importedCount = None, 0
+		self._loadedCount = 0
+		self._committedCount = 0
+
+		self.prepareTable( fields )
+		createdTable = self.createTable and not self.resume
+
+		provider.select( self._attrIndexes, QgsRectangle(), self.geomColumn != None )
+		loaded = False
+		self.beginLoad()
+		try:
+			start = time.time()
+			batch = []
+			f = QgsFeature()
+			while not self._canceled and provider.nextFeature(f):
+				# the features are read by increasing id (see canResume()),
+				# skip the ones loaded before the checkpoint
+				if lastFeatureId != None and f.id() <= lastFeatureId:
+					continue
+				batch.append( self.featureRow(f) )
+				if len(batch) >= self.batchSize:
+					self._writeBatch(batch, f.id(), start)
+					batch = []
+
+			if len(batch) > 0 and not self._canceled:
+				self._writeBatch(batch, f.id(), start)
+
+			if self._canceled and not self.COMMIT_EVERY_BATCH:
+				# don't keep a part of the single transaction
+				self.connector._rollback()
+			else:
+				self.connector._commit()
+				self._committedCount = self._loadedCount
+			loaded = True
+		finally:
+			self.endLoad()
+			if not loaded or self._canceled:
+				# the features not committed aren't in the table
+				self.importedCount -= self._loadedCount - self._committedCount
+				if createdTable and self._committedCount <= 0:
+					self.dropCreatedTable()
+
+		if not self._canceled:
+			self.finishTable()
+			self.clearCheckpoint()
+		return self.importedCount
+
+	def _writeBatch(self, rows, lastFeatureId, start):
+		self.writeRows(rows)
+		self.importedCount += len(rows)
+		self._loadedCount += len(rows)
+		if self.COMMIT_EVERY_BATCH:
+			self.connector._commit()
+			self._committedCount = self._loadedCount
+			if self.canResume():
+				self.saveCheckpoint( lastFeatureId )
+		rate = self._loadedCount / max(time.time() - start, 0.001)
+		self.emit( SIGNAL("progress"), self.importedCount, int(rate) )
+
+	def dropCreatedTable(self):
+		""" drop the table created by the import, nothing was loaded into it """
+		try:
+			self.connector._rollback()
+			self.connector.deleteTable(self.table)
+		except BaseError:
+			pass	# don't hide the error which stopped the import
+
+	def beginLoad(self):
+		""" called before loading the first batch """
+		pass
+
+	def endLoad(self):
+		""" called after the load, even if it failed """
+		pass
+
+	def writeRows(self, rows):
+		""" load the rows into the table, in the current transaction """
+		raise Exception("VectorLayerImporter.writeRows() is an abstract method")
+
+
+	def tableExists(self):
+		names = self.connector.getTableNames()
+		return self.connector.getSchemaTableName(self.table) in map(lambda x: (x[0], x[1]), names)
+
+	def prepareTable(self, fields):
+		""" create the table (unless appending to an existing one) and
+			set the columns the features will be written to """
+		self.columns = []
+		self._attrIndexes = []
+		self._writeFeatureId = False
+
+		if not self.createTable or self.resume:
+			# append to the existing table, only the common columns
+			existing = map(lambda x: unicode(x[1]), self.connector.getTableFields(self.table))
+			for idx in sorted( fields.keys() ):
+				name = unicode(fields[idx].name())
+				if name in existing:
+					self.columns.append( name )
+					self._attrIndexes.append( idx )
+			if self.resume and self.pkColumn in existing and self.pkColumn not in self.columns:
+				# the primary key created by the import is filled with the features ids
+				self.columns.insert( 0, self.pkColumn )
+				self._writeFeatureId = True
+			if self.geomColumn != None:
+				self.columns.append( self.geomColumn )
+				self._geometryParts = self.geometryParts( self.connector.getGeometryColumnType(self.table, self.geomColumn) )
+			return
+
+		if self.overwrite and self.tableExists():
+			self.connector.deleteTable(self.table)
+
+		field_defs = []
+		for idx in sorted( fields.keys() ):
+			name = unicode(fields[idx].name())
+			field_defs.append( u"%s %s" % (self.connector.quoteId(name), self.fieldType(fields[idx])) )
+			self.columns.append( name )
+			self._attrIndexes.append( idx )
+
+		if self.pkColumn != None and self.pkColumn not in self.columns:
+			# the features ids are the values of the new primary key column
+			field_defs.insert( 0, u"%s %s" % (self.connector.quoteId(self.pkColumn), self.pkType()) )
+			self.columns.insert( 0, self.pkColumn )
+			self._writeFeatureId = True
+
+		# the primary key is usually added after the load, see finishTable()
+		pkey = self.pkColumn if not self.PRIMARY_KEY_AFTER_LOAD else None
+		self.connector.createTable(self.table, field_defs, pkey)
+
+		if self.geomColumn != None:
+			geomType, dim = self.GEOMETRY_TYPES.get( self.layer.wkbType(), ('GEOMETRY', 2) )
+			if geomType != 'GEOMETRY':
+				# like QgsVectorLayerImport, a layer (e.g. a shapefile) can mix
+				# single and multi-part geometries
+				singleType = self.SINGLE_PART_TYPES.get( geomType, geomType )
+				geomType = singleType if self.singlePart else u"MULTI%s" % singleType
+			self._geometryParts = self.geometryParts( geomType )
+			self.connector.addGeometryColumn(self.table, self.geomColumn, geomType, self.srid, dim)
+			self.columns.append( self.geomColumn )
+
+	def finishTable(self):
+		""" create the primary key and the spatial index on the loaded table """
+		if self.createTable and self.pkColumn != None and self.PRIMARY_KEY_AFTER_LOAD:
+			self.connector.addTablePrimaryKey(self.table, self.pkColumn)
+		if self.spatialIndex and self.geomColumn != None:
+			self.connector.createSpatialIndex(self.table, self.geomColumn)
+
+
+	def fieldType(self, fld):
+		""" return the type of the column for a layer field """
+		fldType = fld.type()
+		if fldType == QVariant.Int:
+			return u"integer"
+		if fldType == QVariant.LongLong:
+			return u"bigint"
+		if fldType == QVariant.Double:
+			return u"double precision"
+		if fldType == QVariant.Date:
+			return u"date"
+		if fldType == QVariant.DateTime:
+			return u"timestamp"
+		if fld.length() > 0:
+			return u"varchar(%d)" % fld.length()
+		return u"text"
+
+	def pkType(self):
+		return u"integer"
+
+	def featureRow(self, f):
+		""" return the values to write for a feature """
+		attrs = f.attributeMap()
+		row = [ f.id() ] if self._writeFeatureId else []
+		for idx in self._attrIndexes:
+			row.append( self.attributeValue( attrs.get(idx, QVariant()) ) )
+		if self.geomColumn != None:
+			row.append( self.geometryValue( f.geometry() ) )
+		return row
+
+	def attributeValue(self, value):
+		if value.isNull():
+			return None
+		valueType = value.type()
+		if valueType == QVariant.Int:
+			return value.toInt()[0]
+		if valueType == QVariant.LongLong:
+			return value.toLongLong()[0]
+		if valueType == QVariant.Double:
+			return value.toDouble()[0]
+		return unicode(value.toString())
+
+	def geometryValue(self, geom):
+		""" return the WKB of the geometry (reprojected if needed), as a
+			single or multi-part geometry like the column """
+		if geom == None:
+			return None
+		if self.transform != None:
+			geom.transform(self.transform)
+		wkb = geom.asWkb()
+		if hasattr(wkb, 'asstring'):	# sip.voidptr
+			wkb = wkb.asstring( geom.wkbSize() )
+		return self.convertWkbParts( str(wkb) )
+
+	@classmethod
+	def geometryParts(self, geomType):
+		""" return whether the geometries loaded into a column of the type
+			must be 'multi' or 'single' part, None if any geometry fits """
+		if geomType == None:
+			return None
+		geomType = unicode(geomType).upper().rstrip('ZM')
+		if geomType in self.SINGLE_PART_TYPES:
+			return 'multi'
+		if geomType in self.SINGLE_PART_TYPES.values():
+			return 'single'
+		return None
+
+	def convertWkbParts(self, wkb):
+		""" return the WKB as a multi-part geometry or, if it has one part
+			only, as a single-part one according to the geometry column """
+		if self._geometryParts == None or len(wkb) < 9:
+			return wkb
+		order = '<' if ord(wkb[0]) == 1 else '>'
+		wkbType = struct.unpack(order + 'I', wkb[1:5])[0]
+		baseType = wkbType & 0x0fffffff	# without the 2.5D flag
+		if self._geometryParts == 'multi' and baseType in (1, 2, 3):
+			# a collection of one geometry: the multi type, the number of parts, the part
+			return wkb[0] + struct.pack(order + 'II', wkbType + 3, 1) + wkb
+		if self._geometryParts == 'single' and baseType in (4, 5, 6):
+			if struct.unpack(order + 'I', wkb[5:9])[0] == 1:
+				return wkb[9:]
+		return wkb
+
+
+class BatchImporter(QObject):
+	""" import many vector files into a schema, running up to maxWorkers
+		imports at a time, each one in a thread with its own connection.
+		Every file is loaded into the table named as the file.
+
+		The "fileStarted" signal is emitted with the file name and the table
+		when an import starts, "fileProgress" with the file name, the imported
+		features and the features per second after each batch, "fileFinished"
+		with the file name, the imported features, the features per second and
+		the error message (None if it succeeded). "finished" is emitted when
+		all the files are imported.
+	"""
+
+	MAX_WORKERS = 16
+
+	def __init__(self, db, files, schema=None, geomColumn=None, pkColumn=None, sourceCrs=None, outCrs=None, encoding=None, createTable=True, overwrite=False, spatialIndex=False, maxWorkers=None, parent=None):
+		QObject.__init__(self, parent)
+		self.db = db
+		self.files = map(unicode, files)
+		self.schema = schema
+		self.geomColumn = geomColumn
+		self.pkColumn = pkColumn
+		self.sourceCrs = sourceCrs
+		self.outCrs = outCrs
+		self.encoding = encoding
+		self.createTable = createTable
+		self.overwrite = overwrite
+		self.spatialIndex = spatialIndex
+
+		if maxWorkers == None:
+			settings = QSettings()
+			maxWorkers = settings.value("/DB_Manager/import/maxWorkers", 4).toInt()[0]
+		self.maxWorkers = max( min(maxWorkers, self.workersLimit(db)), 1 )
+
+		self.serverTransform = False	# see VectorLayerImporter.setServerTransform()
+		self.singlePart = False	# see VectorLayerImporter.setSinglePart()
+
+		self._pending = []
+		self._tasks = {}	# importer: (task, file name, layer)
+		self._results = []	# (file name, table, features, features per second, error)
+		self._canceled = False
+
+	@classmethod
+	def workersLimit(self, db):
+		""" return how many imports can run at a time. In pooled mode every
+			import leases a connection, one is left to the other tasks """
+		if db.connector.isPooled():
+			return max( min(db.connector.pool.maxsize - 1, self.MAX_WORKERS), 1 )
+		return self.MAX_WORKERS
+
+	@classmethod
+	def tableName(self, fileName):
+		""" return the name of the table a file is imported into """
+		return unicode(QFileInfo(fileName).completeBaseName()).lower()
+
+	@classmethod
+	def duplicateTableNames(self, files):
+		""" return the table names which more than one of the files
+			would be imported into """
+		tables = {}	# table: number of files
+		for fileName in files:
+			table = self.tableName(fileName)
+			tables[ table ] = tables.get(table, 0) + 1
+		return sorted( filter(lambda x: tables[x] > 1, tables.keys()) )
+
+	def start(self):
+		""" start the import, the files must be imported into different tables """
+		duplicates = self.duplicateTableNames(self.files)
+		if len(duplicates) > 0:
+			raise BaseError( u"more files would be imported into the table(s): %s" % u", ".join(duplicates) )
+		self._pending = list(self.files)
+		self._results = []
+		self._canceled = False
+		self._startNext()
+
+	def cancel(self):
+		""" skip the files not imported yet and stop the running imports """
+		self._canceled = True
+		self._pending = []
+		for task, fileName, layer in self._tasks.values():
+			task.cancel()
+
+	def isRunning(self):
+		return len(self._tasks) > 0
+
+	def results(self):
+		return self._results
+
+	def _startNext(self):
+		while len(self._pending) > 0 and len(self._tasks) < self.maxWorkers:
+			fileName = self._pending.pop(0)
+			table = (self.schema, self.tableName(fileName))
+
+			layer = QgsVectorLayer(fileName, table[1], "ogr")
+			if not layer.isValid():
+				layer.deleteLater()
+				self._fileFinished(fileName, table, 0, 0, u"invalid vector layer")
+				continue
+			if self.sourceCrs != None:
+				layer.setCrs( self.sourceCrs )
+			if self.encoding != None:
+				layer.setProviderEncoding( self.encoding )
+
+			importer = self.db.vectorLayerImporter( layer, table, self.geomColumn, self.pkColumn, self.outCrs, self.createTable, self.overwrite, self.spatialIndex )
+			if importer == None:
+				layer.deleteLater()
+				self._fileFinished(fileName, table, 0, 0, u"bulk import not supported by the database")
+				continue
+			if not importer.PARALLEL_LOAD:
+				self.maxWorkers = 1
+			if self.serverTransform:
+				importer.setServerTransform( True )
+			importer.setSinglePart( self.singlePart )
+
+			from .tasks import ImportTask
+			task = ImportTask(self.db, importer)
+			self.connect(importer, SIGNAL("progress"), self._importProgress)
+			self.connect(task, SIGNAL("finished()"), self._taskFinished)
+			self._tasks[ importer ] = (task, fileName, layer)
+			self.emit( SIGNAL("fileStarted"), fileName, table )
+			task.start()
+
+		if len(self._tasks) <= 0:
+			self.emit( SIGNAL("finished") )
+
+	def _importProgress(self, count, rowsPerSec):
+		entry = self._tasks.get( self.sender() )
+		if entry != None:
+			self.emit( SIGNAL("fileProgress"), entry[1], count, rowsPerSec )
+
+	def _taskFinished(self):
+		task = self.sender()
+		importer = task.importer
+		task, fileName, layer = self._tasks.pop( importer )
+		task.deleteLater()
+		layer.deleteLater()
+
+		count = importer.importedCount
+		rate = int( count / max(task.elapsed(), 0.001) )
+		if task.error() != None:
+			error = unicode(task.error())
+		elif importer.isCanceled():
+			error = u"canceled"
+		else:
+			error = None
+		self._fileFinished(fileName, importer.table, count, rate, error)
+		self._startNext()
+
+	def _fileFinished(self, fileName, table, count, rowsPerSec, error):
+		self._results.append( (fileName, table, count, rowsPerSec, error) )
+		self.emit( SIGNAL("fileFinished"), fileName, count, rowsPerSec, error )
@@ -24,6 +24,9 @@ from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
 from .plugin import DbError
+from .tasks import DbTask
+
+from collections import OrderedDict
 
 class BaseTableModel(QAbstractTableModel):
 	def __init__(self, header=None, data=None, parent=None):
@@ -89,6 +92,11 @@ class BaseTableModel(QAbstractTableModel):
 
 
 class TableDataModel(BaseTableModel):
+	""" model for the table contents.
+		Rows are read in blocks of fixed size by fetchMoreData(), the most
+		recently used blocks are kept in a cache whose size is limited by
+		the settings, so scrolling back doesn't read the rows again """
+
 	def __init__(self, table, parent=None):
 		self.db = table.database().connector
 		self.table = table
@@ -101,60 +109,229 @@ class TableDataModel(BaseTableModel):
 		for fld in table.fields():
 			self.fields.append( self._sanitizeTableField(fld) )
 
-		self.fetchedCount = 201
-		self.fetchedFrom = -self.fetchedCount-1		# so the first call to getData will exec fetchMoreData(0)
+		settings = QSettings()
+		self.blockSize = max(1, settings.value("/DB_Manager/tableViewer/blockSize", 200).toInt()[0])
+		self.readAheadBlocks = max(1, settings.value("/DB_Manager/tableViewer/readAheadBlocks", 2).toInt()[0])
+		maxCachedRows = settings.value("/DB_Manager/tableViewer/maxCachedRows", 20000).toInt()[0]
+		self.maxCachedBlocks = max(self.readAheadBlocks + 1, maxCachedRows / self.blockSize)
+
+		self._blocks = OrderedDict()	# block index -> rows, least recently used first
+		self._lastBlock = None
+		self._rowCount = None	# rows shown, it's adjusted while reading when estimated
 
 	def _sanitizeTableField(self, field):
 		""" quote column names to avoid some problems (e.g. columns with upper case) """
 		return self.db.quoteId(field)
 
 	def getData(self, row, col):
-		if row < self.fetchedFrom or row >= self.fetchedFrom + self.fetchedCount:
-			margin = self.fetchedCount/2
-			start = self.rowCount() - margin if row + margin >= self.rowCount() else row - margin
-			if start < 0: start = 0
-			self.fetchMoreData(start)
-		return self.resdata[row-self.fetchedFrom][col]
-
-	def fetchMoreData(self, row_start):
-		pass
+		block = row / self.blockSize
+		rows = self._getBlock( block )
+		row -= block * self.blockSize
+		if row >= len(rows):
+			return None
+		return rows[row][col]
+
+	def _getBlock(self, block):
+		rows = self._blocks.pop( block, None )
+		if rows != None:
+			self._blocks[ block ] = rows	# now it's the most recently used
+			self._lastBlock = block
+			return rows
+
+		# read ahead when scrolling in the same direction
+		first = last = block
+		if self._lastBlock != None:
+			if block == self._lastBlock + 1:
+				last = block + self.readAheadBlocks - 1
+			elif block == self._lastBlock - 1:
+				first = max(0, block - self.readAheadBlocks + 1)
+		# don't read again the cached blocks
+		while first < block and self._blocks.has_key( first ):
+			first += 1
+		while last > block and self._blocks.has_key( last ):
+			last -= 1
+
+		data = self.fetchMoreData( first * self.blockSize, (last - first + 1) * self.blockSize )
+		if data == None:
+			data = []
+		if self.isRowCountEstimated():
+			self._checkRowCount( first * self.blockSize, (last - first + 1) * self.blockSize, len(data) )
+		for b in range(first, last+1):
+			start = (b - first) * self.blockSize
+			self._cacheBlock( b, data[ start : start + self.blockSize ] )
+
+		self._lastBlock = block
+		return self._blocks[ block ]
+
+	def _cacheBlock(self, block, rows):
+		self._blocks.pop( block, None )
+		self._blocks[ block ] = rows
+		while len(self._blocks) > self.maxCachedBlocks:
+			self._blocks.popitem( False )	# drop the least recently used
+
+	def clearCache(self):
+		self._blocks.clear()
+		self._lastBlock = None
+
+	def fetchMoreData(self, row_start, count):
+		""" return the rows in the range [row_start, row_start+count) """
+		return []
+
+	def isRowCountEstimated(self):
+		return self.table.rowCount == None and self.table.estimatedRowCount != None
+
+	def _checkRowCount(self, row_start, count, fetched):
+		""" fix the estimated row count using the number of rows read """
+		rows = self.rowCount()
+		if fetched < count and (fetched > 0 or row_start == 0):
+			rows = row_start + fetched	# the last row was read
+		elif fetched == 0:
+			rows = min(rows, row_start)	# there's no row from row_start onwards
+		elif row_start + fetched >= rows:
+			rows = row_start + fetched + self.blockSize	# there're more rows than estimated
+
+		if rows != self.rowCount():
+			# don't change the model while the view is asking for data
+			self._newRowCount = rows
+			QTimer.singleShot(0, self._updateRowCount)
+
+	def _updateRowCount(self):
+		prev, rows = self.rowCount(), self._newRowCount
+		if rows > prev:
+			self.beginInsertRows(QModelIndex(), prev, rows-1)
+			self._rowCount = rows
+			self.endInsertRows()
+		elif rows < prev:
+			self.beginRemoveRows(QModelIndex(), rows, prev-1)
+			self._rowCount = rows
+			self.endRemoveRows()
 
 	def rowCount(self, index=None):
 		# case for tables with no columns ... any reason to use them? :-)
-		return self.table.rowCount if self.table.rowCount != None and self.columnCount(index) > 0 else 0
+		if self.columnCount(index) <= 0:
+			return 0
+		if self._rowCount == None:
+			if self.table.rowCount != None:
+				return self.table.rowCount
+			# use the estimation until the rows are counted
+			return max(0, self.table.estimatedRowCount) if self.table.estimatedRowCount != None else 0
+		return self._rowCount
+
+	def headerData(self, section, orientation, role):
+		if role == Qt.DisplayRole and orientation == Qt.Vertical and \
+				section == self.rowCount()-1 and self.isRowCountEstimated():
+			# the number of rows is an estimation
+			return QVariant( u"~%d" % (section+1) )
+		return BaseTableModel.headerData(self, section, orientation, role)
 
 
 class SqlResultModel(BaseTableModel):
+	""" model for the results of a query.
+		Rows are fetched in batches when the view needs them (see fetchMore),
+		up to the maximum number of rows set in the settings """
+
 	def __init__(self, db, sql, parent=None):
 		self.db = db.connector
+		self.cursor = None
+		# the connection running the query, it can be different from the
+		# connection of the thread using the model (i.e. in pooled mode)
+		self.connection = self.db.connection
+
+		settings = QSettings()
+		self.fetchSize = max(1, settings.value("/DB_Manager/sqlWindow/fetchSize", 1000).toInt()[0])
+		self.maxRows = settings.value("/DB_Manager/sqlWindow/maxRows", 500000).toInt()[0]
 
 		t = QTime()
 		t.start()
-		c = self.db._execute(None, unicode(sql))
-		self._secs = t.elapsed() / 1000.0
-		del t
+		c = self._createCursor( unicode(sql) )
 
 		self._affectedRows = 0
+		self._truncated = False
+		self._fetchError = None
 		data = []
+		if self._hasResultRows(c):
+			try:
+				# errors raised running the query (e.g. a division by zero)
+				# can show up here, with server-side cursors
+				data = self.db._fetchmany(c, self.fetchSize)
+			except DbError:
+				self.db._close_cursor(c)
+				raise
 		header = self.db._get_cursor_columns(c)
 		if header == None:
 			header = []
+		self._secs = t.elapsed() / 1000.0
+		del t
 
-		try:
-			if len(header) > 0:
-				data = self.db._fetchall(c)
-			self._affectedRows = c.rowcount
-		except DbError:
-			# nothing to fetch!
-			data = []
-			header = []
+		BaseTableModel.__init__(self, header, data if len(header) > 0 else None, parent)
 
-		BaseTableModel.__init__(self, header, data, parent)
+		if len(header) > 0 and len(data) >= self.fetchSize:
+			# more rows to fetch, keep the cursor (and the transaction) opened
+			self.cursor = c
+		else:
+			self._affectedRows = c.rowcount if len(header) <= 0 else len(self.resdata)
+			self._closeCursor(c)
 
+	def __del__(self):
+		self.close()
+
+	def _createCursor(self, sql):
+		return self.db._execute(None, sql)
+
+	def _hasResultRows(self, c):
+		""" whether the query returns rows """
+		header = self.db._get_cursor_columns(c)
+		return header != None and len(header) > 0
+
+	def _closeCursor(self, c):
 		# commit before closing the cursor to make sure that the changes are stored
-		self.db._commit()
-		c.close()
-		del c
+		try:
+			self.db._commit( self.connection )
+		finally:
+			self.db._close_cursor(c)
+
+	def close(self):
+		""" stop fetching rows, close the cursor and end the transaction """
+		if self.cursor == None:
+			return
+		c = self.cursor
+		self.cursor = None
+		self._closeCursor(c)
+
+	def canFetchMore(self, parent=None):
+		if parent != None and parent.isValid():
+			return False
+		return self.cursor != None
+
+	def fetchMore(self, parent=None):
+		if not self.canFetchMore(parent):
+			return
+
+		size = self.fetchSize
+		if self.maxRows > 0:
+			size = min(size, self.maxRows - len(self.resdata))
+
+		try:
+			rows = self.db._fetchmany(self.cursor, size) if size > 0 else []
+		except DbError, e:
+			# the rows fetched so far are kept
+			rows = []
+			self._fetchError = e
+			self.close()
+			self.emit( SIGNAL("fetchError"), e )
+
+		if len(rows) > 0:
+			self.beginInsertRows(QModelIndex(), len(self.resdata), len(self.resdata) + len(rows) - 1)
+			self.resdata.extend( rows )
+			self.endInsertRows()
+
+		if len(rows) < self.fetchSize:
+			# no more rows or too many rows in memory
+			self._truncated = self.maxRows > 0 and len(self.resdata) >= self.maxRows
+			self.close()
+
+		self._affectedRows = len(self.resdata)
+		self.emit( SIGNAL("rowsFetched"), len(self.resdata) )
 
 	def secs(self):
 		return self._secs
@@ -162,6 +339,34 @@ class SqlResultModel(BaseTableModel):
 	def affectedRows(self):
 		return self._affectedRows
 
+	def fetchedRows(self):
+		return len(self.resdata)
+
+	def hasMoreRows(self):
+		return self.cursor != None
+
+	def isTruncated(self):
+		""" whether the rows were not fetched all because of the memory limit """
+		return self._truncated
+
+	def fetchError(self):
+		""" the error which stopped fetching the rows, None if there was no error """
+		return self._fetchError
+
+
+class SqlQueryTask(DbTask):
+	""" build the result model of a query in a separate thread """
+
+	def __init__(self, db, sql, parent=None, connection=None):
+		DbTask.__init__(self, db, parent, connection)
+		self.sql = sql
+
+	def runTask(self):
+		model = self.db.sqlResultModel( self.sql, None )
+		# the model will be used by the GUI thread
+		model.moveToThread( QCoreApplication.instance().thread() )
+		return model
+
 
 
 class SimpleTableModel(QStandardItemModel):
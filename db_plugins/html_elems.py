@@ -23,22 +23,28 @@ email                : brush.tyler@gmail.com
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
+class HtmlWriter:
+	""" collect the html chunks in a list, they're joined once at the end """
+
+	def __init__(self):
+		self.chunks = []
+		self.write = self.chunks.append
+
+	def getvalue(self):
+		return u''.join( self.chunks )
+
+
 class HtmlContent:
 	def __init__(self, data):
 		self.data = data if not isinstance(data, HtmlContent) else data.data
 
 	def toHtml(self):
-		if isinstance(self.data, list) or isinstance(self.data, tuple):
-			html = u''
-			for item in self.data:
-				html += HtmlContent(item).toHtml()
-			return html
-
-		if hasattr(self.data, 'toHtml' ):
-			return self.data.toHtml()
+		writer = HtmlWriter()
+		self.writeHtml(writer)
+		return writer.getvalue()
 
-		html = unicode(self.data).replace("\n", "<br>")
-		return html
+	def writeHtml(self, writer):
+		writeHtmlData(writer, self.data)
 
 	def hasContents(self):
 		if isinstance(self.data, list) or isinstance(self.data, tuple):
@@ -54,6 +60,19 @@ class HtmlContent:
 
 		return len(self.data) > 0
 
+def writeHtmlData(writer, data):
+	""" write data (an element, a text or a list of them) to writer """
+	if isinstance(data, list) or isinstance(data, tuple):
+		for item in data:
+			writeHtmlData(writer, item)
+	elif hasattr(data, 'writeHtml'):
+		data.writeHtml(writer)
+	elif hasattr(data, 'toHtml'):
+		writer.write( data.toHtml() )
+	else:
+		# the new lines in the text become line breaks
+		writer.write( unicode(data).replace("\n", "<br>") )
+
 class HtmlElem:
 	def __init__(self, tag, data, attrs=None):
 		self.tag = tag
@@ -85,7 +104,14 @@ class HtmlElem:
 		return u"</%s>" % self.tag
 
 	def toHtml(self):
-		return u"%s%s%s" % ( self.openTagHtml(), self.data.toHtml(), self.closeTagHtml() )
+		writer = HtmlWriter()
+		self.writeHtml(writer)
+		return writer.getvalue()
+
+	def writeHtml(self, writer):
+		writer.write( self.openTagHtml() )
+		self.data.writeHtml(writer)
+		writer.write( self.closeTagHtml() )
 
 	def hasContents(self):
 		return self.data.toHtml() != ""
@@ -135,12 +161,28 @@ class HtmlTableHeader(HtmlTableRow):
 
 class HtmlTable(HtmlElem):
 	def __init__(self, rows, attrs=None):
-		# make sure to have HtmlTableRow items
-		rows = list(rows)
-		for i, r in enumerate(rows):
-			if not isinstance(r, HtmlTableRow):
-				rows[i] = HtmlTableRow( r )
-		HtmlElem.__init__(self, 'table', rows, attrs)
+		# rows can be HtmlTableRow items or sequences of cells, the latter
+		# are written directly without creating the row and col elements
+		HtmlElem.__init__(self, 'table', list(rows), attrs)
+
+	def writeHtml(self, writer):
+		write = writer.write
+		write( self.openTagHtml() )
+		for row in self.getOriginalData():
+			if isinstance(row, HtmlTableRow):
+				row.writeHtml(writer)
+				continue
+
+			write( u"<tr>" )
+			for col in row:
+				if isinstance(col, HtmlTableCol):
+					col.writeHtml(writer)
+				else:
+					write( u"<td>" )
+					writeHtmlData(writer, col)
+					write( u"&nbsp;</td>" )
+			write( u"</tr>" )
+		write( self.closeTagHtml() )
 
 
 class HtmlWarning(HtmlContent):
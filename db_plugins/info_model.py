@@ -23,6 +23,7 @@ email                : brush.tyler@gmail.com
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
+from .plugin import BaseError
 from .html_elems import HtmlContent, HtmlSection, HtmlParagraph, HtmlList, HtmlTable, HtmlTableHeader, HtmlTableCol
 
 
@@ -177,23 +178,109 @@ class SchemaInfo:
 
 
 class TableInfo:
+	# connector methods returning the table metadata, by metadata kind
+	METADATA_METHODS = {
+		"fields": "getTableFields",
+		"constraints": "getTableConstraints",
+		"indexes": "getTableIndexes",
+		"triggers": "getTableTriggers",
+		"rules": "getTableRules"
+	}
+
 	def __init__(self, table):
 		self.table = table
+		self._results = {}	# results of the connector calls, see connectorCall()
 
 	def __del__(self):
 		self.table = None
 
+	def tableKey(self):
+		return (self.table.schemaName(), self.table.name)
+
+	def connectorCall(self, method, *args):
+		""" call a connector method once, its result (or its error) is kept
+			so the data read in advance by prefetchSection() are reused """
+		key = (method,) + args
+		if not self._results.has_key( key ):
+			try:
+				self._results[key] = getattr(self.table.database().connector, method)( *args )
+			except BaseError, e:
+				self._results[key] = e
+		result = self._results[key]
+		if isinstance(result, BaseError):
+			raise result
+		return result
+
+	def sections(self):
+		""" names of the sections, in the order they're shown """
+		ret = [ 'general', 'spatial', 'fields', 'constraints', 'indexes', 'triggers' ]
+		if self.table.isView:
+			ret.append( 'view' )
+		return ret
+
+	def sectionQueries(self, name):
+		""" list of the connector calls (method name and arguments)
+			reading the data shown in a section """
+		if name == 'general':
+			if self.table.rowCount == None:
+				return [ ('getTableRowCount', self.tableKey()) ]
+		elif self.METADATA_METHODS.has_key( name ):
+			return [ (self.METADATA_METHODS[name], self.tableKey()) ]
+		elif name == 'view':
+			return [ ('getViewDefinition', self.tableKey()) ]
+		return []
+
+	def prefetchSection(self, name):
+		""" read the data of a section. It's called from a worker thread,
+			so it must neither create QObjects nor touch the GUI """
+		for query in self.sectionQueries(name):
+			try:
+				self.connectorCall( *query )
+			except BaseError, e:
+				pass	# raised again when the section is rendered
+
+	def _loadPrefetchedMetadata(self):
+		""" create the table metadata from the rows read by prefetchSection() """
+		for kind, method in self.METADATA_METHODS.iteritems():
+			result = self._results.get( (method, self.tableKey()) )
+			if result != None and not isinstance(result, BaseError):
+				self.table.loadMetadataRows(kind, result)
+
+	def _refreshRowCount(self):
+		# row count information is not displayed yet, so just block 
+		# table signals to avoid double refreshing (infoViewer->refreshRowCount->tableChanged->infoViewer)
+		self.table.blockSignals(True)
+		try:
+			key = ('getTableRowCount', self.tableKey())
+			if self._results.has_key( key ):
+				count = self._results[key]
+				self.table.rowCount = int(count) if count != None and not isinstance(count, BaseError) else None
+			else:
+				self.table.refreshRowCount()
+		finally:
+			self.table.blockSignals(False)
+
+	def jobErrorInfo(self, kind):
+		error = self.table.jobError(kind)
+		if error == None:
+			return u''
+		return u'<warning> %s ' % unicode(error).replace('\n', ' ')
+
+	def rowCountInfo(self):
+		if self.table.rowCount != None:
+			return self.table.rowCount
+		job = self.table.runningJob("rowcount")
+		if job != None:
+			return 'Counting... %d s (<a href="action:rows/cancelcount">cancel</a>)' % job.elapsed()
+		return u'Unknown %s(<a href="action:rows/count">find out</a>)' % self.jobErrorInfo("rowcount")
+
 	def generalInfo(self):
 		if self.table.rowCount == None:
-			# row count information is not displayed yet, so just block 
-			# table signals to avoid double refreshing (infoViewer->refreshRowCount->tableChanged->infoViewer)
-			self.table.blockSignals(True)
-			self.table.refreshRowCount()
-			self.table.blockSignals(False)
+			self._refreshRowCount()
 
 		tbl = [
 			("Relation type:", "View" if self.table.isView else "Table"), 
-			("Rows:", self.table.rowCount if self.table.rowCount != None else 'Unknown (<a href="action:rows/count">find out</a>)') 
+			("Rows:", self.rowCountInfo()) 
 		]
 		if self.table.comment:
 			tbl.append( ("Comment:", self.table.comment) )
@@ -285,73 +372,70 @@ class TableInfo:
 	def getViewDefinition(self):
 		if not self.table.isView:
 			return None
-		return self.table.database().connector.getViewDefinition( (self.table.schemaName(), self.table.name) )
+		return self.connectorCall( 'getViewDefinition', self.tableKey() )
 
 
-	def getTableInfo(self):
-		ret = []
+	def sectionHtml(self, name):
+		""" return the HtmlSection for a section, or None if there's nothing to show """
+		self._loadPrefetchedMetadata()
 
-		general_info = self.generalInfo()
-		if general_info == None:
-			pass
-		else:
-			ret.append( HtmlSection( 'General info', general_info ) )
+		if name == 'general':
+			general_info = self.generalInfo()
+			if general_info == None:
+				return None
+			return HtmlSection( 'General info', general_info )
 
-		# spatial info
-		spatial_info = self.spatialInfo()
-		if spatial_info == None:
-			pass
-		else:
+		if name == 'spatial':
+			spatial_info = self.spatialInfo()
+			if spatial_info == None:
+				return None
 			spatial_info = HtmlContent( spatial_info )
 			if not spatial_info.hasContents():
 				spatial_info = u'<warning> This is not a spatial table.'
-			ret.append( HtmlSection( self.table.database().connection().typeNameString(), spatial_info ) )
-
-		# fields
-		fields_details = self.fieldsDetails()
-		if fields_details == None:
-			pass
-		else:
-			ret.append( HtmlSection( 'Fields', fields_details ) )
-
-		# constraints
-		constraints_details = self.constraintsDetails()
-		if constraints_details == None:
-			pass
-		else:
-			ret.append( HtmlSection( 'Constraints', constraints_details ) )
+			return HtmlSection( self.table.database().connection().typeNameString(), spatial_info )
+
+		if name == 'fields':
+			fields_details = self.fieldsDetails()
+			if fields_details == None:
+				return None
+			return HtmlSection( 'Fields', fields_details )
+
+		if name == 'constraints':
+			constraints_details = self.constraintsDetails()
+			if constraints_details == None:
+				return None
+			return HtmlSection( 'Constraints', constraints_details )
+
+		if name == 'indexes':
+			indexes_details = self.indexesDetails()
+			if indexes_details == None:
+				return None
+			return HtmlSection( 'Indexes', indexes_details )
+
+		if name == 'triggers':
+			triggers_details = self.triggersDetails()
+			if triggers_details == None:
+				return None
+			return HtmlSection( 'Triggers', triggers_details )
+
+		if name == 'view':
+			view_def = self.getViewDefinition()
+			if view_def == None:
+				return None
+			return HtmlSection( 'View definition', view_def )
 
-		# indexes
-		indexes_details = self.indexesDetails()
-		if indexes_details == None:
-			pass
-		else:
-			ret.append( HtmlSection( 'Indexes', indexes_details ) )
+		return None
 
-		# triggers
-		triggers_details = self.triggersDetails()
-		if triggers_details == None:
-			pass
-		else:
-			ret.append( HtmlSection( 'Triggers', triggers_details ) )
 
-		return ret
+	def getTableInfo(self):
+		sections = filter(lambda x: x != 'view', self.sections())
+		return filter(None, map(self.sectionHtml, sections))
 
 
 	def getViewInfo(self):
 		if not self.table.isView:
 			return []
-
-		ret = self.getTableInfo()
-
-		# view definition
-		view_def = self.getViewDefinition()
-		if view_def == None:
-			pass
-		else:
-			ret.append( HtmlSection( 'View definition', view_def ) )
-
-		return ret
+		return filter(None, map(self.sectionHtml, self.sections()))
 
 
 	def toHtml(self):
@@ -381,7 +465,7 @@ class VectorTableInfo(TableInfo):
 			tbl.append( ("Dimension:", self.table.geomDim) )
 
 		srid = self.table.srid if self.table.srid != None else -1
-		sr_info = self.table.database().connector.getSpatialRefInfo(srid) if srid != -1 else "Undefined"
+		sr_info = self.connectorCall('getSpatialRefInfo', srid) if srid != -1 else "Undefined"
 		if sr_info:
 			tbl.append( ("Spatial ref:", u"%s (%d)" % (sr_info, srid)) )
 
@@ -391,18 +475,41 @@ class VectorTableInfo(TableInfo):
 				# estimated extent information is not displayed yet, so just block 
 				# table signals to avoid double refreshing (infoViewer->refreshEstimatedExtent->tableChanged->infoViewer)
 				self.table.blockSignals(True)
-				self.table.refreshTableEstimatedExtent()
+				key = ('getTableEstimatedExtent', self.tableKey(), self.table.geomColumn)
+				if self._results.has_key( key ):
+					extent = self._results[key]
+					self.table.estimatedExtent = extent if not isinstance(extent, BaseError) else None
+				else:
+					self.table.refreshTableEstimatedExtent()
 				self.table.blockSignals(False)
 
 			if self.table.estimatedExtent != None and self.table.estimatedExtent[0] != None:
-				estimated_extent_str = '%.5f, %.5f - %.5f, %.5f' % self.table.estimatedExtent
+				estimated_extent_str = '%.5f, %.5f - %.5f, %.5f (from the statistics)' % self.table.estimatedExtent
 				tbl.append( ("Estimated extent:", estimated_extent_str) )
 
+			if self.table.extent == None and hasattr(self.table.database().connector, 'getTableIndexedExtent'):
+				# read the extent from the spatial index, if any. Scanning
+				# the whole table is done only on request (extent/get)
+				try:
+					extent = self.connectorCall('getTableIndexedExtent', self.tableKey(), self.table.geomColumn)
+				except BaseError, e:
+					extent = None
+				if extent != None:
+					self.table.extent = extent
+					self.table.extentMethod = "index"
+
 		# extent
-		if self.table.extent != None and self.table.extent[0] != None:
+		job = self.table.runningJob("extent")
+		if job != None:
+			extent_str = 'Computing... %d s (<a href="action:extent/cancel">cancel</a>)' % job.elapsed()
+		elif self.table.extent != None and self.table.extent[0] != None:
 			extent_str = '%.5f, %.5f - %.5f, %.5f' % self.table.extent
+			if self.table.extentMethod == "index":
+				extent_str += u' (from the spatial index, %s<a href="action:extent/get">compute the exact one</a>)' % self.jobErrorInfo("extent")
+			elif self.table.extentMethod == "exact":
+				extent_str += u' (exact)'
 		else:
-			extent_str = '(unknown) (<a href="action:extent/get">find out</a>)'
+			extent_str = u'(unknown) %s(<a href="action:extent/get">find out</a>)' % self.jobErrorInfo("extent")
 		tbl.append( ("Extent:", extent_str) )
 
 		ret.append( HtmlTable( tbl ) )
@@ -418,6 +525,25 @@ class VectorTableInfo(TableInfo):
 
 		return ret
 
+	def sectionQueries(self, name):
+		if name != 'spatial':
+			return TableInfo.sectionQueries(self, name)
+		if self.table.geomType == None:
+			return []
+
+		ret = []
+		if self.table.srid != None and self.table.srid != -1:
+			ret.append( ('getSpatialRefInfo', self.table.srid) )
+		if not self.table.isView:
+			if self.table.estimatedExtent == None and hasattr(self.table.database().connector, 'getTableEstimatedExtent'):
+				ret.append( ('getTableEstimatedExtent', self.tableKey(), self.table.geomColumn) )
+			if self.table.extent == None and hasattr(self.table.database().connector, 'getTableIndexedExtent'):
+				ret.append( ('getTableIndexedExtent', self.tableKey(), self.table.geomColumn) )
+			# needed to find out whether there's a spatial index
+			ret.append( ('getTableFields', self.tableKey()) )
+			ret.append( ('getTableIndexes', self.tableKey()) )
+		return ret
+
 class RasterTableInfo(TableInfo):
 	def __init__(self, table):
 		TableInfo.__init__(self, table)
@@ -434,17 +560,26 @@ class RasterTableInfo(TableInfo):
 
 		# only if we have info from geometry_columns
 		srid = self.table.srid if self.table.srid != None else -1
-		sr_info = self.table.database().connector.getSpatialRefInfo(srid) if srid != -1 else "Undefined"
+		sr_info = self.connectorCall('getSpatialRefInfo', srid) if srid != -1 else "Undefined"
 		if sr_info: 
 			tbl.append( ("Spatial ref:", u"%s (%d)" % (sr_info, srid)) )
 
 		# extent
+		job = self.table.runningJob("extent")
 		if self.table.extent != None and self.table.extent[0] != None:
 			extent_str = '%.5f, %.5f - %.5f, %.5f' % self.table.extent
+		elif job != None:
+			extent_str = 'Computing... %d s (<a href="action:extent/cancel">cancel</a>)' % job.elapsed()
 		else:
-			extent_str = '(unknown) (<a href="action:extent/get">find out</a>)'
+			extent_str = u'(unknown) %s(<a href="action:extent/get">find out</a>)' % self.jobErrorInfo("extent")
 		tbl.append( ("Extent:", extent_str) )
 
 		ret.append( HtmlTable( tbl ) )
 		return ret
 
+	def sectionQueries(self, name):
+		if name != 'spatial':
+			return TableInfo.sectionQueries(self, name)
+		if self.table.geomType == None or self.table.srid == None or self.table.srid == -1:
+			return []
+		return [ ('getSpatialRefInfo', self.table.srid) ]
@@ -53,6 +53,8 @@ class DbError(BaseError):
 	def __init__(self, e, query=None):
 		BaseError.__init__(self, e)
 		self.query = unicode( query ) if query != None else None
+		# SQLSTATE code of the error, if the driver reports it
+		self.sqlstate = getattr(e, 'pgcode', None)
 
 	def __unicode__(self):
 		if self.query == None:
@@ -92,6 +94,11 @@ class DBPlugin(QObject):
 
 	def reconnect(self):
 		if self.db is not None:
+			if self.db.connector.resetPool():
+				# pooled connections are re-opened on demand, no need to
+				# tear down the whole database object
+				return True
+
 			uri = self.db.uri()
 			self.db.deleteLater()
 			self.db = None
@@ -165,6 +172,7 @@ class Database(DbItemObject):
 	def __init__(self, dbplugin, uri):
 		DbItemObject.__init__(self, dbplugin)
 		self.connector = self.connectorsFactory( uri )
+		self._jobManager = None
 
 	def connectorsFactory(self, uri):
 		return None
@@ -192,11 +200,23 @@ class Database(DbItemObject):
 		from .info_model import DatabaseInfo
 		return DatabaseInfo(self)
 
+	def jobManager(self):
+		""" return the manager of the jobs running on the tables """
+		if self._jobManager == None:
+			from .tasks import JobManager
+			self._jobManager = JobManager(self)
+		return self._jobManager
+
 
 	def sqlResultModel(self, sql, parent):
 		from .data_model import SqlResultModel
 		return SqlResultModel(self, sql, parent)
 
+	def vectorLayerImporter(self, layer, table, geomColumn=None, pkColumn=None, outCrs=None, createTable=True, overwrite=False, spatialIndex=False):
+		""" return an object to bulk import the layer into the table,
+			None if it's not supported (then use QgsVectorLayerImport) """
+		return None
+
 
 	def toSqlLayer(self, sql, geomCol, uniqueCol, layerName="QueryLayer", layerType=None):
 		from qgis.core import QgsMapLayer, QgsVectorLayer, QgsRasterLayer
@@ -243,6 +263,10 @@ class Database(DbItemObject):
 		mainWindow.registerAction( action, "&Table", self.deleteTableActionSlot )
 		action = QAction("&Empty table", self)
 		mainWindow.registerAction( action, "&Table", self.emptyTableActionSlot )
+		action = QAction("&Import vector files", self)
+		mainWindow.registerAction( action, "&Table", self.importVectorFilesActionSlot )
+		action = QAction("E&xport to file", self)
+		mainWindow.registerAction( action, "&Table", self.exportTableActionSlot )
 
 		if self.schemas() != None:
 			action = QAction("&Move to schema", self)
@@ -320,6 +344,39 @@ class Database(DbItemObject):
 		DlgCreateTable(item, parent).exec_()
 		QApplication.setOverrideCursor(Qt.WaitCursor)
 
+	def importVectorFilesActionSlot(self, item, action, parent):
+		QApplication.restoreOverrideCursor()
+		try:
+			if not hasattr(item, 'database') or item.database() == None:
+				QMessageBox.information(parent, "Sorry", "No database selected or you are not connected to it.")
+				return
+			# import into the schema of the selected item
+			outUri = self.uri()
+			schema = item.schema() if hasattr(item, 'schema') else None
+			if schema != None:
+				outUri.setDataSource( schema.name, QString(), QString() )
+			from ..dlg_import_vector_files import DlgImportVectorFiles
+			DlgImportVectorFiles(self, outUri, parent).exec_()
+			self.refresh()
+		finally:
+			QApplication.setOverrideCursor(Qt.WaitCursor)
+
+	def exportTableActionSlot(self, item, action, parent):
+		QApplication.restoreOverrideCursor()
+		try:
+			if not isinstance(item, Table):
+				QMessageBox.information(parent, "Sorry", "Select a TABLE or a VIEW to export.")
+				return
+			sql = u"SELECT * FROM %s" % self.connector.quoteId( (item.schemaName(), item.name) )
+			geomColumn = item.geomColumn if item.type == Table.VectorType else None
+			srid = item.srid if item.type == Table.VectorType and item.srid != None else -1
+			rowCount = item.rowCount if item.rowCount != None else item.estimatedRowCount
+
+			from ..dlg_export_data import DlgExportData
+			DlgExportData(self, sql, geomColumn, srid, item.name, rowCount, parent).exec_()
+		finally:
+			QApplication.setOverrideCursor(Qt.WaitCursor)
+
 	def editTableActionSlot(self, item, action, parent):
 		QApplication.restoreOverrideCursor()
 		try:
@@ -448,6 +505,15 @@ class Schema(DbItemObject):
 	def database(self):
 		return self.parent()
 
+	def catalogKey(self):
+		""" identify the schema when the database catalog is read again """
+		return self.name
+
+	def catalogState(self):
+		""" what the tree shows of the schema, its item is updated
+			when it changes """
+		return (self.name,)
+
 	def schema(self):
 		return self
 
@@ -487,6 +553,9 @@ class Table(DbItemObject):
 		self.name = self.isView = self.owner = self.pages = None
 		self.comment = None
 		self.rowCount = None
+		self.estimatedRowCount = None	# from the catalog statistics, if available
+		self.changeMarker = None	# from the catalog, it changes with the table definition
+		self._jobErrors = {}	# kind: error of the last job of that kind
 
 		self._fields = self._indexes = self._constraints = self._triggers = self._rules = None
 
@@ -505,6 +574,46 @@ class Table(DbItemObject):
 	def quotedName(self):
 		return self.database().connector.quoteId( (self.schemaName(), self.name) )
 
+	def catalogKey(self):
+		""" identify the table (and its geometry column, if any) when the
+			database catalog is read again """
+		return (self.schemaName(), self.name, getattr(self, 'geomColumn', None))
+
+	def catalogState(self):
+		""" what the tree shows of the table, its item is updated when it
+			changes. The statistics (e.g. the estimated rows) aren't part of
+			it, they change on every analyze """
+		return self.catalogKey() + (self.type, self.isView, getattr(self, 'geomType', None), getattr(self, 'geomDim', None), getattr(self, 'srid', None))
+
+	def clearMetadata(self):
+		""" forget fields, indexes, ... so they will be read again """
+		self._fields = self._indexes = self._constraints = self._triggers = self._rules = None
+
+	def loadMetadataRows(self, kind, rows):
+		""" create the fields, indexes, ... (kind as in the metadata cache) from the
+			catalog rows read elsewhere, e.g. by a task running in a worker thread
+			as the objects must be created in the thread of the table.
+			Nothing is done if they are already loaded. """
+		factories = {
+			"fields": ("_fields", self.tableFieldsFactory),
+			"constraints": ("_constraints", self.tableConstraintsFactory),
+			"indexes": ("_indexes", self.tableIndexesFactory),
+			"triggers": ("_triggers", self.tableTriggersFactory),
+			"rules": ("_rules", self.tableRulesFactory)
+		}
+		attr, factory = factories[kind]
+		if rows == None or getattr(self, attr) != None:
+			return
+		setattr(self, attr, map(lambda x: factory(x, self), rows))
+
+	def aboutToChange(self):
+		# the table is going to change, its cached metadata could be out of date
+		self._invalidateMetadata()
+		DbItemObject.aboutToChange(self)
+
+	def _invalidateMetadata(self, kind=None):
+		self.database().connector.metadataCache.invalidate( (self.schemaName(), self.name), kind )
+
 
 	def delete(self):
 		self.aboutToChange()
@@ -611,6 +720,7 @@ class Table(DbItemObject):
 
 	def refreshFields(self):
 		self._fields = None	# refresh table fields
+		self._invalidateMetadata("fields")
 		self.refresh()
 
 	def addField(self, fld):
@@ -656,6 +766,7 @@ class Table(DbItemObject):
 
 	def refreshConstraints(self):
 		self._constraints = None	# refresh table constraints
+		self._invalidateMetadata("constraints")
 		self.refresh()
 
 	def addConstraint(self, constr):
@@ -690,6 +801,7 @@ class Table(DbItemObject):
 
 	def refreshIndexes(self):
 		self._indexes = None	# refresh table indexes
+		self._invalidateMetadata("indexes")
 		self.refresh()
 
 	def addIndex(self, idx):
@@ -719,6 +831,7 @@ class Table(DbItemObject):
 
 	def refreshTriggers(self):
 		self._triggers = None	# refresh table triggers
+		self._invalidateMetadata("triggers")
 		self.refresh()
 
 
@@ -734,6 +847,7 @@ class Table(DbItemObject):
 
 	def refreshRules(self):
 		self._rules = None	# refresh table rules
+		self._invalidateMetadata("rules")
 		self.refresh()
 
 
@@ -748,13 +862,66 @@ class Table(DbItemObject):
 		if self.rowCount != prevRowCount:
 			self.refresh()
 
+	def refreshRowCountInBackground(self):
+		""" count the rows by a cancellable job running in a separate thread,
+			the table is refreshed when the count is done """
+		self.runJob( "rowcount", "getTableRowCount", (self.schemaName(), self.name) )
+
+	def isCountingRows(self):
+		return self.runningJob( "rowcount" ) != None
+
+	def cancelRowCount(self):
+		self.database().jobManager().cancel( self, "rowcount" )
+
+
+	def runJob(self, kind, method, *args):
+		""" call a connector method by a job of the database job manager,
+			when it's done jobDone() gets the result and the table is refreshed.
+			The "jobProgress" signal is emitted while the job is running """
+		manager = self.database().jobManager()
+		if manager.job(self, kind) != None:
+			return
+		self._jobErrors.pop( kind, None )
+		job = manager.start(self, kind, method, *args)
+		self.connect(job, SIGNAL("progress"), self._jobProgress)
+		self.connect(job, SIGNAL("finished()"), self._jobFinished)
+
+	def runningJob(self, kind):
+		return self.database().jobManager().job(self, kind)
+
+	def jobError(self, kind):
+		""" return the error of the last job of that kind, if it failed """
+		return self._jobErrors.get( kind )
+
+	def jobDone(self, kind, result):
+		""" store the result of a job """
+		if kind == "rowcount":
+			self.rowCount = int(result) if result != None else None
+
+	def _jobProgress(self, elapsed):
+		self.emit( SIGNAL("jobProgress"), self.sender() )
+
+	def _jobFinished(self):
+		job = self.sender()
+		self.aboutToChange()
+		if job.isCanceled():
+			pass
+		elif job.error() != None:
+			self._jobErrors[ job.kind ] = job.error()
+		else:
+			self.jobDone( job.kind, job.result() )
+		self.refresh()
+
 
 	def runAction(self, action):
 		action = unicode(action)
 
 		if action.startswith( "rows/" ):
 			if action == "rows/count":
-				self.refreshRowCount()
+				self.refreshRowCountInBackground()
+				return True
+			elif action == "rows/cancelcount":
+				self.cancelRowCount()
 				return True
 
 		elif action.startswith( "triggers/" ):
@@ -811,6 +978,7 @@ class VectorTable(Table):
 		self.type = Table.VectorType
 		self.geomColumn = self.geomType = self.geomDim = self.srid = None
 		self.estimatedExtent = self.extent = None
+		self.extentMethod = None	# how the extent was found out: "index" or "exact"
 
 	def info(self):
 		from .info_model import VectorTableInfo
@@ -847,10 +1015,25 @@ class VectorTable(Table):
 		return ret
 
 
+	def refreshTableExtentInBackground(self):
+		""" find out the extent by a cancellable job running in a separate thread """
+		self.runJob( "extent", "getTableExtent", (self.schemaName(), self.name), self.geomColumn )
+
+	def isComputingExtent(self):
+		return self.runningJob( "extent" ) != None
+
+	def jobDone(self, kind, result):
+		if kind == "extent":
+			self.extent = result
+			self.extentMethod = "exact"
+			return
+		Table.jobDone(self, kind, result)
+
 	def refreshTableExtent(self):
 		prevExtent = self.extent
 		try:
 			self.extent = self.database().connector.getTableExtent( (self.schemaName(), self.name), self.geomColumn )
+			self.extentMethod = "exact"
 		except DbError:
 			self.extent = None
 		if self.extent != prevExtent:
@@ -890,7 +1073,11 @@ class VectorTable(Table):
 
 		if action.startswith( "extent/" ):
 			if action == "extent/get":
-				self.refreshTableExtent()
+				self.refreshTableExtentInBackground()
+				return True
+
+			if action == "extent/cancel":
+				self.database().jobManager().cancel( self, "extent" )
 				return True
 
 			if action == "extent/estimated/get":
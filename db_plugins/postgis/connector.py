@@ -25,11 +25,14 @@ The content of this file is based on
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
-from ..connector import DBConnector
+from ..connector import DBConnector, cachedMetadata, invalidatesMetadata
 from ..plugin import ConnectionError, DbError, Table
 
 import psycopg2
 import psycopg2.extensions
+from cStringIO import StringIO
+import os
+import uuid
 # use unicode!
 psycopg2.extensions.register_type(psycopg2.extensions.UNICODE)
 psycopg2.extensions.register_type(psycopg2.extensions.UNICODEARRAY)
@@ -51,10 +54,8 @@ class PostGisDBConnector(DBConnector):
 		if self.dbname == '' or self.dbname is None:
 			self.dbname = self.user
 		
-		try:
-			self.connection = psycopg2.connect( self._connectionInfo().encode('utf-8') )
-		except self.connection_error_types(), e:
-			raise ConnectionError(e)
+		self._functions = {}	# see _hasFunction
+		self._createPool()
 		
 		self._checkSpatial()
 		self._checkRaster()
@@ -64,6 +65,33 @@ class PostGisDBConnector(DBConnector):
 	def _connectionInfo(self):
 		return unicode(self._uri.connectionInfo())
 
+	def _connect(self):
+		try:
+			return psycopg2.connect( self._connectionInfo().encode('utf-8') )
+		except self.connection_error_types(), e:
+			raise ConnectionError(e)
+
+	def _checkConnection(self, conn):
+		""" health check run on pooled connections before leasing them """
+		if conn.closed:
+			return False
+		try:
+			c = conn.cursor()
+			c.execute( u"SELECT 1" )
+			c.close()
+			conn.rollback()
+		except self.error_types(), e:
+			return False
+		return True
+
+	def _hasFunction(self, name):
+		""" check whether the function is present in catalog """
+		if not self._functions.has_key( name ):
+			c = self._get_cursor()
+			self._execute(c, u"SELECT COUNT(*) FROM pg_proc WHERE proname = %s" % self.quoteString(name))
+			self._functions[name] = c.fetchone()[0] > 0
+		return self._functions[name]
+
 	def _checkSpatial(self):
 		""" check whether postgis_version is present in catalog """
 		c = self._get_cursor()
@@ -196,8 +224,104 @@ class PostGisDBConnector(DBConnector):
 		return c.fetchall()
 
 	def getTables(self, schema=None):
-		""" get list of tables """
-		tablenames = []
+		""" get list of tables, views and tables with geometry or raster columns.
+			A single catalog query returns all of them, if it fails the
+			tables are read by separate queries """
+		if not self.has_spatial:
+			return self._getTablesSeparately(schema)
+
+		try:
+			return self._getTablesSnapshot(schema)
+		except DbError:
+			return self._getTablesSeparately(schema)
+
+	def _getTablesSnapshot(self, schema=None):
+		c = self._get_cursor()
+
+		sys_tables = set([ "spatial_ref_sys", "geography_columns", "geometry_columns", 
+				"raster_columns", "raster_overviews" ])
+
+		if schema:
+			schema_where = u" AND nspname = %s " % self.quoteString(schema)
+		else:
+			schema_where = u" AND (nspname != 'information_schema' AND nspname !~ 'pg_') "
+
+		# geometry and raster columns are found by their type
+		spatial_types = [ u"'geometry'::regtype" ]
+		column_kind = u"WHEN att.atttypid = 'geometry'::regtype OR typ.typbasetype = 'geometry'::regtype THEN 'g' "
+		if self.has_raster:
+			spatial_types.append( u"'raster'::regtype" )
+			column_kind += u"WHEN att.atttypid = 'raster'::regtype OR typ.typbasetype = 'raster'::regtype THEN 'r' "
+		spatial_types = u", ".join(spatial_types)
+
+		geometry_column_from = u""
+		geometry_fields_select = u"NULL, NULL, NULL, NULL"
+		if self.has_geometry_columns and self.has_geometry_columns_access:
+			geometry_column_from = u"""LEFT OUTER JOIN geometry_columns AS geo ON 
+						cla.relname = geo.f_table_name AND nsp.nspname = geo.f_table_schema AND 
+						lower(att.attname) = lower(geo.f_geometry_column)"""
+			geometry_fields_select = u"geo.f_geometry_column, geo.type, geo.coord_dimension, geo.srid"
+
+		raster_column_from = u""
+		raster_fields_select = u"NULL, NULL, NULL, NULL, NULL, NULL"
+		if self.has_raster and self.has_raster_columns and self.has_raster_columns_access:
+			raster_column_from = u"""LEFT OUTER JOIN raster_columns AS rast ON 
+						cla.relname = rast.r_table_name AND nsp.nspname = rast.r_table_schema AND 
+						lower(att.attname) = lower(rast.r_raster_column)"""
+			raster_fields_select = u"rast.r_raster_column, rast.pixel_types, rast.scale_x, rast.scale_y, rast.out_db, rast.srid"
+
+		# every relation is returned once for each geometry/raster column,
+		# or just once with NULL column fields if it has none of them
+		sql = u"""SELECT 
+						cla.relname, nsp.nspname, cla.relkind = 'v', 
+						pg_get_userbyid(relowner), cla.reltuples, cla.relpages, 
+						pg_catalog.obj_description(cla.oid), cla.oid, cla.xmin, 
+						att.attname, CASE """ + column_kind + """ END, 
+						textin(regtypeout(att.atttypid::regtype)), 
+						""" + geometry_fields_select + """, 
+						""" + raster_fields_select + """
+
+					FROM pg_class AS cla 
+					JOIN pg_namespace AS nsp ON 
+						nsp.oid = cla.relnamespace
+
+					LEFT OUTER JOIN (pg_attribute AS att JOIN pg_type AS typ ON typ.oid = att.atttypid) ON 
+						att.attrelid = cla.oid AND att.attnum > 0 AND NOT att.attisdropped AND 
+						(att.atttypid IN (""" + spatial_types + """) OR typ.typbasetype IN (""" + spatial_types + """)) 
+
+					""" + geometry_column_from + """ 
+					""" + raster_column_from + """ 
+
+					WHERE cla.relkind IN ('v', 'r') """ + schema_where + """ 
+					ORDER BY nsp.nspname, cla.relname, att.attname"""
+
+		self._execute(c, sql)
+
+		items = []
+		plain = set()	# tables already added without spatial columns
+		for tbl in c.fetchall():
+			table_info = list(tbl[:9])
+			attname, kind, atttype = tbl[9:12]
+			geo, rast = tbl[12:16], tbl[16:22]
+
+			if kind != None and not (tbl[0] in sys_tables and tbl[1] in ['', 'public']):
+				if kind == 'g':
+					item = [Table.VectorType] + table_info + [ geo[0] if geo[0] != None else attname, 
+							geo[1] if geo[1] != None else atttype, geo[2], geo[3] ]
+				else:
+					item = [Table.RasterType] + table_info + [ rast[0] if rast[0] != None else attname ] + list(rast[1:])
+				items.append( item )
+
+			elif (tbl[1], tbl[0]) not in plain:
+				plain.add( (tbl[1], tbl[0]) )
+				items.append( [Table.TableType] + table_info )
+
+		return sorted( items, key=lambda x: (x[2], x[1]) )
+
+	def _getTablesSeparately(self, schema=None):
+		""" get list of tables by reading vector, raster and the other tables
+			by separate queries """
+		tablenames = set()
 		items = []
 
 		sys_tables = [ "spatial_ref_sys", "geography_columns", "geometry_columns", 
@@ -208,7 +332,7 @@ class PostGisDBConnector(DBConnector):
 			for tbl in vectors:
 				if tbl[1] in sys_tables and tbl[2] in ['', 'public']:
 					continue
-				tablenames.append( (tbl[2], tbl[1]) )
+				tablenames.add( (tbl[2], tbl[1]) )
 				items.append( tbl )
 		except DbError:
 			pass
@@ -218,16 +342,13 @@ class PostGisDBConnector(DBConnector):
 			for tbl in rasters:
 				if tbl[1] in sys_tables and tbl[2] in ['', 'public']:
 					continue
-				tablenames.append( (tbl[2], tbl[1]) )
+				tablenames.add( (tbl[2], tbl[1]) )
 				items.append( tbl )
 		except DbError:
 			pass
 
 		c = self._get_cursor()
 
-		sys_tables = [ "spatial_ref_sys", "geography_columns", "geometry_columns", 
-				"raster_columns", "raster_overviews" ]
-		
 		if schema:
 			schema_where = u" AND nspname = %s " % self.quoteString(schema)
 		else:
@@ -237,7 +358,7 @@ class PostGisDBConnector(DBConnector):
 		sql = u"""SELECT 
 						cla.relname, nsp.nspname, cla.relkind = 'v', 
 						pg_get_userbyid(relowner), reltuples, relpages, 
-						pg_catalog.obj_description(cla.oid)
+						pg_catalog.obj_description(cla.oid), cla.oid, cla.xmin
 					FROM pg_class AS cla 
 					JOIN pg_namespace AS nsp ON nsp.oid = cla.relnamespace
 					WHERE cla.relkind IN ('v', 'r') """ + schema_where + """
@@ -246,14 +367,25 @@ class PostGisDBConnector(DBConnector):
 		self._execute(c, sql)
 
 		for tbl in c.fetchall():
-			if tablenames.count( (tbl[1], tbl[0]) ) <= 0:
+			if (tbl[1], tbl[0]) not in tablenames:
 				item = list(tbl)
 				item.insert(0, Table.TableType)
 				items.append( item )
 
-		return sorted( items, cmp=lambda x,y: cmp((x[2],x[1]), (y[2],y[1])) )
+		return sorted( items, key=lambda x: (x[2], x[1]) )
 
 
+	def getTableNames(self):
+		""" get (schema, name) of all the tables and views, it's used to
+			search them without reading all the table details """
+		c = self._get_cursor()
+		sql = u"""SELECT nsp.nspname, cla.relname
+					FROM pg_class AS cla
+					JOIN pg_namespace AS nsp ON nsp.oid = cla.relnamespace
+					WHERE cla.relkind IN ('v', 'r') AND (nspname != 'information_schema' AND nspname !~ 'pg_')"""
+		self._execute(c, sql)
+		return c.fetchall()
+
 	def getVectorTables(self, schema=None):
 		""" get list of table with a geometry column
 			it returns:
@@ -263,6 +395,9 @@ class PostGisDBConnector(DBConnector):
 				owner 
 				tuples
 				pages
+				comment
+				oid
+				xmin (changes when the table definition changes)
 				geometry_column:
 					f_geometry_column (or pg_attribute.attname, the geometry column name)
 					type (or pg_attribute.atttypid::regtype, the geometry column type name)
@@ -297,7 +432,7 @@ class PostGisDBConnector(DBConnector):
 		sql = u"""SELECT 
 						cla.relname, nsp.nspname, cla.relkind = 'v', 
 						pg_get_userbyid(relowner), cla.reltuples, cla.relpages, 
-						pg_catalog.obj_description(cla.oid), 
+						pg_catalog.obj_description(cla.oid), cla.oid, cla.xmin, 
 						""" + geometry_fields_select + """
 
 					FROM pg_class AS cla 
@@ -333,6 +468,9 @@ class PostGisDBConnector(DBConnector):
 				owner 
 				tuples
 				pages
+				comment
+				oid
+				xmin (changes when the table definition changes)
 				raster_column:
 					r_raster_column (or pg_attribute.attname, the raster column name)
 					pixel type
@@ -371,7 +509,7 @@ class PostGisDBConnector(DBConnector):
 		sql = u"""SELECT 
 						cla.relname, nsp.nspname, cla.relkind = 'v', 
 						pg_get_userbyid(relowner), cla.reltuples, cla.relpages, 
-						pg_catalog.obj_description(cla.oid), 
+						pg_catalog.obj_description(cla.oid), cla.oid, cla.xmin, 
 						""" + raster_fields_select + """
 
 					FROM pg_class AS cla 
@@ -404,6 +542,70 @@ class PostGisDBConnector(DBConnector):
 		self._execute( c, u"SELECT COUNT(*) FROM %s" % self.quoteId(table) )
 		return c.fetchone()[0]
 
+	def prefetchTablesMetadata(self, schema=None):
+		""" read fields, indexes, constraints, triggers and rules of all
+			the tables in the schema by one query for each of them """
+		if schema == None:
+			return False
+		schema_where = u" nspname=%s " % self.quoteString(schema)
+
+		queries = [
+			("fields", u"""SELECT c.relname, a.attnum AS ordinal_position,
+					a.attname AS column_name,
+					t.typname AS data_type,
+					a.attlen AS char_max_len,
+					a.atttypmod AS modifier,
+					a.attnotnull AS notnull,
+					a.atthasdef AS hasdefault,
+					adef.adsrc AS default_value, 
+					pg_catalog.format_type(a.atttypid,a.atttypmod) AS formatted_type
+				FROM pg_class c
+				JOIN pg_attribute a ON a.attrelid = c.oid
+				JOIN pg_type t ON a.atttypid = t.oid
+				JOIN pg_namespace nsp ON c.relnamespace = nsp.oid
+				LEFT JOIN pg_attrdef adef ON adef.adrelid = a.attrelid AND adef.adnum = a.attnum
+				WHERE
+				  a.attnum > 0 AND c.relkind IN ('v', 'r') AND %s
+				ORDER BY c.relname, a.attnum""" % schema_where),
+
+			("indexes", u"""SELECT pg_class.relname, idxcls.relname, indkey, indisunique = 't' 
+							FROM pg_index JOIN pg_class ON pg_index.indrelid=pg_class.oid 
+							JOIN pg_class AS idxcls ON pg_index.indexrelid=idxcls.oid 
+							JOIN pg_namespace nsp ON pg_class.relnamespace = nsp.oid 
+								WHERE %s AND indisprimary != 't' """ % schema_where),
+
+			("constraints", u"""SELECT t.relname, c.conname, c.contype, c.condeferrable, c.condeferred, array_to_string(c.conkey, ' '), c.consrc,
+						t2.relname, c.confupdtype, c.confdeltype, c.confmatchtype, array_to_string(c.confkey, ' ') FROM pg_constraint c
+				JOIN pg_class t ON c.conrelid = t.oid
+				LEFT JOIN pg_class t2 ON c.confrelid = t2.oid
+				JOIN pg_namespace nsp ON t.relnamespace = nsp.oid
+				WHERE %s """ % schema_where),
+
+			("triggers", u"""SELECT t.relname, tgname, proname, tgtype, tgenabled NOT IN ('f', 'D') FROM pg_trigger trig
+				JOIN pg_class t ON trig.tgrelid = t.oid
+				LEFT JOIN pg_proc p ON trig.tgfoid = p.oid
+				JOIN pg_namespace nsp ON t.relnamespace = nsp.oid
+				WHERE %s """ % schema_where),
+
+			("rules", u"""SELECT tablename, rulename, definition FROM pg_rules
+				WHERE schemaname=%s """ % self.quoteString(schema))
+		]
+
+		# table name -> { kind: rows }, the table name is the first column
+		metadata = {}
+		c = self._get_cursor()
+		for kind, sql in queries:
+			self._execute(c, sql)
+			for row in c.fetchall():
+				metadata.setdefault( row[0], {} ).setdefault( kind, [] ).append( row[1:] )
+		self._close_cursor(c)
+
+		for tablename, tablemeta in metadata.iteritems():
+			for kind, sql in queries:
+				self.metadataCache.put( (schema, tablename), kind, tablemeta.get( kind, [] ) )
+		return True
+
+	@cachedMetadata("fields")
 	def getTableFields(self, table):
 		""" return list of columns in table """
 		c = self._get_cursor()
@@ -432,6 +634,7 @@ class PostGisDBConnector(DBConnector):
 		self._execute(c, sql)
 		return c.fetchall()
 
+	@cachedMetadata("indexes")
 	def getTableIndexes(self, table):
 		""" get info about table's indexes. ignore primary key constraint index, they get listed in constaints """
 		schema, tablename = self.getSchemaTableName(table)
@@ -448,6 +651,7 @@ class PostGisDBConnector(DBConnector):
 		return c.fetchall()
 	
 	
+	@cachedMetadata("constraints")
 	def getTableConstraints(self, table):
 		c = self._get_cursor()
 		
@@ -465,6 +669,7 @@ class PostGisDBConnector(DBConnector):
 		return c.fetchall()
 
 
+	@cachedMetadata("triggers")
 	def getTableTriggers(self, table):
 		c = self._get_cursor()
 		
@@ -489,13 +694,16 @@ class PostGisDBConnector(DBConnector):
 		trigger = self.quoteId(trigger) if trigger != None else "ALL"
 		sql = u"ALTER TABLE %s %s TRIGGER %s" % (self.quoteId(table), "ENABLE" if enable else "DISABLE", trigger)
 		self._execute_and_commit(sql)
+		self.metadataCache.invalidate(table, "triggers")
 		
 	def deleteTableTrigger(self, trigger, table):
 		""" delete trigger on table """
 		sql = u"DROP TRIGGER %s ON %s" % (self.quoteId(trigger), self.quoteId(table))
 		self._execute_and_commit(sql)
+		self.metadataCache.invalidate(table, "triggers")
 		
 	
+	@cachedMetadata("rules")
 	def getTableRules(self, table):
 		c = self._get_cursor()
 		
@@ -512,6 +720,7 @@ class PostGisDBConnector(DBConnector):
 		""" delete rule on table """
 		sql = u"DROP RULE %s ON %s" % (self.quoteId(rule), self.quoteId(table))
 		self._execute_and_commit(sql)
+		self.metadataCache.invalidate(table, "rules")
 
 
 	def getTableExtent(self, table, geom):
@@ -522,6 +731,22 @@ class PostGisDBConnector(DBConnector):
 		self._execute(c, sql)
 		return c.fetchone()
 
+	def getTableIndexedExtent(self, table, geom):
+		""" find out table extent reading the root of the spatial index (PostGIS >= 2.5),
+			much faster than scanning the whole table. Return None if there's no index """
+		if self.isRasterTable(table) or not self._hasFunction('_postgis_index_extent'):
+			return
+
+		c = self._get_cursor()
+		subquery = u"SELECT _postgis_index_extent(%s::regclass, %s) AS extent" % (self.quoteString(self.quoteId(table)), self.quoteString(geom))
+		sql = u"""SELECT st_xmin(extent), st_ymin(extent), st_xmax(extent), st_ymax(extent) FROM (%s) AS subquery """ % subquery
+		try:
+			self._execute(c, sql)
+		except DbError, e:	# no spatial index on the column
+			return
+		extent = c.fetchone()
+		return extent if extent != None and extent[0] != None else None
+
 	def getTableEstimatedExtent(self, table, geom):
 		""" find out estimated extent (from the statistics) """
 		if self.isRasterTable(table):
@@ -531,7 +756,9 @@ class PostGisDBConnector(DBConnector):
 		schema, tablename = self.getSchemaTableName(table)
 		schema_part = u"%s," % self.quoteString(schema) if schema is not None else ""
 
-		subquery = u"SELECT st_estimated_extent(%s%s,%s) AS extent" % (schema_part, self.quoteString(tablename), self.quoteString(geom))
+		# st_estimated_extent was renamed in PostGIS 2.1
+		function = u"st_estimatedextent" if self._hasFunction('st_estimatedextent') else u"st_estimated_extent"
+		subquery = u"SELECT %s(%s%s,%s) AS extent" % (function, schema_part, self.quoteString(tablename), self.quoteString(geom))
 		sql = u"""SELECT st_xmin(extent), st_ymin(extent), st_xmax(extent), st_ymax(extent) FROM (%s) AS subquery """ % subquery
 		try:
 			self._execute(c, sql)
@@ -591,6 +818,7 @@ class PostGisDBConnector(DBConnector):
 		return False		
 
 
+	@invalidatesMetadata
 	def createTable(self, table, field_defs, pkey):
 		""" create ordinary table
 				'fields' is array containing field definitions
@@ -608,6 +836,7 @@ class PostGisDBConnector(DBConnector):
 		self._execute_and_commit(sql)
 		return True
 
+	@invalidatesMetadata
 	def deleteTable(self, table):
 		""" delete table and its reference in either geometry_columns or raster_columns """
 		schema, tablename = self.getSchemaTableName(table)
@@ -626,6 +855,153 @@ class PostGisDBConnector(DBConnector):
 		sql = u"TRUNCATE %s" % self.quoteId(table)
 		self._execute_and_commit(sql)
 
+	def copyFrom(self, table, columns, rows):
+		""" bulk load the rows into the table by COPY FROM STDIN, in the
+			current transaction. Values are sent in the text format, so
+			geometries must be passed as hex (E)WKB """
+		buf = StringIO()
+		for row in rows:
+			values = []
+			for value in row:
+				if value == None:
+					values.append( u"\\N" )
+				else:
+					value = self._copyText(value)
+					value = value.replace(u"\\", u"\\\\").replace(u"\t", u"\\t").replace(u"\n", u"\\n").replace(u"\r", u"\\r")
+					values.append( value )
+			buf.write( (u"\t".join(values) + u"\n").encode( self._clientEncoding() ) )
+		buf.seek(0)
+
+		sql = u"COPY %s (%s) FROM STDIN" % (self.quoteId(table), u", ".join( map(self.quoteId, columns) ))
+		c = self._get_cursor()
+		try:
+			c.copy_expert(sql, buf)
+
+		except self.connection_error_types(), e:
+			raise ConnectionError(e)
+
+		except self.execution_error_types(), e:
+			# do the rollback to avoid a "current transaction aborted, commands ignored" errors
+			self._rollback()
+			raise DbError(e, sql)
+
+	@classmethod
+	def _copyText(self, value):
+		""" return the text of a value in the COPY text format """
+		if isinstance(value, float):
+			if value != value:
+				return u"NaN"
+			if value in (float('inf'), float('-inf')):
+				return u"Infinity" if value > 0 else u"-Infinity"
+			# repr() keeps all the digits, unicode() only 12 of them
+			return unicode(repr(value))
+		return unicode(value)
+
+	def iterQueryRows(self, sql, chunksize=1000):
+		# fetch the rows through a server-side cursor, a plain cursor
+		# would read all of them at once
+		c = self._execute(self._get_cursor("export"), sql)
+		try:
+			while True:
+				rows = self._fetchmany(c, chunksize)
+				if len(rows) <= 0:
+					break
+				yield rows
+		finally:
+			self._close_cursor(c)
+			self._commit()
+
+	def copyTo(self, sql, f):
+		""" write the rows of the query to the file object as CSV with
+			a header, by COPY TO STDOUT """
+		sql = u"COPY (%s\n) TO STDOUT WITH CSV HEADER" % sql
+		c = self._get_cursor()
+		try:
+			c.copy_expert(sql, f)
+
+		except self.connection_error_types(), e:
+			raise ConnectionError(e)
+
+		except self.execution_error_types(), e:
+			# do the rollback to avoid a "current transaction aborted, commands ignored" errors
+			self._rollback()
+			raise DbError(e, sql)
+
+		except:
+			# writing to the file failed (or the export was canceled), the
+			# connection is left in the middle of the COPY
+			self._discardConnection()
+			raise
+
+		self._commit()
+
+	def _discardConnection(self):
+		""" stop the query and close the connection used by the current thread,
+			it can't be used anymore. The GUI connection is opened again """
+		conn = self.connection
+		self.cancel(conn)
+		try:
+			conn.close()
+		except self.error_types(), e:
+			pass
+		if conn == self._connection:
+			self._connection = self._connect()
+
+	def _clientEncoding(self):
+		return psycopg2.extensions.encodings.get( self.connection.encoding, 'utf-8' )
+
+	def createStagingTable(self, table, geom_column):
+		""" create an empty table with the columns of the table to load data
+			into it before moving them to the table, see insertFromStagingTable().
+			It's not WAL-logged and its geometry column accepts any srid.
+			Return the staging table """
+		schema, tablename = self.getSchemaTableName(table)
+		c = self._get_cursor()
+
+		# a name no other table has (in any schema), with the pid and a random
+		# part so that concurrent imports don't pick the same one
+		while True:
+			suffix = u"_import_staging_%d_%s" % (os.getpid(), uuid.uuid4().hex[:8])
+			# names longer than 63 bytes would be truncated by the server
+			stagingname = tablename[:63 - len(suffix)] + suffix
+			while len( stagingname.encode('utf-8') ) > 63:
+				stagingname = stagingname[:-len(suffix)-1] + suffix
+			self._execute(c, u"SELECT count(*) FROM pg_class WHERE relname = %s" % self.quoteString(stagingname))
+			if c.fetchone()[0] == 0:
+				break
+
+		if self.connection.server_version >= 90100:
+			staging = (schema, stagingname)
+			sql = u"CREATE UNLOGGED TABLE %s AS SELECT * FROM %s WHERE false" % (self.quoteId(staging), self.quoteId(table))
+		else:
+			# no unlogged tables before 9.1, temporary ones aren't logged either
+			staging = (None, stagingname)
+			sql = u"CREATE TEMP TABLE %s AS SELECT * FROM %s WHERE false" % (self.quoteId(staging), self.quoteId(table))
+		self._execute(c, sql)
+		if geom_column != None:
+			self._execute(c, u"ALTER TABLE %s ALTER COLUMN %s TYPE geometry" % (self.quoteId(staging), self.quoteId(geom_column)))
+		self._commit()
+		return staging
+
+	def insertFromStagingTable(self, table, staging, columns, geom_column=None, srid=-1):
+		""" move the rows of the staging table into the table, reprojecting
+			the geometries to srid, in the current transaction """
+		values = []
+		for col in columns:
+			if col == geom_column:
+				values.append( u"ST_Transform(%s, %d)" % (self.quoteId(col), srid) )
+			else:
+				values.append( self.quoteId(col) )
+		c = self._get_cursor()
+		sql = u"INSERT INTO %s (%s) SELECT %s FROM %s" % (self.quoteId(table), u", ".join( map(self.quoteId, columns) ), u", ".join( values ), self.quoteId(staging))
+		self._execute(c, sql)
+		self._execute(c, u"TRUNCATE %s" % self.quoteId(staging))
+
+	def deleteStagingTable(self, staging):
+		""" drop a table returned by createStagingTable() """
+		self._execute_and_commit(u"DROP TABLE %s" % self.quoteId(staging))
+
+	@invalidatesMetadata
 	def renameTable(self, table, new_table):
 		""" rename a table in database """
 		schema, tablename = self.getSchemaTableName(table)
@@ -644,6 +1020,7 @@ class PostGisDBConnector(DBConnector):
 
 		self._commit()
 
+	@invalidatesMetadata
 	def moveTableToSchema(self, table, new_schema):
 		schema, tablename = self.getSchemaTableName(table)
 		if new_schema == schema:
@@ -662,6 +1039,7 @@ class PostGisDBConnector(DBConnector):
 
 		self._commit()
 
+	@invalidatesMetadata
 	def moveTable(self, table, new_table, new_schema=None):
 		schema, tablename = self.getSchemaTableName(table)
 		if new_schema == schema and new_table == tablename: 
@@ -693,10 +1071,12 @@ class PostGisDBConnector(DBConnector):
 
 		self._commit()
 		
+	@invalidatesMetadata
 	def createView(self, view, query):
 		sql = u"CREATE VIEW %s AS %s" % (self.quoteId(view), query)
 		self._execute_and_commit(sql)
 	
+	@invalidatesMetadata
 	def deleteView(self, view):
 		sql = u"DROP VIEW %s" % self.quoteId(view)
 		self._execute_and_commit(sql)
@@ -714,11 +1094,13 @@ class PostGisDBConnector(DBConnector):
 		""" drop (empty) schema from database """
 		sql = u"DROP SCHEMA %s" % self.quoteId(schema)
 		self._execute_and_commit(sql)
+		self.metadataCache.invalidateSchema(schema)
 		
 	def renameSchema(self, schema, new_schema):
 		""" rename a schema in database """
 		sql = u"ALTER SCHEMA %s RENAME TO %s" % (self.quoteId(schema), self.quoteId(new_schema))
 		self._execute_and_commit(sql)
+		self.metadataCache.invalidateSchema(schema)
 
 
 	def runVacuum(self):
@@ -735,11 +1117,13 @@ class PostGisDBConnector(DBConnector):
 		self.connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED)
 
 
+	@invalidatesMetadata
 	def addTableColumn(self, table, field_def):
 		""" add a column to table """
 		sql = u"ALTER TABLE %s ADD %s" % (self.quoteId(table), field_def)
 		self._execute_and_commit(sql)
 		
+	@invalidatesMetadata
 	def deleteTableColumn(self, table, column):
 		""" delete column from a table """
 		if self.isGeometryColumn(table, column):
@@ -751,6 +1135,7 @@ class PostGisDBConnector(DBConnector):
 			sql = u"ALTER TABLE %s DROP %s" % (self.quoteId(table), self.quoteId(column))
 		self._execute_and_commit(sql)
 
+	@invalidatesMetadata
 	def updateTableColumn(self, table, column, new_name=None, data_type=None, not_null=None, default=None):
 		if new_name == None and data_type == None and not_null == None and default == None:
 			return
@@ -817,6 +1202,19 @@ class PostGisDBConnector(DBConnector):
 		self._execute(c, sql)
 		return c.fetchone()[0] == 't'
 
+	def getGeometryColumnType(self, table, geom_column):
+		if not self.has_geometry_columns or not self.has_geometry_columns_access:
+			return None
+		schema, tablename = self.getSchemaTableName(table)
+		schema_where = u"f_table_schema = %s" % self.quoteString(schema) if schema else u"f_table_schema = current_schema()"
+		c = self._get_cursor()
+		sql = u"SELECT type FROM geometry_columns WHERE %s AND f_table_name = %s AND f_geometry_column = %s" % (schema_where, self.quoteString(tablename), self.quoteString(geom_column))
+		self._execute(c, sql)
+		row = c.fetchone()
+		self._close_cursor(c)
+		return unicode(row[0]).upper() if row != None and row[0] != None else None
+
+	@invalidatesMetadata
 	def addGeometryColumn(self, table, geom_column='geom', geom_type='POINT', srid=-1, dim=2):
 		schema, tablename = self.getSchemaTableName(table)
 		schema_part = u"%s, " % self.quoteString(schema) if schema else ""
@@ -828,44 +1226,68 @@ class PostGisDBConnector(DBConnector):
 		return self.deleteTableColumn(table, geom_column)
 
 
+	@invalidatesMetadata
 	def addTableUniqueConstraint(self, table, column):
 		""" add a unique constraint to a table """
 		sql = u"ALTER TABLE %s ADD UNIQUE (%s)" % (self.quoteId(table), self.quoteId(column))
 		self._execute_and_commit(sql)
 
+	@invalidatesMetadata
 	def deleteTableConstraint(self, table, constraint):
 		""" delete constraint in a table """
 		sql = u"ALTER TABLE %s DROP CONSTRAINT %s" % (self.quoteId(table), self.quoteId(constraint))
 		self._execute_and_commit(sql)
 
+	@invalidatesMetadata
 	def addTablePrimaryKey(self, table, column):
 		""" add a primery key (with one column) to a table """
 		sql = u"ALTER TABLE %s ADD PRIMARY KEY (%s)" % (self.quoteId(table), self.quoteId(column))
 		self._execute_and_commit(sql)
 
 
+	@invalidatesMetadata
 	def createTableIndex(self, table, name, column):
 		""" create index on one column using default options """
 		sql = u"CREATE INDEX %s ON %s (%s)" % (self.quoteId(name), self.quoteId(table), self.quoteId(column))
 		self._execute_and_commit(sql)
 		
+	@invalidatesMetadata
 	def deleteTableIndex(self, table, name):
 		schema, tablename = self.getSchemaTableName(table)
 		sql = u"DROP INDEX %s" % self.quoteId( (schema, name) )
 		self._execute_and_commit(sql)
 
+	@invalidatesMetadata
 	def createSpatialIndex(self, table, geom_column='geom'):
 		schema, tablename = self.getSchemaTableName(table)
 		idx_name = self.quoteId(u"sidx_%s_%s" % (tablename, geom_column))
 		sql = u"CREATE INDEX %s ON %s USING GIST(%s)" % (idx_name, self.quoteId(table), self.quoteId(geom_column))
 		self._execute_and_commit(sql)
 
+	@invalidatesMetadata
 	def deleteSpatialIndex(self, table, geom_column='geom'):
 		schema, tablename = self.getSchemaTableName(table)
 		idx_name = self.quoteId(u"sidx_%s_%s" % (tablename, geom_column))
 		return self.dropTableIndex(table, idx_name)
 
 
+	def cancel(self, connection=None):
+		""" interrupt the query running on the connection """
+		if connection == None:
+			connection = self.connection
+		try:
+			connection.cancel()
+		except self.error_types(), e:
+			return False
+		return True
+
+
+	def setStatementTimeout(self, msecs):
+		c = self._get_cursor()
+		self._execute(c, u"SET LOCAL statement_timeout = %d" % msecs)
+		return True
+
+
 	def execution_error_types(self):
 		return psycopg2.Error, psycopg2.ProgrammingError
 
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+Name                 : DB Manager
+Description          : Database manager plugin for QuantumGIS
+Date                 : May 23, 2011
+copyright            : (C) 2011 by Giuseppe Sucameli
+email                : brush.tyler@gmail.com
+
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from ..data_import import VectorLayerImporter
+from ..plugin import BaseError
+
+import struct
+import binascii
+
+class PGVectorLayerImporter(VectorLayerImporter):
+	""" load the features by COPY FROM STDIN, one COPY per batch.
+		When the geometries are reprojected by the server they're copied
+		into a staging table, then moved to the table by ST_Transform. """
+
+	def __init__(self, *args, **kwargs):
+		VectorLayerImporter.__init__(self, *args, **kwargs)
+		self.sourceSrid = self.srid	# srid of the loaded geometries
+		self.staging = None
+
+	def setServerTransform(self, enable):
+		if not enable or self.transform == None or self.srid <= 0:
+			return False
+
+		crs = self.layer.crs()
+		sourceSrid = crs.postgisSrid() if crs.isValid() else -1
+		if sourceSrid <= 0:
+			return False
+		# load the geometries as they are
+		self.transform = None
+		self.sourceSrid = sourceSrid
+		return True
+
+	def isServerTransform(self):
+		return self.sourceSrid != self.srid
+
+	def beginLoad(self):
+		if self.isServerTransform():
+			self.staging = self.connector.createStagingTable(self.table, self.geomColumn)
+
+	def endLoad(self):
+		if self.staging == None:
+			return
+		try:
+			self.connector._rollback()
+			self.connector.deleteStagingTable(self.staging)
+		except BaseError:
+			pass	# the connection is broken, the staging table is left behind
+		self.staging = None
+
+	def writeRows(self, rows):
+		if self.staging == None:
+			self.connector.copyFrom(self.table, self.columns, rows)
+			return
+		self.connector.copyFrom(self.staging, self.columns, rows)
+		self.connector.insertFromStagingTable(self.table, self.staging, self.columns, self.geomColumn, self.srid)
+
+	def geometryValue(self, geom):
+		""" return the geometry as hex EWKB, i.e. WKB with the srid """
+		wkb = VectorLayerImporter.geometryValue(self, geom)
+		if wkb == None:
+			return None
+		if self.sourceSrid > 0:
+			order = '<' if ord(wkb[0]) == 1 else '>'
+			wkbType = struct.unpack(order + 'I', wkb[1:5])[0]
+			wkb = wkb[0] + struct.pack(order + 'Ii', wkbType | 0x20000000, self.sourceSrid) + wkb[5:]
+		return binascii.hexlify(wkb)
+
+	def finishTable(self):
+		VectorLayerImporter.finishTable(self)
+		# update the planner statistics for the new rows
+		self.connector.runVacuumAnalyze(self.table)
@@ -24,20 +24,53 @@ from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
 from ..data_model import TableDataModel, SqlResultModel
-from ..plugin import BaseError
+from ..plugin import BaseError, DbError
 
 class PGTableDataModel(TableDataModel):
+	""" model for the contents of a PostGIS table.
+
+		If the table has a unique key the rows are read by keyset
+		pagination (WHERE key > last key ORDER BY key LIMIT n), otherwise
+		a scrollable named cursor is opened on the whole table.
+	"""
+
 	def __init__(self, table, parent=None):
 		self.cursor = None
+		self.cursorPos = 0
+		self.keyColumn = None
+		self._lastKeys = {}	# row number -> key value of that row
 		TableDataModel.__init__(self, table, parent)
 
-		if self.table.rowCount == None:
+		# counting the rows of a big table is a sequential scan, so use the
+		# estimation unless it's less than 100 rows
+		if self.table.rowCount == None and self.table.estimatedRowCount < 100:
+			self.table.blockSignals(True)
 			self.table.refreshRowCount()
-			if self.table.rowCount == None:
-				return
+			self.table.blockSignals(False)
 
 		self.connect(self.table, SIGNAL("aboutToChange"), self._deleteCursor)
-		self._createCursor()
+
+		settings = QSettings()
+		if settings.value("/DB_Manager/tableViewer/keysetPagination", True).toBool():
+			self.keyColumn = self._getKeysetColumn()
+		if self.keyColumn == None:
+			self._createCursor()
+
+	def _getKeysetColumn(self):
+		""" return the primary key (if it's one column only) or a not null
+			field with an unique index on it only """
+		pkcols = filter(lambda x: x.primaryKey, self.table.fields())
+		if len(pkcols) == 1:
+			return pkcols[0]
+
+		# a column of a composite key isn't unique
+		indexes = self.table.indexes()
+		for idx in indexes if indexes != None else []:
+			if idx.isUnique and len(idx.columns) == 1:
+				fld = idx.fields().get( idx.columns[0] )
+				if fld != None and fld.notNull:
+					return fld
+		return None
 
 	def _createCursor(self):
 		fields_txt = u", ".join(self.fields)
@@ -47,6 +80,7 @@ class PGTableDataModel(TableDataModel):
 		self.cursor = self.db._get_cursor(self.table.name)
 		sql = u"SELECT %s FROM %s" % (fields_txt, table_txt)
 		self.db._execute(self.cursor, sql)
+		self.cursorPos = 0
 
 	def _sanitizeTableField(self, field):
 		# get fields, ignore geometry columns
@@ -59,26 +93,81 @@ class PGTableDataModel(TableDataModel):
 	def _deleteCursor(self):
 		self.db._close_cursor(self.cursor)
 		self.cursor = None
+		self._lastKeys = {}
+		self.clearCache()
 
 	def __del__(self):
 		self.disconnect(self.table, SIGNAL("aboutToChange"), self._deleteCursor)
 		self._deleteCursor()
 		pass	#print "PGTableModel.__del__"
 
-	def fetchMoreData(self, row_start):
+	def fetchMoreData(self, row_start, count):
+		if self.keyColumn != None:
+			return self._fetchPage(row_start, count)
+
 		if not self.cursor:
 			self._createCursor()
 
-		try:
-			self.cursor.scroll(row_start, mode='absolute')
-		except self.db.error_types():
-			self._deleteCursor()
-			return self.fetchMoreData(row_start)
-
-		self.resdata = self.cursor.fetchmany(self.fetchedCount)
-		self.fetchedFrom = row_start
+		# no need to move the cursor when reading sequentially
+		if self.cursorPos != row_start:
+			try:
+				self.cursor.scroll(row_start, mode='absolute')
+			except self.db.error_types():
+				self._deleteCursor()
+				return self.fetchMoreData(row_start, count)
+
+		rows = self.cursor.fetchmany(count)
+		self.cursorPos = row_start + len(rows)
+		return rows
+
+	def _fetchPage(self, row_start, count):
+		""" read rows by keyset pagination, no transaction is kept opened """
+		key = self.db.quoteId( self.keyColumn.name )
+		sql = u"SELECT %s, %s::text FROM %s" % (u", ".join(self.fields), key, self.db.quoteId( (self.table.schemaName(), self.table.name) ))
+
+		if row_start == 0:
+			sql += u" ORDER BY %s LIMIT %d" % (key, count)
+		elif self._lastKeys.has_key( row_start - 1 ):
+			sql += u" WHERE %s > %s ORDER BY %s LIMIT %d" % (key, self.db.quoteString( self._lastKeys[ row_start - 1 ] ), key, count)
+		else:
+			# jump to a page never seen, the next ones will be read by key
+			sql += u" ORDER BY %s LIMIT %d OFFSET %d" % (key, count, row_start)
+
+		c = self.db._execute(None, sql)
+		rows = self.db._fetchall(c)
+		self.db._close_cursor(c)
+		self.db._commit()
+
+		# remember the key at the end of each block, the key column is the last one
+		for i in range(len(rows)):
+			if (row_start + i + 1) % self.blockSize == 0 or i == len(rows)-1:
+				self._lastKeys[ row_start + i ] = rows[i][-1]
+		return rows
 
 
 class PGSqlResultModel(SqlResultModel):
-	pass
+	# errors of the cursor declarations that the statement can't be declared
+	# as cursor: feature_not_supported (e.g. data-modifying WITH) and
+	# syntax_error (e.g. SELECT INTO), neither one runs the statement
+	UNDECLARABLE_SQLSTATES = ('0A000', '42601')
+
+	def _createCursor(self, sql):
+		# use a server-side cursor for queries returning rows, so only
+		# the fetched rows are transferred
+		if QString(sql).trimmed().contains( QRegExp(u"^(SELECT|WITH|VALUES|TABLE)\\b", Qt.CaseInsensitive) ):
+			c = self.db._get_cursor("sqlwindow")
+			try:
+				return self.db._execute(c, sql)
+			except DbError, e:
+				self.db._close_cursor(c)
+				if e.sqlstate not in self.UNDECLARABLE_SQLSTATES:
+					raise
+				# e.g. SELECT INTO or data-modifying WITH can't be used in a
+				# cursor declaration, run them as plain queries
+
+		return SqlResultModel._createCursor(self, sql)
+
+	def _hasResultRows(self, c):
+		# named cursors have no description until the first fetch
+		return c.name != None or SqlResultModel._hasResultRows(self, c)
 
@@ -28,7 +28,27 @@ from ..html_elems import HtmlSection, HtmlParagraph, HtmlList, HtmlTable, HtmlTa
 
 class PGTableInfo(TableInfo):
 	def __init__(self, table):
-		self.table = table
+		TableInfo.__init__(self, table)
+
+
+	def sections(self):
+		ret = TableInfo.sections(self)
+		ret.insert( ret.index('triggers') + 1, 'rules' )
+		return ret
+
+	def sectionQueries(self, name):
+		if name != 'general':
+			return TableInfo.sectionQueries(self, name)
+
+		ret = []
+		if self.table.rowCount == None and self.table.estimatedRowCount < 100:
+			ret.append( ('getTableRowCount', self.tableKey()) )
+		if self.table.schema():
+			ret.append( ('getSchemaPrivileges', self.table.schemaName()) )
+		ret.append( ('getTablePrivileges', self.tableKey()) )
+		if not self.table.isView:
+			ret.append( ('getTableFields', self.tableKey()) )
+		return ret
 
 
 	def generalInfo(self):
@@ -36,11 +56,7 @@ class PGTableInfo(TableInfo):
 
 		# if the estimation is less than 100 rows, try to count them - it shouldn't take long time
 		if self.table.rowCount == None and self.table.estimatedRowCount < 100:
-			# row count information is not displayed yet, so just block 
-			# table signals to avoid double refreshing (infoViewer->refreshRowCount->tableChanged->infoViewer)
-			self.table.blockSignals(True)
-			self.table.refreshRowCount()
-			self.table.blockSignals(False)
+			self._refreshRowCount()
 
 		tbl = [
 			("Relation type:", "View" if self.table.isView else "Table"), 
@@ -56,19 +72,19 @@ class PGTableInfo(TableInfo):
 
 		# privileges
 		# has the user access to this schema?
-		schema_priv = self.table.database().connector.getSchemaPrivileges(self.table.schemaName()) if self.table.schema() else None
+		schema_priv = self.connectorCall('getSchemaPrivileges', self.table.schemaName()) if self.table.schema() else None
 		if schema_priv == None:
 			pass
 		elif schema_priv[1] == False:	# no usage privileges on the schema
 			tbl.append( ("Privileges:", u"<warning> This user doesn't have usage privileges for this schema!" ) )
 		else:
-			table_priv = self.table.database().connector.getTablePrivileges( (self.table.schemaName(), self.table.name) )
+			table_priv = self.connectorCall( 'getTablePrivileges', self.tableKey() )
 			privileges = []
 			if table_priv[0]:
 				privileges.append("select")
 
 				if self.table.rowCount == None or self.table.rowCount >= 0:
-					tbl.append( ("Rows (counted):", self.table.rowCount if self.table.rowCount != None else 'Unknown (<a href="action:rows/count">find out</a>)') )
+					tbl.append( ("Rows (counted):", self.rowCountInfo()) )
 
 			if table_priv[1]: privileges.append("insert")
 			if table_priv[2]: privileges.append("update")
@@ -162,17 +178,15 @@ class PGTableInfo(TableInfo):
 		return HtmlTable( tbl, {"class":"header"} )
 
 
-	def getTableInfo(self):
-		ret = TableInfo.getTableInfo(self)
+	def sectionHtml(self, name):
+		if name != 'rules':
+			return TableInfo.sectionHtml(self, name)
 
-		# rules
+		self._loadPrefetchedMetadata()
 		rules_details = self.rulesDetails()
 		if rules_details == None:
-			pass
-		else:
-			ret.append( HtmlSection( 'Rules', rules_details ) )
-
-		return ret
+			return None
+		return HtmlSection( 'Rules', rules_details )
 
 class PGVectorTableInfo(PGTableInfo, VectorTableInfo):
 	def __init__(self, table):
@@ -182,6 +196,11 @@ class PGVectorTableInfo(PGTableInfo, VectorTableInfo):
 	def spatialInfo(self):
 		return VectorTableInfo.spatialInfo(self)
 
+	def sectionQueries(self, name):
+		if name == 'spatial':
+			return VectorTableInfo.sectionQueries(self, name)
+		return PGTableInfo.sectionQueries(self, name)
+
 class PGRasterTableInfo(PGTableInfo, RasterTableInfo):
 	def __init__(self, table):
 		RasterTableInfo.__init__(self, table)
@@ -189,3 +208,8 @@ class PGRasterTableInfo(PGTableInfo, RasterTableInfo):
 
 	def spatialInfo(self):
 		return RasterTableInfo.spatialInfo(self)
+
+	def sectionQueries(self, name):
+		if name == 'spatial':
+			return RasterTableInfo.sectionQueries(self, name)
+		return PGTableInfo.sectionQueries(self, name)
@@ -158,6 +158,10 @@ class PGDatabase(Database):
 		from .data_model import PGSqlResultModel
 		return PGSqlResultModel(self, sql, parent)
 
+	def vectorLayerImporter(self, layer, table, geomColumn=None, pkColumn=None, outCrs=None, createTable=True, overwrite=False, spatialIndex=False):
+		from .data_import import PGVectorLayerImporter
+		return PGVectorLayerImporter(self, layer, table, geomColumn, pkColumn, outCrs, createTable, overwrite, spatialIndex)
+
 
 	def registerDatabaseActions(self, mainWindow):
 		Database.registerDatabaseActions(self, mainWindow)
@@ -187,13 +191,19 @@ class PGSchema(Schema):
 		Schema.__init__(self, db)
 		self.oid, self.name, self.owner, self.perms, self.comment = row
 
+	def catalogKey(self):
+		return self.oid
+
 
 class PGTable(Table):
 	def __init__(self, row, db, schema=None):
 		Table.__init__(self, db, schema)
-		self.name, schema_name, self.isView, self.owner, self.estimatedRowCount, self.pages, self.comment = row
+		self.name, schema_name, self.isView, self.owner, self.estimatedRowCount, self.pages, self.comment, self.oid, self.changeMarker = row
 		self.estimatedRowCount = int(self.estimatedRowCount)
 
+	def catalogKey(self):
+		return (self.oid, getattr(self, 'geomColumn', None))
+
 	def runVacuumAnalyze(self):
 		self.aboutToChange()
 		self.database().connector.runVacuumAnalyze( (self.schemaName(), self.name) )
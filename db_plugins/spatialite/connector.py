@@ -23,10 +23,12 @@ email                : brush.tyler@gmail.com
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
-from ..connector import DBConnector
+from ..connector import DBConnector, cachedMetadata, invalidatesMetadata
 from ..plugin import ConnectionError, DbError, Table
 
 from pyspatialite import dbapi2 as sqlite
+import time
+import struct
 
 def classFactory():
 	return SpatiaLiteDBConnector
@@ -39,11 +41,9 @@ class SpatiaLiteDBConnector(DBConnector):
 		if not QFile.exists( self.dbname ):
 			raise ConnectionError( u'"%s" not found' % self.dbname )
 
-		try:
-			self.connection = sqlite.connect( self._connectionInfo() )
-
-		except self.connection_error_types(), e:
-			raise ConnectionError(e)
+		# the connection is used by the GUI thread only, the threads running
+		# the queries open their own connections (see DbTask)
+		self.connection = self._connect()
 
 		self._checkSpatial()
 		self._checkRaster()
@@ -52,6 +52,14 @@ class SpatiaLiteDBConnector(DBConnector):
 
 	def _connectionInfo(self):
 		return unicode(self.dbname)
+
+	def _connect(self):
+		try:
+			# a connection can be opened by a thread and used by another one,
+			# but never by two threads at the same time
+			return sqlite.connect( self._connectionInfo(), check_same_thread=False )
+		except self.connection_error_types(), e:
+			raise ConnectionError(e)
 	
 	def _checkSpatial(self):
 		""" check if it's a valid spatialite db """
@@ -188,6 +196,14 @@ class SpatiaLiteDBConnector(DBConnector):
 
 		return sorted( items, cmp=lambda x,y: cmp(x[1], y[1]) )
 
+	def getTableNames(self):
+		""" get (schema, name) of all the tables and views, it's used to
+			search them without reading all the table details """
+		c = self._get_cursor()
+		sql = u"SELECT NULL, name FROM sqlite_master WHERE type IN ('table', 'view')"
+		self._execute(c, sql)
+		return c.fetchall()
+
 	def getVectorTables(self, schema=None):
 		""" get list of table with a geometry column
 			it returns:
@@ -264,6 +280,43 @@ class SpatiaLiteDBConnector(DBConnector):
 		ret = c.fetchone()
 		return ret[0] if ret is not None else None
 
+	def prefetchTablesMetadata(self, schema=None):
+		""" read fields, indexes and triggers of all the tables by one query
+			for each of them. It needs the pragma table-valued functions (SQLite 3.16) """
+		c = self._get_cursor()
+		sql = u"SELECT name FROM sqlite_master WHERE type IN ('table', 'view')"
+		self._execute(c, sql)
+		# table name -> { kind: rows }, names are case insensitive
+		metadata = {}
+		for row in c.fetchall():
+			metadata[ row[0].lower() ] = (row[0], { "fields" : [], "indexes" : [], "triggers" : [] })
+
+		sql = u"""SELECT m.name, p.cid, p.name, p.type, p."notnull", p.dflt_value, p.pk 
+				FROM sqlite_master AS m, pragma_table_info(m.name) AS p 
+				WHERE m.type IN ('table', 'view') 
+				ORDER BY m.name, p.cid"""
+		self._execute(c, sql)
+		for row in c.fetchall():
+			if metadata.has_key( row[0].lower() ):
+				metadata[ row[0].lower() ][1]["fields"].append( row[1:] )
+
+		for tablename, indexes in self._getIndexCatalog().iteritems():
+			if metadata.has_key( tablename.lower() ):
+				metadata[ tablename.lower() ][1]["indexes"] = indexes
+
+		sql = u"SELECT tbl_name, name, sql FROM sqlite_master WHERE type = 'trigger'"
+		self._execute(c, sql)
+		for row in c.fetchall():
+			if metadata.has_key( row[0].lower() ):
+				metadata[ row[0].lower() ][1]["triggers"].append( row[1:] )
+		c.close()
+
+		for tablename, tablemeta in metadata.itervalues():
+			for kind, rows in tablemeta.iteritems():
+				self.metadataCache.put( (None, tablename), kind, rows )
+		return True
+
+	@cachedMetadata("fields")
 	def getTableFields(self, table):
 		""" return list of columns in table """
 		c = self._get_cursor()
@@ -271,15 +324,50 @@ class SpatiaLiteDBConnector(DBConnector):
 		self._execute(c, sql)
 		return c.fetchall()
 
+	def _getIndexCatalog(self, table=None):
+		""" read the indexes of a table (or of all the tables) by a single query
+			joining the pragma table-valued functions (SQLite 3.16).
+			Return a dict table name -> list of [num, name, unique, columns] """
+		if table != None:
+			schema, tablename = self.getSchemaTableName(table)
+			table_where = u" AND lower(m.name) = lower(%s) " % self.quoteString(tablename)
+		else:
+			table_where = u""
+
+		sql = u"""SELECT m.name, il.seq, il.name, il."unique", ii.cid 
+				FROM sqlite_master AS m, pragma_index_list(m.name) AS il, pragma_index_info(il.name) AS ii 
+				WHERE m.type = 'table' %s 
+				ORDER BY m.name, il.seq, ii.seqno""" % table_where
+		c = self._get_cursor()
+		self._execute(c, sql)
+		rows = c.fetchall()
+		c.close()
+
+		catalog = {}
+		for tablename, num, name, unique, cid in rows:
+			indexes = catalog.setdefault( tablename, [] )
+			if len(indexes) == 0 or indexes[-1][1] != name:
+				indexes.append( [num, name, unique, []] )
+			indexes[-1][3].append( cid )
+		return catalog
+
+	@cachedMetadata("indexes")
 	def getTableIndexes(self, table):
 		""" get info about table's indexes """
+		try:
+			catalog = self._getIndexCatalog(table)
+			return catalog.values()[0] if len(catalog) > 0 else []
+		except DbError:
+			pass
+
+		# the pragma functions aren't available, read every index info
 		c = self._get_cursor()
 		sql = u"PRAGMA index_list(%s)" % (self.quoteId(table))
 		self._execute(c, sql)
 		indexes = c.fetchall()
 
 		for i, idx in enumerate(indexes):
-			num, name, unique = idx
+			num, name, unique = idx[:3]
 			sql = u"PRAGMA index_info(%s)" % (self.quoteId(name))
 			self._execute(c, sql)
 
@@ -292,9 +380,11 @@ class SpatiaLiteDBConnector(DBConnector):
 
 		return indexes
 
+	@cachedMetadata("constraints")
 	def getTableConstraints(self, table):
 		return None
 
+	@cachedMetadata("triggers")
 	def getTableTriggers(self, table):
 		c = self._get_cursor()
 		schema, tablename = self.getSchemaTableName(table)
@@ -302,10 +392,11 @@ class SpatiaLiteDBConnector(DBConnector):
 		self._execute(c, sql)
 		return c.fetchall()
 
-	def deleteTableTrigger(self, trigger, table=None):
-		""" delete trigger """
+	def deleteTableTrigger(self, trigger, table):
+		""" delete trigger on table """
 		sql = u"DROP TRIGGER %s" % self.quoteId(trigger)
 		self._execute_and_commit(sql)
+		self.metadataCache.invalidate(table, "triggers")
 
 
 	def getTableExtent(self, table, geom):
@@ -322,6 +413,32 @@ class SpatiaLiteDBConnector(DBConnector):
 		self._execute(c, sql)
 		return c.fetchone()
 	
+	def getTableIndexedExtent(self, table, geom):
+		""" find out table extent from the bounds of the root node of the
+			R*Tree spatial index, much faster than scanning the whole table.
+			Return None if there's no spatial index """
+		if not self.hasSpatialIndex(table, geom):
+			return
+
+		schema, tablename = self.getSchemaTableName(table)
+		c = self._get_cursor()
+		sql = u"SELECT data FROM %s WHERE nodeno = 1" % self.quoteId( u"idx_%s_%s_node" % (tablename, geom) )
+		self._execute(c, sql)
+		row = c.fetchone()
+		if row == None:
+			return
+		data = str(row[0])
+
+		# the node is the tree depth and the number of cells (2 bytes each),
+		# then the cells: rowid (8 bytes) and minx, maxx, miny, maxy (float32).
+		# The coordinates are rounded outwards, so the extent could be a bit larger
+		count = struct.unpack('>H', data[2:4])[0]
+		if count <= 0:
+			return	# empty table
+		cells = map(lambda i: struct.unpack('>q4f', data[4 + i*24 : 28 + i*24]), range(count))
+		return ( min(map(lambda x: x[1], cells)), min(map(lambda x: x[3], cells)),
+				max(map(lambda x: x[2], cells)), max(map(lambda x: x[4], cells)) )
+
 	def getViewDefinition(self, view):
 		""" returns definition of the view """
 		schema, tablename = self.getSchemaTableName(view)
@@ -362,6 +479,7 @@ class SpatiaLiteDBConnector(DBConnector):
 		return False
 
 
+	@invalidatesMetadata
 	def createTable(self, table, field_defs, pkey):
 		""" create ordinary table
 				'fields' is array containing field definitions
@@ -379,6 +497,7 @@ class SpatiaLiteDBConnector(DBConnector):
 		self._execute_and_commit(sql)
 		return True
 
+	@invalidatesMetadata
 	def deleteTable(self, table):
 		""" delete table from the database """
 		if self.isRasterTable(table):
@@ -401,6 +520,7 @@ class SpatiaLiteDBConnector(DBConnector):
 		sql = u"DELETE FROM %s" % self.quoteId(table)
 		self._execute_and_commit(sql)
 		
+	@invalidatesMetadata
 	def renameTable(self, table, new_table):
 		""" rename a table """
 		schema, tablename = self.getSchemaTableName(table)
@@ -422,13 +542,16 @@ class SpatiaLiteDBConnector(DBConnector):
 
 		self._commit()
 
+	@invalidatesMetadata
 	def moveTable(self, table, new_table, new_schema=None):
 		return self.renameTable(table, new_table)
 		
+	@invalidatesMetadata
 	def createView(self, view, query):
 		sql = u"CREATE VIEW %s AS %s" % (self.quoteId(view), query)
 		self._execute_and_commit(sql)
 	
+	@invalidatesMetadata
 	def deleteView(self, view):
 		sql = u"DROP VIEW %s" % self.quoteId(view)
 		self._execute_and_commit(sql)
@@ -438,16 +561,72 @@ class SpatiaLiteDBConnector(DBConnector):
 		return self.renameTable(view, new_name)
 
 
+	GEOMETRY_OUTPUT_FUNCTIONS = { 'wkt': 'AsText', 'geojson': 'AsGeoJSON', 'wkb': 'AsBinary', 'transform': 'Transform' }
+
 	def runVacuum(self):
 		""" run vacuum on the db """
 		self._execute_and_commit("VACUUM")
 
+	# pragmas set while bulk loading: no rollback journal on disk, no
+	# fsync and a bigger page cache. The db may be corrupted if the
+	# system crashes during the load.
+	BULK_LOAD_PRAGMAS = [ ('journal_mode', 'MEMORY'), ('synchronous', 'OFF'), ('cache_size', '100000') ]
+
+	def beginBulkLoad(self):
+		""" switch the pragmas to the load-friendly values, return the
+			previous values to pass to endBulkLoad() """
+		self._commit()	# pragmas can't be changed within a transaction
+		c = self._get_cursor()
+		saved = []
+		for name, value in self.BULK_LOAD_PRAGMAS:
+			self._execute(c, u"PRAGMA %s" % name)
+			saved.append( (name, c.fetchone()[0]) )
+			self._execute(c, u"PRAGMA %s = %s" % (name, value))
+			c.fetchall()
+		return saved
+
+	def endBulkLoad(self, saved):
+		""" restore the pragmas, the rows not committed yet are discarded """
+		self._rollback()
+		c = self._get_cursor()
+		for name, value in saved:
+			self._execute(c, u"PRAGMA %s = %s" % (name, value))
+			c.fetchall()
+
+	def insertRows(self, table, columns, rows, geomColumn=None, srid=-1):
+		""" insert the rows by a prepared statement, in the current transaction.
+			The value of the geometry column is its WKB """
+		values = []
+		for col in columns:
+			if col == geomColumn:
+				values.append( u"GeomFromWKB(?, %d)" % srid )
+			else:
+				values.append( u"?" )
+
+		sql = u"INSERT INTO %s (%s) VALUES (%s)" % (self.quoteId(table), u", ".join( map(self.quoteId, columns) ), u", ".join( values ))
+		if geomColumn != None:
+			geomIndex = columns.index(geomColumn)
+			rows = map(lambda row: row[:geomIndex] + [ sqlite.Binary(row[geomIndex]) if row[geomIndex] != None else None ] + row[geomIndex+1:], rows)
+
+		c = self._get_cursor()
+		try:
+			c.executemany(sql, rows)
+
+		except self.connection_error_types(), e:
+			raise ConnectionError(e)
+
+		except self.execution_error_types(), e:
+			self._rollback()
+			raise DbError(e, sql)
+
 
+	@invalidatesMetadata
 	def addTableColumn(self, table, field_def):
 		""" add a column to table """
 		sql = u"ALTER TABLE %s ADD %s" % (self.quoteId(table), field_def)
 		self._execute_and_commit(sql)
 		
+	@invalidatesMetadata
 	def deleteTableColumn(self, table, column):
 		""" delete column from a table """
 		if not self.isGeometryColumn(table, column):
@@ -458,6 +637,7 @@ class SpatiaLiteDBConnector(DBConnector):
 		sql = u"SELECT DiscardGeometryColumn(%s, %s)" % (self.quoteString(tablename), self.quoteString(column))
 		self._execute_and_commit(sql)
 		
+	@invalidatesMetadata
 	def updateTableColumn(self, table, column, new_name, new_data_type=None, new_not_null=None, new_default=None):
 		return False	# column editing not supported
 
@@ -484,6 +664,29 @@ class SpatiaLiteDBConnector(DBConnector):
 		self._execute(c, sql)
 		return c.fetchone()[0] == 't'
 
+	# geometry types by code, the geometry_columns of SpatiaLite 4 stores
+	# them as integers (+1000 for Z, +2000 for M, +3000 for ZM)
+	GEOMETRY_TYPE_NAMES = { 0: 'GEOMETRY', 1: 'POINT', 2: 'LINESTRING', 3: 'POLYGON', 4: 'MULTIPOINT', 5: 'MULTILINESTRING', 6: 'MULTIPOLYGON', 7: 'GEOMETRYCOLLECTION' }
+
+	def getGeometryColumnType(self, table, geom_column):
+		if not self.has_geometry_columns:
+			return None
+		schema, tablename = self.getSchemaTableName(table)
+		c = self._get_cursor()
+		sql = u"SELECT * FROM geometry_columns WHERE lower(f_table_name) = lower(%s) AND lower(f_geometry_column) = lower(%s)" % (self.quoteString(tablename), self.quoteString(geom_column))
+		self._execute(c, sql)
+		columns = self._get_cursor_columns(c)
+		row = c.fetchone()
+		if row == None:
+			return None
+		row = dict( zip( map(lambda x: unicode(x).lower(), columns), row ) )
+		if row.get('type') != None:
+			return unicode(row['type']).upper()
+		if row.get('geometry_type') != None:
+			return self.GEOMETRY_TYPE_NAMES.get( int(row['geometry_type']) % 1000 )
+		return None
+
+	@invalidatesMetadata
 	def addGeometryColumn(self, table, geom_column='geometry', geom_type='POINT', srid=-1, dim=2):
 		schema, tablename = self.getSchemaTableName(table)
 		sql = u"SELECT AddGeometryColumn(%s, %s, %d, %s, %s)" % (self.quoteString(tablename), self.quoteString(geom_column), srid, self.quoteString(geom_type), dim)
@@ -493,32 +696,38 @@ class SpatiaLiteDBConnector(DBConnector):
 		return self.deleteTableColumn(table, geom_column)
 
 
+	@invalidatesMetadata
 	def addTableUniqueConstraint(self, table, column):
 		""" add a unique constraint to a table """
 		return False	# constraints not supported
 
+	@invalidatesMetadata
 	def deleteTableConstraint(self, table, constraint):
 		""" delete constraint in a table """
 		return False	# constraints not supported
 
 
+	@invalidatesMetadata
 	def addTablePrimaryKey(self, table, column):
 		""" add a primery key (with one column) to a table """
 		sql = u"ALTER TABLE %s ADD PRIMARY KEY (%s)" % (self.quoteId(table), self.quoteId(column))
 		self._execute_and_commit(sql)
 
 
+	@invalidatesMetadata
 	def createTableIndex(self, table, name, column, unique=False):
 		""" create index on one column using default options """
 		unique_str = u"UNIQUE" if unique else ""
 		sql = u"CREATE %s INDEX %s ON %s (%s)" % (unique_str, self.quoteId(name), self.quoteId(table), self.quoteId(column))
 		self._execute_and_commit(sql)
 		
+	@invalidatesMetadata
 	def deleteTableIndex(self, table, name):
 		schema, tablename = self.getSchemaTableName(table)
 		sql = u"DROP INDEX %s" % self.quoteId( (schema, name) )
 		self._execute_and_commit(sql)
 
+	@invalidatesMetadata
 	def createSpatialIndex(self, table, geom_column='geometry'):
 		if self.isRasterTable( table ):
 			return False
@@ -527,6 +736,7 @@ class SpatiaLiteDBConnector(DBConnector):
 		sql = u"SELECT CreateSpatialIndex(%s, %s)" % (self.quoteString(tablename), self.quoteString(geom_column))
 		self._execute_and_commit(sql)
 			
+	@invalidatesMetadata
 	def deleteSpatialIndex(self, table, geom_column='geometry'):
 		if self.isRasterTable( table ):
 			return False
@@ -553,6 +763,28 @@ class SpatiaLiteDBConnector(DBConnector):
 		return row != None and row[0] == 1
 
 
+	def cancel(self, connection=None):
+		""" interrupt the query running on the connection """
+		if connection == None:
+			connection = self.connection
+		connection.interrupt()
+		return True
+
+
+	def setStatementTimeout(self, msecs):
+		""" SQLite has no statement timeout, the queries are interrupted
+			by a progress handler once the time is elapsed """
+		connection = self.connection
+		if not hasattr(connection, 'set_progress_handler'):
+			return False
+		if msecs <= 0:
+			connection.set_progress_handler(None, 0)
+			return True
+		deadline = time.time() + msecs / 1000.0
+		connection.set_progress_handler(lambda: 1 if time.time() > deadline else 0, 10000)
+		return True
+
+
 	def execution_error_types(self):
 		return sqlite.Error, sqlite.ProgrammingError
 
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+Name                 : DB Manager
+Description          : Database manager plugin for QuantumGIS
+Date                 : May 23, 2011
+copyright            : (C) 2011 by Giuseppe Sucameli
+email                : brush.tyler@gmail.com
+
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from ..data_import import VectorLayerImporter
+
+class SLVectorLayerImporter(VectorLayerImporter):
+	""" load the features by prepared inserts in one transaction, with
+		the pragmas tuned for the load """
+
+	COMMIT_EVERY_BATCH = False
+	# SQLite allows one writer at a time
+	PARALLEL_LOAD = False
+	# SQLite can't add a primary key to an existing table
+	PRIMARY_KEY_AFTER_LOAD = False
+
+	def beginLoad(self):
+		self._pragmas = self.connector.beginBulkLoad()
+
+	def endLoad(self):
+		self.connector.endBulkLoad(self._pragmas)
+
+	def writeRows(self, rows):
+		self.connector.insertRows(self.table, self.columns, rows, self.geomColumn, self.srid)
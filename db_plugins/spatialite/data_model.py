@@ -27,24 +27,27 @@ from ..data_model import TableDataModel, SqlResultModel
 from ..plugin import DbError
 
 class SLTableDataModel(TableDataModel):
+	""" model for the contents of a SpatiaLite table.
+		Rows of tables are read by rowid ranges (WHERE rowid > last rowid),
+		views have no rowid so they're read by LIMIT/OFFSET """
+
 	def __init__(self, table, parent=None):
+		self._lastRowids = {}	# row number -> rowid of that row
 		TableDataModel.__init__(self, table, parent)
 
-		fields_txt = u", ".join(self.fields)
-		table_txt = self.db.quoteId( (self.table.schemaName(), self.table.name) )
-		
-		# run query and get results
-		sql = u"SELECT %s FROM %s" % (fields_txt, table_txt)
-		c = self.db._get_cursor()
-		self.db._execute(c, sql)
+		# counting the rows is a full scan of the table, so until they're
+		# counted (e.g. on demand) the row count grows while paging
+		if self.table.rowCount == None:
+			self._rowCount = self.blockSize
 
-		self.resdata = self.db._fetchall(c)
-		c.close()
-		del c
+		self.connect(self.table, SIGNAL("aboutToChange"), self._resetPaging)
 
-		self.fetchedFrom = 0
-		self.fetchedCount = len(self.resdata)
+	def isRowCountEstimated(self):
+		return self.table.rowCount == None
 
+	def _resetPaging(self):
+		self._lastRowids = {}
+		self.clearCache()
 
 	def _sanitizeTableField(self, field):
 		# get fields, ignore geometry columns
@@ -56,8 +59,32 @@ class SLTableDataModel(TableDataModel):
 			return u'GeometryType(%s)' % self.db.quoteId(field.name)
 		return self.db.quoteId(field.name)
 
-	def rowCount(self, index=None):
-		return self.fetchedCount
+	def fetchMoreData(self, row_start, count):
+		fields_txt = u", ".join(self.fields)
+		table_txt = self.db.quoteId( (self.table.schemaName(), self.table.name) )
+
+		if self.table.isView:
+			sql = u"SELECT %s FROM %s LIMIT %d OFFSET %d" % (fields_txt, table_txt, count, row_start)
+		elif row_start == 0:
+			sql = u"SELECT %s, rowid FROM %s ORDER BY rowid LIMIT %d" % (fields_txt, table_txt, count)
+		elif self._lastRowids.has_key( row_start - 1 ):
+			sql = u"SELECT %s, rowid FROM %s WHERE rowid > %d ORDER BY rowid LIMIT %d" % (fields_txt, table_txt, self._lastRowids[ row_start - 1 ], count)
+		else:
+			# jump to a page never seen, the next ones will be read by rowid
+			sql = u"SELECT %s, rowid FROM %s ORDER BY rowid LIMIT %d OFFSET %d" % (fields_txt, table_txt, count, row_start)
+
+		c = self.db._get_cursor()
+		self.db._execute(c, sql)
+		rows = self.db._fetchall(c)
+		c.close()
+		del c
+
+		if not self.table.isView:
+			# remember the rowid at the end of each block, it's the last column
+			for i in range(len(rows)):
+				if (row_start + i + 1) % self.blockSize == 0 or i == len(rows)-1:
+					self._lastRowids[ row_start + i ] = rows[i][-1]
+		return rows
 
 
 class SLSqlResultModel(SqlResultModel):
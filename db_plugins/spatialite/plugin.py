@@ -105,6 +105,10 @@ class SLDatabase(Database):
 		from .data_model import SLSqlResultModel
 		return SLSqlResultModel(self, sql, parent)
 
+	def vectorLayerImporter(self, layer, table, geomColumn=None, pkColumn=None, outCrs=None, createTable=True, overwrite=False, spatialIndex=False):
+		from .data_import import SLVectorLayerImporter
+		return SLVectorLayerImporter(self, layer, table, geomColumn, pkColumn, outCrs, createTable, overwrite, spatialIndex)
+
 
 	def registerDatabaseActions(self, mainWindow):
 		action = QAction("Run &Vacuum", self)
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+Name                 : DB Manager
+Description          : Database manager plugin for QuantumGIS
+Date                 : May 23, 2011
+copyright            : (C) 2011 by Giuseppe Sucameli
+email                : brush.tyler@gmail.com
+
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+from .plugin import BaseError
+
+import time
+import traceback
+
+class DbTask(QThread):
+	""" run a database operation in a separate thread.
+
+		Subclasses implement runTask(), the returned value is available
+		through result() once the thread emits the finished() signal,
+		the raised error through error() (other exceptions than database
+		errors are wrapped in a BaseError).
+		When the connector isn't pooled the task opens a connection of its
+		own, the only connection is left to the GUI thread.
+	"""
+
+	def __init__(self, db, parent=None, connection=None):
+		QThread.__init__(self, parent)
+		self.db = db
+		self.connector = db.connector
+		# use this connection (got by DBConnector.leaseConnection) instead of leasing one
+		self.boundConnection = connection
+
+		self._result = None
+		self._error = None
+		self._canceled = False
+		self._connection = None
+
+	def run(self):
+		connection = None
+		if self.boundConnection == None and not self.connector.isPooled():
+			# don't share the only connection with the GUI thread
+			try:
+				connection = self.connector._connect()
+			except BaseError, e:
+				self._error = e
+				return
+			self.boundConnection = connection
+
+		try:
+			self._runTask()
+		finally:
+			if connection != None:
+				self.boundConnection = None
+				try:
+					connection.close()
+				except self.connector.error_types(), e:
+					pass
+
+	def _runTask(self):
+		try:
+			if self.boundConnection != None:
+				self.connector.bindThreadConnection( self.boundConnection )
+			# the connection used by this thread (it's a leased one in pooled mode)
+			self._connection = self.connector.connection
+			self._result = self.runTask()
+
+		except BaseError, e:
+			self._error = e
+			if self._canceled:
+				# the interrupted query leaves the transaction aborted
+				try:
+					self.connector._rollback()
+				except BaseError:
+					pass
+
+		except Exception, e:
+			# don't let the thread die without a result nor an error
+			self._error = BaseError( u"".join( traceback.format_exception_only(type(e), e) ) )
+			try:
+				self.connector._rollback()
+			except BaseError:
+				pass
+
+		finally:
+			self._connection = None
+			if self.boundConnection != None:
+				self.connector.unbindThreadConnection()
+			else:
+				self.connector.releaseThreadConnection()
+
+	def runTask(self):
+		raise Exception("DbTask.runTask() is an abstract method")
+
+	def cancel(self):
+		""" stop the task, interrupting the running query (if any) """
+		self._canceled = True
+		if self._connection != None:
+			self.connector.cancel( self._connection )
+
+	def isCanceled(self):
+		return self._canceled
+
+	def result(self):
+		return self._result
+
+	def error(self):
+		return self._error
+
+	def reportProgress(self, *args):
+		self.emit( SIGNAL("progress"), *args )
+
+
+# canceled tasks whose thread is still running, a running QThread
+# must not be destroyed when its owner drops it
+_discardedTasks = []
+
+def discardTask(task):
+	""" cancel the task and keep it alive until its thread ends,
+		then it's deleted """
+	task.cancel()
+	_discardedTasks.append(task)
+	QObject.connect(task, SIGNAL("finished()"), lambda: _deleteDiscardedTask(task))
+	if not task.isRunning():
+		_deleteDiscardedTask(task)
+
+def _deleteDiscardedTask(task):
+	if task in _discardedTasks:
+		_discardedTasks.remove(task)
+		task.deleteLater()
+
+
+class TableJob(DbTask):
+	""" run an expensive statistic query on a table (e.g. count its rows)
+		calling the connector method on a connection of its own. The query
+		is aborted after timeout milliseconds, 0 means no limit """
+
+	def __init__(self, table, kind, method, args, timeout=0):
+		DbTask.__init__(self, table.database())
+		self.table = table
+		self.kind = kind
+		self.method = method
+		self.args = args
+		self.timeout = timeout
+		self.startTime = time.time()
+
+	def runTask(self):
+		if self.timeout > 0:
+			self.connector.setStatementTimeout( self.timeout )
+		return getattr(self.connector, self.method)( *self.args )
+
+	def elapsed(self):
+		""" seconds since the job was started """
+		return int( time.time() - self.startTime )
+
+
+class JobManager(QObject):
+	""" run the table jobs of a database and keep track of them,
+		only a job of each kind runs on a table at a time.
+		While they're running the jobs emit the "progress" signal
+		with the elapsed seconds every second. """
+
+	def __init__(self, parent=None):
+		QObject.__init__(self, parent)
+		self._jobs = {}	# (table, kind): job
+
+		settings = QSettings()
+		self.timeout = settings.value("/DB_Manager/jobs/statementTimeout", 300).toInt()[0] * 1000
+
+		self._timer = QTimer(self)
+		self._timer.setInterval(1000)
+		self.connect(self._timer, SIGNAL("timeout()"), self._reportProgress)
+
+	def start(self, table, kind, method, *args):
+		""" run the connector method in background, if a job of the same kind
+			is running on the table it's returned instead of starting a new one """
+		job = self.job(table, kind)
+		if job != None:
+			return job
+		job = TableJob(table, kind, method, args, self.timeout)
+		self.connect(job, SIGNAL("finished()"), self._jobFinished)
+		self._jobs[ (id(table), kind) ] = job
+		job.start()
+		if not self._timer.isActive():
+			self._timer.start()
+		return job
+
+	def job(self, table, kind):
+		""" return the running job, or None """
+		return self._jobs.get( (id(table), kind) )
+
+	def jobs(self):
+		return self._jobs.values()
+
+	def cancel(self, table, kind):
+		job = self.job(table, kind)
+		if job != None:
+			job.cancel()
+
+	def cancelAll(self):
+		for job in self._jobs.values():
+			job.cancel()
+
+	def _jobFinished(self):
+		job = self.sender()
+		job.deleteLater()
+		self._jobs.pop( (id(job.table), job.kind), None )
+		if len(self._jobs) <= 0:
+			self._timer.stop()
+		self.emit( SIGNAL("jobFinished"), job )
+
+	def _reportProgress(self):
+		for job in self._jobs.values():
+			job.reportProgress( job.elapsed() )
+
+
+class CatalogTask(DbTask):
+	""" read a list of catalog rows (e.g. schemas or tables) calling
+		method(*args), usually a connector method """
+
+	def __init__(self, db, method, *args):
+		DbTask.__init__(self, db)
+		self.method = method
+		self.args = args
+
+	def runTask(self):
+		return self.method( *self.args )
+
+
+class InfoTask(DbTask):
+	""" read the data shown by an info object (e.g. TableInfo) one section
+		at a time, the "progress" signal is emitted with the name of each
+		section once its data are available """
+
+	def __init__(self, db, info, sections):
+		DbTask.__init__(self, db)
+		self.info = info
+		self.sections = sections
+
+	def runTask(self):
+		for name in self.sections:
+			if self.isCanceled():
+				break
+			self.info.prefetchSection( name )
+			self.reportProgress( name )
+
+
+class ImportTask(DbTask):
+	""" run a vector layer importer (see data_import.VectorLayerImporter),
+		the result is the number of imported
+		features """
+
+	def __init__(self, db, importer):
+		DbTask.__init__(self, db)
+		self.importer = importer
+		self.startTime = None
+
+	def runTask(self):
+		self.startTime = time.time()
+		return self.importer.run()
+
+	def cancel(self):
+		# stop after the current batch, the connection isn't interrupted
+		self._canceled = True
+		self.importer.cancel()
+
+	def elapsed(self):
+		""" seconds since the import was started """
+		if self.startTime == None:
+			return 0
+		return time.time() - self.startTime
+
+
+class ExportTask(DbTask):
+	""" run a data exporter (see data_export.DataExporter), the result
+		is the number of exported rows """
+
+	def __init__(self, db, exporter):
+		DbTask.__init__(self, db)
+		self.exporter = exporter
+
+	def runTask(self):
+		return self.exporter.run()
+
+	def cancel(self):
+		# stop after the current chunk, the connection isn't interrupted
+		self._canceled = True
+		self.exporter.cancel()
@@ -25,7 +25,7 @@ from PyQt4.QtGui import *
 
 from qgis.core import QgsMapLayerRegistry
 
-from .db_model import DBModel
+from .db_model import DBModel, DBFilterProxyModel
 from .db_plugins.plugin import DBPlugin, Schema, Table
 
 class DBTree(QTreeView):
@@ -33,7 +33,7 @@ class DBTree(QTreeView):
 		QTreeView.__init__(self, mainWindow)
 		self.mainWindow = mainWindow
 
-		self.setModel( DBModel(self) )
+		self.setModel( DBFilterProxyModel(DBModel(self), self) )
 		self.setHeaderHidden(True)
 		self.setEditTriggers(QTreeView.EditKeyPressed|QTreeView.SelectedClicked)
 
@@ -44,8 +44,9 @@ class DBTree(QTreeView):
 		self.connect(self.selectionModel(), SIGNAL("currentChanged(const QModelIndex&, const QModelIndex&)"), self.currentItemChanged)
 		self.connect(self, SIGNAL("expanded(const QModelIndex&)"), self.itemChanged)
 		self.connect(self, SIGNAL("collapsed(const QModelIndex&)"), self.itemChanged)
+		self.connect(self, SIGNAL("collapsed(const QModelIndex&)"), self.model().cancelPopulate)
 		self.connect(self.model(), SIGNAL("dataChanged(const QModelIndex&, const QModelIndex&)"), self.modelDataChanged)
-		self.connect(self.model(), SIGNAL("notPopulated"), self.collapse)
+		self.connect(self.model().sourceModel(), SIGNAL("notPopulated"), self.sourceItemNotPopulated)
 
 	def refreshItem(self, item=None):
 		if item == None:
@@ -56,6 +57,10 @@ class DBTree(QTreeView):
 	def showSystemTables(self, show):
 		pass
 
+	def setFilterText(self, text):
+		""" show only the tables whose name contains the text """
+		self.model().setFilterText(text)
+
 	def currentItem(self):
 		indexes = self.selectedIndexes()
 		if len(indexes) <= 0:
@@ -92,6 +97,9 @@ class DBTree(QTreeView):
 		self.setCurrentIndex(index)
 		self.emit( SIGNAL('selectedItemChanged'), self.currentItem() )
 
+	def sourceItemNotPopulated(self, index):
+		self.collapse( self.model().mapFromSource(index) )
+
 	def modelDataChanged(self, indexFrom, indexTo):
 		self.itemChanged(indexTo)
 
@@ -121,6 +129,10 @@ class DBTree(QTreeView):
 		elif isinstance(item, DBPlugin) and item.database() is not None:
 			menu.addAction("Re-connect", self.reconnect)
 
+		if self.model().mapToSource(index).internalPointer().isLoading():
+			menu.addSeparator()
+			menu.addAction("Stop loading", self.stopLoading)
+
 		if not menu.isEmpty():
 			menu.exec_(ev.globalPos())
 
@@ -142,6 +154,9 @@ class DBTree(QTreeView):
 		if table is not None:
 			QgsMapLayerRegistry.instance().addMapLayer(table.toMapLayer())
 
+	def stopLoading(self):
+		self.model().cancelPopulate( self.currentIndex() )
+
 	def reconnect(self):
 		db = self.currentDatabase()
 		if db is not None:
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+Name                 : DB Manager
+Description          : Database manager plugin for QuantumGIS
+Date                 : May 23, 2011
+copyright            : (C) 2011 by Giuseppe Sucameli
+email                : brush.tyler@gmail.com
+
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+from .db_plugins.data_export import EXPORT_FORMATS
+from .db_plugins.tasks import ExportTask
+from .dlg_db_error import DlgDbError
+
+from .ui.DlgExportData_ui import Ui_DlgExportData
+
+class DlgExportData(QDialog, Ui_DlgExportData):
+	""" export the rows of a query (or a table) to a file, in background """
+
+	def __init__(self, db, sql, geomColumn=None, srid=-1, name="export", rowCount=None, parent=None):
+		QDialog.__init__(self, parent)
+		self.db = db
+		self.sql = sql
+		self.srid = srid
+		self.name = name
+		self.rowCount = rowCount	# the number of rows to export, None if unknown
+		self.task = None
+		self.setupUi(self)
+
+		for fmt in EXPORT_FORMATS:
+			self.cboFormat.addItem( fmt[0] )
+		self.editGeomColumn.setText( geomColumn if geomColumn != None else "" )
+		self.progressBar.hide()
+		self.lblProgress.hide()
+
+		self.connect(self.btnBrowse, SIGNAL("clicked()"), self.chooseFile)
+		self.connect(self.cboFormat, SIGNAL("currentIndexChanged(int)"), self.formatChanged)
+		self.connect(self.buttonBox, SIGNAL("accepted()"), self.exportData)
+
+	def currentFormat(self):
+		return EXPORT_FORMATS[ self.cboFormat.currentIndex() ]
+
+	def formatChanged(self, index):
+		# keep the file extension in sync with the format
+		fileName = self.editFile.text()
+		if fileName.isEmpty():
+			return
+		info = QFileInfo(fileName)
+		ext = self.currentFormat()[1][1:]
+		self.editFile.setText( QDir(info.path()).filePath( info.completeBaseName() + ext ) )
+
+	def chooseFile(self):
+		settings = QSettings()
+		lastDir = settings.value("/DB_Manager/export/lastDir").toString()
+		name, pattern, exporterClass = self.currentFormat()
+		fileName = QFileDialog.getSaveFileName(self, "Export to file", QDir(lastDir).filePath( self.name + pattern[1:] ), u"%s (%s)" % (name, pattern))
+		if fileName.isEmpty():
+			return
+		settings.setValue("/DB_Manager/export/lastDir", QFileInfo(fileName).absolutePath())
+		self.editFile.setText( fileName )
+
+	def exportData(self):
+		if self.task != None:
+			return
+
+		fileName = self.editFile.text()
+		if fileName.isEmpty():
+			QMessageBox.information(self, "Export to file", "File name is required")
+			return
+
+		name, pattern, exporterClass = self.currentFormat()
+		geomColumn = self.editGeomColumn.text()
+		if geomColumn.isEmpty() and exporterClass.REQUIRES_GEOMETRY:
+			QMessageBox.information(self, "Export to file", "Geometry column is required")
+			return
+
+		self.exporter = exporterClass(self.db, self.sql, fileName, geomColumn, self.srid)
+		self.connect(self.exporter, SIGNAL("progress"), self.exportProgress)
+		self.task = ExportTask(self.db, self.exporter)
+		self.connect(self.task, SIGNAL("finished()"), self.exportFinished)
+
+		# unknown number of rows, show a busy indicator
+		self.progressBar.setRange( 0, self.rowCount if self.rowCount != None and self.rowCount > 0 else 0 )
+		self.progressBar.setValue( 0 )
+		self.lblProgress.setText( "" )
+		self.progressBar.show()
+		self.lblProgress.show()
+		self.buttonBox.button(QDialogButtonBox.Ok).setEnabled(False)
+
+		self.task.start()
+
+	def exportProgress(self, count):
+		if self.progressBar.maximum() > 0:
+			self.progressBar.setValue( min(count, self.progressBar.maximum()) )
+		self.lblProgress.setText( u"%d rows" % count )
+
+	def exportFinished(self):
+		task = self.task
+		self.task = None
+		task.deleteLater()
+		self.buttonBox.button(QDialogButtonBox.Ok).setEnabled(True)
+		self.progressBar.hide()
+		self.lblProgress.hide()
+
+		if task.error() != None:
+			DlgDbError.showError(task.error(), self)
+			return
+		if task.isCanceled():
+			QMessageBox.information(self, "Export to file", "Export was canceled.")
+			return
+
+		QMessageBox.information(self, "Export to file", u"%d rows were exported." % task.result())
+		self.accept()
+
+	def reject(self):
+		# cancel the running export instead of closing the dialog
+		if self.task != None:
+			self.task.cancel()
+			return
+		QDialog.reject(self)
@@ -27,7 +27,7 @@ from PyQt4.QtGui import *
 
 import qgis.core
 
-from .db_plugins.plugin import DbError
+from .db_plugins.plugin import BaseError, DbError
 from .dlg_db_error import DlgDbError
 
 from .ui.DlgImportVector_ui import Ui_DlgImportVector
@@ -40,9 +40,29 @@ class DlgImportVector(QDialog, Ui_DlgImportVector):
 		self.db = outDb
 		self.outUri = outUri
 		self.setupUi(self)
+		self.setupOptions()
 
+		self.cboTable.setEditText(self.outUri.table())
+		pk = self.outUri.keyColumn()
+		self.editPrimaryKey.setText(pk if pk != "" else self.default_pk)
+		geom = self.outUri.geometryColumn()
+		self.editGeomColumn.setText(geom if geom != "" else self.default_geom)
+		inCrs = self.inLayer.crs()
+		srid = inCrs.postgisSrid() if inCrs.isValid() else 4236
+		self.editSourceSrid.setText( "%s" % srid )
+		self.editTargetSrid.setText( "%s" % srid )
+
+		self.checkSupports()
+
+	def setupOptions(self):
+		""" init the widgets of the import options """
 		self.default_pk = "id"
 		self.default_geom = "geom"
+
+		self.importer = None	# bulk importer while it's running
+		self.importTask = None
+		self.progressBar.hide()
+		self.lblProgress.hide()
 		
 		# updates of UI
 		for widget in [self.radCreate, self.chkDropTable, self.radAppend, 
@@ -58,25 +78,15 @@ class DlgImportVector(QDialog, Ui_DlgImportVector):
 		self.populateEncodings()
 		self.updateUi()
 
-		self.cboTable.setEditText(self.outUri.table())
-		pk = self.outUri.keyColumn()
-		self.editPrimaryKey.setText(pk if pk != "" else self.default_pk)
-		geom = self.outUri.geometryColumn()
-		self.editGeomColumn.setText(geom if geom != "" else self.default_geom)
-		inCrs = self.inLayer.crs()
-		srid = inCrs.postgisSrid() if inCrs.isValid() else 4236
-		self.editSourceSrid.setText( "%s" % srid )
-		self.editTargetSrid.setText( "%s" % srid )
-
-		self.checkSupports()
-
 
 	def checkSupports(self):
 		allowSpatial = self.db.connector.hasSpatialSupport()
 		self.chkGeomColumn.setEnabled(allowSpatial)
 		self.chkSourceSrid.setEnabled(allowSpatial)
 		self.chkTargetSrid.setEnabled(allowSpatial)
+		self.chkServerTransform.setEnabled(allowSpatial and self.chkTargetSrid.isChecked())
 		self.chkSpatialIndex.setEnabled(allowSpatial)
+		self.chkSinglePart.setEnabled(allowSpatial)
 	
 		
 	def populateSchemas(self):
@@ -140,28 +150,50 @@ class DlgImportVector(QDialog, Ui_DlgImportVector):
 
 		allowSetTargetSrid = self.chkTargetSrid.isChecked()
 		self.editTargetSrid.setEnabled(allowSetTargetSrid)
+		self.chkServerTransform.setEnabled(allowSetTargetSrid and self.chkTargetSrid.isEnabled())
 		
 		allowSetEncoding = self.chkEncoding.isChecked()
 		self.cboEncoding.setEnabled(allowSetEncoding)
 
 		
-	def importLayer(self):
-		# sanity checks
-		if self.cboTable.currentText().isEmpty():
-			QMessageBox.information(self, "Import to database", "Table name is required")
-			return
-
+	def checkSrids(self):
+		""" return whether the source and target srids are valid, warn the user if not """
 		if self.chkSourceSrid.isChecked():
 			sourceSrid, ok = self.editSourceSrid.text().toInt()
 			if not ok:
 				QMessageBox.information(self, "Import to database", "Invalid source srid: must be an integer")
-				return
+				return False
 
 		if self.chkTargetSrid.isChecked():
 			targetSrid, ok = self.editTargetSrid.text().toInt()
 			if not ok:
 				QMessageBox.information(self, "Import to database", "Invalid target srid: must be an integer")
-				return
+				return False
+
+		return True
+
+	def sourceCrs(self):
+		""" return the crs set for the input layer, None to keep the layer one """
+		if not self.chkSourceSrid.isChecked():
+			return None
+		sourceSrid = self.editSourceSrid.text().toInt()[0]
+		return qgis.core.QgsCoordinateReferenceSystem(sourceSrid)
+
+	def targetCrs(self):
+		""" return the crs of the imported data, None to keep the layer one """
+		if not self.chkTargetSrid.isChecked():
+			return None
+		targetSrid = self.editTargetSrid.text().toInt()[0]
+		return qgis.core.QgsCoordinateReferenceSystem(targetSrid)
+
+	def importLayer(self):
+		# sanity checks
+		if self.cboTable.currentText().isEmpty():
+			QMessageBox.information(self, "Import to database", "Table name is required")
+			return
+
+		if not self.checkSrids():
+			return
 
 		QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
 
@@ -180,15 +212,11 @@ class DlgImportVector(QDialog, Ui_DlgImportVector):
 
 		providerName = self.db.dbplugin().providerName()
 
-		if self.chkSourceSrid.isChecked():
-			sourceSrid = self.editSourceSrid.text().toInt()[0]
-			inCrs = qgis.core.QgsCoordinateReferenceSystem(sourceSrid)
+		inCrs = self.sourceCrs()
+		if inCrs != None:
 			self.inLayer.setCrs( inCrs )
 
-		outCrs = None
-		if self.chkTargetSrid.isChecked():
-			targetSrid = self.editTargetSrid.text().toInt()[0]
-			outCrs = qgis.core.QgsCoordinateReferenceSystem(targetSrid)
+		outCrs = self.targetCrs()
 
 		if self.chkEncoding.isChecked():
 			enc = self.cboEncoding.currentText()
@@ -199,18 +227,102 @@ class DlgImportVector(QDialog, Ui_DlgImportVector):
 			options['overwrite'] = True
 		elif self.radAppend.isChecked():
 			options['append'] = True
+		if self.chkSinglePart.isEnabled() and self.chkSinglePart.isChecked():
+			options['forceSinglePartGeometryType'] = True
+
+		# use the bulk importer of the db plugin if any, it creates the
+		# spatial index by itself once the features are loaded
+		importer = self.db.vectorLayerImporter( self.inLayer, (unicode(schema) or None, unicode(table)),
+				geom if self.inLayer.hasGeometryType() else None, pk, outCrs,
+				self.radCreate.isChecked(), options.get('overwrite', False), self.chkSpatialIndex.isChecked() )
+		if importer != None:
+			# a previous import of the layer into the table didn't complete
+			checkpoint = importer.checkpoint()
+			if checkpoint != None:
+				QApplication.restoreOverrideCursor()
+				res = QMessageBox.question(self, "Import to database",
+						u"A previous import of this layer into the table stopped after %d features.\n"
+						u"Resume it, loading only the remaining features?" % checkpoint[1],
+						QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+				if res == QMessageBox.Cancel:
+					return
+				QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+				if res == QMessageBox.Yes:
+					importer.setResume( True )
+				else:
+					importer.clearCheckpoint()
+
+			if self.chkServerTransform.isEnabled() and self.chkServerTransform.isChecked():
+				importer.setServerTransform( True )
+			importer.setSinglePart( self.chkSinglePart.isEnabled() and self.chkSinglePart.isChecked() )
+
+			# the dialog is closed by importFinished() once it succeeds
+			self.runImporter(importer)
+			return
+
+		else:
+			ret, errMsg = qgis.core.QgsVectorLayerImport.importLayer( self.inLayer, uri, providerName, outCrs, False, False, options )
+			QApplication.restoreOverrideCursor()
+			if ret != 0:
+				QMessageBox.warning(self, "Import to database", u"Error %d\n%s" % (ret, errMsg) )
+				return
+
+			if self.chkSpatialIndex.isChecked():
+				self.db.connector.createSpatialIndex( (schema, table), geom )
 
-		ret, errMsg = qgis.core.QgsVectorLayerImport.importLayer( self.inLayer, uri, providerName, outCrs, False, False, options )
+		QMessageBox.information(self, "Import to database", "Import was successful.")
+		return self.accept()
+
+	def runImporter(self, importer):
+		""" run the bulk import in background showing its progress,
+			importFinished() is called when it ends """
+		from .db_plugins.tasks import ImportTask
+		self.importer = importer
+		self.importTask = ImportTask(self.db, importer)
+		self.connect(importer, SIGNAL("progress"), self.importProgress)
+		self.connect(self.importTask, SIGNAL("finished()"), self.importFinished)
+
+		self.progressBar.setRange( 0, max(importer.featureCount(), 0) )
+		self.progressBar.setValue( 0 )
+		self.lblProgress.setText( "" )
+		self.progressBar.show()
+		self.lblProgress.show()
+		self.buttonBox.button(QDialogButtonBox.Ok).setEnabled(False)
+
+		self.importTask.start()
+
+	def importFinished(self):
+		task, importer = self.importTask, self.importer
+		self.importTask = None
+		self.importer = None
+		task.deleteLater()
+		self.buttonBox.button(QDialogButtonBox.Ok).setEnabled(True)
 		QApplication.restoreOverrideCursor()
-		if ret != 0:
-			QMessageBox.warning(self, "Import to database", u"Error %d\n%s" % (ret, errMsg) )
+
+		if task.error() != None:
+			DlgDbError.showError(task.error(), self)
 			return
 
-		if self.chkSpatialIndex.isChecked():
-			self.db.connector.createSpatialIndex( (schema, table), geom )
+		if importer.isCanceled():
+			msg = u"Import was canceled, %d features were imported." % importer.importedCount
+			if importer.checkpoint() != None:
+				msg += u"\nImport the layer again to resume it."
+			QMessageBox.information(self, "Import to database", msg)
+			return
 
 		QMessageBox.information(self, "Import to database", "Import was successful.")
-		return self.accept()
+		self.accept()
+
+	def importProgress(self, count, rowsPerSec):
+		self.progressBar.setValue( count )
+		self.lblProgress.setText( u"%d features (%d/s)" % (count, rowsPerSec) )
+
+	def reject(self):
+		# cancel the running import instead of closing the dialog
+		if self.importTask != None:
+			self.importTask.cancel()
+			return
+		QDialog.reject(self)
 
 
 if __name__ == '__main__':
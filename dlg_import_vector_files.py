@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+Name                 : DB Manager
+Description          : Database manager plugin for QuantumGIS
+Date                 : May 23, 2011
+copyright            : (C) 2011 by Giuseppe Sucameli
+email                : brush.tyler@gmail.com
+
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+from .db_plugins.data_import import BatchImporter
+from .dlg_import_vector import DlgImportVector
+
+class DlgImportVectorFiles(DlgImportVector):
+	""" import many vector files at once into a schema, each file into
+		the table named as it. The import options are the ones of the
+		single layer import dialog. """
+
+	COL_FILE, COL_TABLE, COL_FEATURES, COL_RATE, COL_STATUS = range(5)
+
+	# files added by "Add directory"
+	VECTOR_FILE_PATTERNS = ["*.shp", "*.tab", "*.mif", "*.gml", "*.kml", "*.geojson"]
+
+	def __init__(self, outDb, outUri, parent=None):
+		QDialog.__init__(self, parent)
+		self.inLayer = None
+		self.db = outDb
+		self.outUri = outUri
+		self.batch = None
+		self._rows = {}	# file name: row in the results table
+
+		self.setupUi(self)
+		self.setWindowTitle("Import vector files")
+		self.setupFilesUi()
+		self.setupOptions()
+
+		# the tables are named as the files
+		self.label_3.hide()
+		self.cboTable.hide()
+
+		self.editPrimaryKey.setText(self.default_pk)
+		self.editGeomColumn.setText(self.default_geom)
+		self.editSourceSrid.setText("4326")
+		self.editTargetSrid.setText("4326")
+
+		self.checkSupports()
+
+	def setupFilesUi(self):
+		filesGroup = QGroupBox("Files", self)
+		layout = QGridLayout(filesGroup)
+		self.listFiles = QListWidget(filesGroup)
+		self.listFiles.setSelectionMode(QAbstractItemView.ExtendedSelection)
+		layout.addWidget(self.listFiles, 0, 0, 4, 1)
+		self.btnAddFiles = QPushButton("Add &files...", filesGroup)
+		layout.addWidget(self.btnAddFiles, 0, 1)
+		self.btnAddDirectory = QPushButton("Add &directory...", filesGroup)
+		layout.addWidget(self.btnAddDirectory, 1, 1)
+		self.btnRemoveFiles = QPushButton("&Remove", filesGroup)
+		layout.addWidget(self.btnRemoveFiles, 2, 1)
+		self.layout().insertWidget(0, filesGroup)
+
+		self.connect(self.btnAddFiles, SIGNAL("clicked()"), self.addFiles)
+		self.connect(self.btnAddDirectory, SIGNAL("clicked()"), self.addDirectory)
+		self.connect(self.btnRemoveFiles, SIGNAL("clicked()"), self.removeFiles)
+
+		# how many files are imported at the same time
+		settings = QSettings()
+		workersLayout = QHBoxLayout()
+		workersLayout.addWidget( QLabel("Parallel imports:", self) )
+		self.spinWorkers = QSpinBox(self)
+		self.spinWorkers.setRange(1, BatchImporter.workersLimit(self.db))
+		self.spinWorkers.setValue( settings.value("/DB_Manager/import/maxWorkers", 4).toInt()[0] )
+		workersLayout.addWidget(self.spinWorkers)
+		workersLayout.addStretch()
+		# before the progress bar and the buttons
+		self.layout().insertLayout(self.layout().count()-2, workersLayout)
+
+		self.tableResults = QTableWidget(0, 5, self)
+		self.tableResults.setHorizontalHeaderLabels( ["File", "Table", "Features", "Features/s", "Status"] )
+		self.tableResults.setEditTriggers(QAbstractItemView.NoEditTriggers)
+		self.tableResults.verticalHeader().hide()
+		self.tableResults.hide()
+		self.layout().insertWidget(self.layout().count()-2, self.tableResults)
+
+
+	def files(self):
+		return map(lambda i: unicode(self.listFiles.item(i).text()), range(self.listFiles.count()))
+
+	def appendFiles(self, files):
+		current = self.files()
+		for f in files:
+			f = unicode(f)
+			if f not in current:
+				self.listFiles.addItem(f)
+				current.append(f)
+
+	def addFiles(self):
+		settings = QSettings()
+		lastDir = settings.value("/DB_Manager/import/lastDir").toString()
+		files = QFileDialog.getOpenFileNames(self, "Select vector files", lastDir, "Vector files (%s);;All files (*)" % " ".join(self.VECTOR_FILE_PATTERNS))
+		if files.isEmpty():
+			return
+		settings.setValue("/DB_Manager/import/lastDir", QFileInfo(files[0]).absolutePath())
+		self.appendFiles( files )
+
+	def addDirectory(self):
+		settings = QSettings()
+		lastDir = settings.value("/DB_Manager/import/lastDir").toString()
+		path = QFileDialog.getExistingDirectory(self, "Select a directory", lastDir)
+		if path.isEmpty():
+			return
+		settings.setValue("/DB_Manager/import/lastDir", path)
+		directory = QDir(path)
+		names = directory.entryList(self.VECTOR_FILE_PATTERNS, QDir.Files, QDir.Name)
+		self.appendFiles( map(directory.absoluteFilePath, names) )
+
+	def removeFiles(self):
+		for item in self.listFiles.selectedItems():
+			self.listFiles.takeItem( self.listFiles.row(item) )
+
+
+	def importLayer(self):
+		if self.batch != None:
+			return
+
+		# sanity checks
+		files = self.files()
+		if len(files) <= 0:
+			QMessageBox.information(self, "Import to database", "Add the files to import")
+			return
+
+		# every file is imported into the table named as the file
+		duplicates = BatchImporter.duplicateTableNames(files)
+		if len(duplicates) > 0:
+			QMessageBox.information(self, "Import to database", u"More files would be imported into the same table:\n%s\n\nRemove the files with the same name." % u"\n".join(duplicates))
+			return
+
+		if not self.checkSrids():
+			return
+
+		schema = unicode(self.cboSchema.currentText()) or None if self.cboSchema.isEnabled() else None
+		pk = unicode(self.editPrimaryKey.text()) if self.chkPrimaryKey.isChecked() else ""
+		pk = pk if pk != "" else self.default_pk
+		geom = unicode(self.editGeomColumn.text()) if self.chkGeomColumn.isChecked() else ""
+		geom = geom if geom != "" else self.default_geom
+		encoding = unicode(self.cboEncoding.currentText()) if self.chkEncoding.isChecked() else None
+
+		createTable = self.radCreate.isChecked()
+		overwrite = createTable and self.chkDropTable.isChecked()
+
+		settings = QSettings()
+		settings.setValue("/DB_Manager/import/maxWorkers", self.spinWorkers.value())
+
+		self.batch = BatchImporter(self.db, files, schema, geom, pk, self.sourceCrs(), self.targetCrs(), encoding,
+				createTable, overwrite, self.chkSpatialIndex.isChecked(), self.spinWorkers.value(), self)
+		self.batch.serverTransform = self.chkServerTransform.isEnabled() and self.chkServerTransform.isChecked()
+		self.batch.singlePart = self.chkSinglePart.isEnabled() and self.chkSinglePart.isChecked()
+		self.connect(self.batch, SIGNAL("fileStarted"), self._fileStarted)
+		self.connect(self.batch, SIGNAL("fileProgress"), self._fileProgress)
+		self.connect(self.batch, SIGNAL("fileFinished"), self._fileFinished)
+		self.connect(self.batch, SIGNAL("finished"), self._batchFinished)
+
+		# one row per file in the results table
+		self._rows = {}
+		self.tableResults.setRowCount( len(files) )
+		for row, fileName in enumerate(files):
+			self._rows[ fileName ] = row
+			self._setResult( row, self.COL_FILE, QFileInfo(fileName).fileName() )
+			self._setResult( row, self.COL_TABLE, BatchImporter.tableName(fileName) )
+			self._setResult( row, self.COL_STATUS, "waiting" )
+		self.tableResults.show()
+
+		self.progressBar.setRange( 0, len(files) )
+		self.progressBar.setValue( 0 )
+		self.lblProgress.setText( "" )
+		self.progressBar.show()
+		self.lblProgress.show()
+		self._setImporting( True )
+
+		self.batch.start()
+
+	def _setImporting(self, importing):
+		self.buttonBox.button(QDialogButtonBox.Ok).setEnabled( not importing )
+		for widget in [self.btnAddFiles, self.btnAddDirectory, self.btnRemoveFiles, self.spinWorkers]:
+			widget.setEnabled( not importing )
+
+	def _setResult(self, row, col, text, toolTip=None):
+		item = QTableWidgetItem( unicode(text) )
+		if toolTip != None:
+			item.setToolTip( toolTip )
+		self.tableResults.setItem(row, col, item)
+
+	def _fileStarted(self, fileName, table):
+		row = self._rows[ fileName ]
+		self._setResult( row, self.COL_STATUS, "importing" )
+
+	def _fileProgress(self, fileName, count, rowsPerSec):
+		row = self._rows[ fileName ]
+		self._setResult( row, self.COL_FEATURES, count )
+		self._setResult( row, self.COL_RATE, rowsPerSec )
+
+	def _fileFinished(self, fileName, count, rowsPerSec, error):
+		row = self._rows[ fileName ]
+		self._setResult( row, self.COL_FEATURES, count )
+		self._setResult( row, self.COL_RATE, rowsPerSec )
+		if error == None:
+			self._setResult( row, self.COL_STATUS, "done" )
+		else:
+			self._setResult( row, self.COL_STATUS, u"failed: %s" % error, error )
+
+		results = self.batch.results()
+		failed = len( filter(lambda x: x[4] != None, results) )
+		self.progressBar.setValue( len(results) )
+		self.lblProgress.setText( u"%d of %d files (%d failed)" % (len(results), self.progressBar.maximum(), failed) )
+
+	def _batchFinished(self):
+		results = self.batch.results()
+		self.batch.deleteLater()
+		self.batch = None
+		self._setImporting( False )
+
+		# the files not imported because of a cancel
+		imported = map(lambda x: x[0], results)
+		for fileName, row in self._rows.iteritems():
+			if fileName not in imported:
+				self._setResult( row, self.COL_STATUS, "skipped" )
+
+		failed = len( filter(lambda x: x[4] != None, results) )
+		if failed > 0:
+			QMessageBox.warning(self, "Import to database", u"%d of %d files were not imported." % (failed, len(results)))
+		else:
+			QMessageBox.information(self, "Import to database", u"%d files were imported." % len(results))
+
+	def reject(self):
+		# cancel the running imports instead of closing the dialog
+		if self.batch != None:
+			self.batch.cancel()
+			return
+		DlgImportVector.reject(self)
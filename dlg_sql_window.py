@@ -26,6 +26,7 @@ from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
 from .db_plugins.plugin import BaseError
+from .db_plugins.data_model import SqlQueryTask
 from .dlg_db_error import DlgDbError
 
 from .ui.DlgSqlWindow_ui import Ui_DlgSqlWindow
@@ -57,8 +58,20 @@ class DlgSqlWindow(QDialog, Ui_DlgSqlWindow):
 		copyAction.setShortcuts(QKeySequence.Copy)
 		QObject.connect(copyAction, SIGNAL("triggered()"), self.copySelectedResults)
 		
+		# the query runs in a separate thread, the timer updates the elapsed time.
+		# Each query leases a connection until its result is dropped, so the
+		# result cursor stays opened while the other queries run
+		self.queryConnection = None
+		self.queryTask = None
+		self.queryTime = QTime()
+		self.queryTimer = QTimer(self)
+		self.queryTimer.setInterval(100)
+		self.connect(self.queryTimer, SIGNAL("timeout()"), self.updateQueryProgress)
+
 		self.connect(self.btnExecute, SIGNAL("clicked()"), self.executeSql)
+		self.connect(self.btnCancel, SIGNAL("clicked()"), self.cancelSql)
 		self.connect(self.btnClear, SIGNAL("clicked()"), self.clearSql)
+		self.connect(self.btnExport, SIGNAL("clicked()"), self.exportResults)
 		self.connect(self.buttonBox.button(QDialogButtonBox.Close), SIGNAL("clicked()"), self.close)
 
 		# hide the load query as layer if feature is not supported
@@ -72,12 +85,31 @@ class DlgSqlWindow(QDialog, Ui_DlgSqlWindow):
 			self.loadAsLayerToggled(False)
 
 
-	def closeEvent(self, e):
-		""" save window state """
+	def done(self, r):
+		""" save window state, it's called however the window is closed """
+		if self.queryTask != None:
+			self.cancelSql()
+			self.queryTask.wait()
+		self.clearResult()
+
 		settings = QSettings()
 		settings.setValue("/DB_Manager/sqlWindow/geometry", QVariant(self.saveGeometry()))
 		
-		QDialog.closeEvent(self, e)
+		QDialog.done(self, r)
+
+	def clearResult(self):
+		""" drop the result of the last query and give back its connection """
+		model = self.viewResult.model()
+		self.viewResult.setModel(None)
+		if model:
+			model.close()
+			model.deleteLater()
+		self.releaseQueryConnection()
+
+	def releaseQueryConnection(self):
+		if self.queryConnection != None:
+			self.db.connector.releaseConnection( self.queryConnection )
+			self.queryConnection = None
 
 	def loadAsLayerToggled(self, checked):
 		self.loadAsLayerGroup.setChecked( checked )
@@ -99,40 +131,115 @@ class DlgSqlWindow(QDialog, Ui_DlgSqlWindow):
 	def clearSql(self):
 		self.editSql.clear()
 
+	def exportResults(self):
+		""" export the rows of the query to a file, the query is run again
+			and its rows are streamed to the file """
+		sql = self.getSql()
+		if sql.isEmpty():
+			return
+		geomColumn = self.geomCombo.currentText() if self._loadAsLayerAvailable else ""
+
+		from .dlg_export_data import DlgExportData
+		DlgExportData(self.db, sql, geomColumn if not geomColumn.isEmpty() else None, parent=self).exec_()
+
 	def executeSql(self):
 		sql = self.getSql()
 		if sql.isEmpty(): return
-
-		QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+		if self.queryTask != None: return	# a query is still running
 
 		# delete the old model 
-		old_model = self.viewResult.model()
-		self.viewResult.setModel(None)
-		if old_model: old_model.deleteLater()
+		self.clearResult()
 
 		self.uniqueCombo.clear()
 		self.geomCombo.clear()
 
+		# don't wait for a pooled connection, the GUI would be blocked
 		try:
-			# set the new model 
-			model = self.db.sqlResultModel( sql, self )
-			self.viewResult.setModel( model )
-			self.lblResult.setText("%d rows, %.1f seconds" % (model.affectedRows(), model.secs()))
-
+			self.queryConnection = self.db.connector.leaseConnection(0)
 		except BaseError, e:
-			QApplication.restoreOverrideCursor()
 			DlgDbError.showError(e, self)
 			return
 
+		# run the query in a separate thread to keep the GUI responsive
+		self.queryTask = SqlQueryTask( self.db, sql, self, self.queryConnection )
+		self.connect(self.queryTask, SIGNAL("finished()"), self.queryFinished)
+
+		self.btnExecute.setEnabled(False)
+		self.btnCancel.setEnabled(True)
+		self.queryTime.start()
+		self.queryTimer.start()
+		self.updateQueryProgress()
+
+		self.queryTask.start()
+
+	def cancelSql(self):
+		if self.queryTask == None: return
+		self.btnCancel.setEnabled(False)
+		self.lblResult.setText("Canceling...")
+		self.queryTask.cancel()
+
+	def updateQueryProgress(self):
+		if self.queryTask == None or self.queryTask.isCanceled(): return
+		self.lblResult.setText("Running query... %.1f seconds" % (self.queryTime.elapsed() / 1000.0))
+
+	def queryFinished(self):
+		task = self.queryTask
+		self.queryTask = None
+		task.deleteLater()
+
+		self.queryTimer.stop()
+		self.btnExecute.setEnabled(True)
+		self.btnCancel.setEnabled(False)
+
+		model = task.result()
+		if task.isCanceled():
+			if model:
+				model.close()
+				model.deleteLater()
+			self.releaseQueryConnection()
+			self.lblResult.setText("Query canceled after %.1f seconds" % (self.queryTime.elapsed() / 1000.0))
+			return
+
+		if task.error() != None:
+			self.releaseQueryConnection()
+			self.lblResult.setText("")
+			DlgDbError.showError(task.error(), self)
+			return
+
+		# set the new model 
+		model.setParent( self )
+		self.viewResult.setModel( model )
+		self.connect(model, SIGNAL("rowsFetched"), self.updateFetchedRows)
+		# show the error once the view is done fetching
+		self.connect(model, SIGNAL("fetchError"), self.fetchFailed, Qt.QueuedConnection)
+		self.updateFetchedRows()
+
 		cols = self.viewResult.model().columnNames()
 		cols.sort()
 		self.uniqueCombo.addItems( cols )
 		self.geomCombo.addItems( cols )
 
 		self.update()
-		QApplication.restoreOverrideCursor()
 
 
+	def updateFetchedRows(self):
+		model = self.viewResult.model()
+		if model == None: return
+
+		if model.hasMoreRows():
+			text = "%d rows fetched so far" % model.fetchedRows()
+		elif model.fetchError() != None:
+			text = "%d rows fetched (stopped by an error)" % model.fetchedRows()
+		elif model.isTruncated():
+			text = "%d rows fetched (limit reached)" % model.fetchedRows()
+		else:
+			text = "%d rows" % model.affectedRows()
+		self.lblResult.setText("%s, %.1f seconds" % (text, model.secs()))
+
+	def fetchFailed(self, error):
+		self.updateFetchedRows()
+		DlgDbError.showError(error, self)
+
 	def loadSqlLayer(self):
 		uniqueFieldName = self.uniqueCombo.currentText()
 		geomFieldName = self.geomCombo.currentText()
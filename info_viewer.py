@@ -27,6 +27,7 @@ from .db_plugins.plugin import BaseError, DbError, DBPlugin, Schema, Table
 from .dlg_db_error import DlgDbError
 
 class InfoViewer(QTextBrowser):
+	MAX_CACHED_ITEMS = 50	# rendered documents kept in memory
 
 	def __init__(self, parent=None):
 		QTextBrowser.__init__(self, parent)
@@ -35,6 +36,14 @@ class InfoViewer(QTextBrowser):
 		self.item = None
 		self.dirty = False
 
+		# table info being rendered a section at a time
+		self._task = None
+		self._info = None
+		self._header = None
+		self._sectionsHtml = []
+
+		self._cache = []	# (item, html) of the items shown recently
+
 		self._clear()
 		self.connect(self, SIGNAL("anchorClicked(const QUrl&)"), self._linkClicked)
 
@@ -56,6 +65,7 @@ class InfoViewer(QTextBrowser):
 
 	def refresh(self):
 		self.setDirty(True)
+		self._uncache( self.item )
 		self.showInfo( self.item )		
 
 	def showInfo(self, item):
@@ -65,7 +75,10 @@ class InfoViewer(QTextBrowser):
 		if item is None:
 			return
 
-		if isinstance(item, DBPlugin):
+		html = self._cachedHtml(item)
+		if html != None:
+			self.setHtml(html)
+		elif isinstance(item, DBPlugin):
 			self._showDatabaseInfo(item)
 		elif isinstance(item, Schema):
 			self._showSchemaInfo(item)
@@ -76,6 +89,7 @@ class InfoViewer(QTextBrowser):
 
 		self.item = item
 		self.connect(self.item, SIGNAL('aboutToChange'), self.setDirty)
+		self.connect(self.item, SIGNAL('jobProgress'), self._jobProgress)
 
 	def setDirty(self, val=True):
 		self.dirty = val
@@ -83,9 +97,18 @@ class InfoViewer(QTextBrowser):
 	def _clear(self):
 		if self.item is not None:
 			self.disconnect(self.item, SIGNAL('aboutToChange'), self.setDirty)
+			self.disconnect(self.item, SIGNAL('jobProgress'), self._jobProgress)
 		self.item = None
 		self.dirty = False
 
+		if self._task != None:
+			from .db_plugins.tasks import discardTask
+			self.disconnect(self._task, SIGNAL("progress"), self._sectionFetched)
+			self.disconnect(self._task, SIGNAL("finished()"), self._infoTaskFinished)
+			discardTask(self._task)
+			self._task = None
+		self._info = None
+
 		self.item = None
 		self.setHtml("")
 
@@ -112,18 +135,101 @@ class InfoViewer(QTextBrowser):
 			html += u'<p style="color:red">%s</p>' % unicode(e).replace('\n', '<br>')
 		html += "</div>"
 		self.setHtml(html)
+		self._cacheHtml(schema, html)
 
 
 	def _showTableInfo(self, table):		
-		html = u'<div style="background-color:#ccccff"><h1>&nbsp;%s</h1></div>' % table.name
-		html += '<div style="margin-left:8px;">'
+		""" the sections are shown as soon as their data are read by a task
+			running in background, so the GUI isn't blocked meanwhile """
+		from .db_plugins.tasks import InfoTask
+
+		self._header = u'<div style="background-color:#ccccff"><h1>&nbsp;%s</h1></div>' % table.name
+		self._sectionsHtml = []
+		self._info = table.info()
+		self._task = InfoTask(table.database(), self._info, self._info.sections())
+		self.connect(self._task, SIGNAL("progress"), self._sectionFetched)
+		self.connect(self._task, SIGNAL("finished()"), self._infoTaskFinished)
+		self._task.start()
+
+		self._showTableSections(True)
+		return True
+
+	def _sectionFetched(self, name):
+		if self.sender() != self._task:
+			return	# canceled
+		self._appendSection(name)
+		self._showTableSections(True)
+
+	def _appendSection(self, name):
 		try:
-			html += table.info().toHtml()
+			section = self._info.sectionHtml(name)
+			if section != None:
+				self._sectionsHtml.append( section.toHtml() )
 		except DbError, e:
-			html += u'<p style="color:red">%s</p>' % unicode(e).replace('\n', '<br>')
+			self._sectionsHtml.append( u'<p style="color:red">%s</p>' % unicode(e).replace('\n', '<br>') )
+
+	def _infoTaskFinished(self):
+		task = self.sender()
+		if task != self._task:
+			return	# canceled
+		task.deleteLater()
+		self._task = None
+
+		html = self._showTableSections(False)
+		if not task.isCanceled():
+			self._cacheHtml(self.item, html)
+
+	def _jobProgress(self, job):
+		""" show the time elapsed by the jobs running on the table,
+			the data read by the info task are rendered again """
+		if self._task != None or self._info == None:
+			return
+		self._sectionsHtml = []
+		for name in self._info.sections():
+			self._appendSection(name)
+		self._showTableSections(False)
+
+	def _showTableSections(self, loading):
+		html = self._header
+		html += '<div style="margin-left:8px;">'
+		html += u''.join( self._sectionsHtml )
+		if loading:
+			html += u'<p>Loading...</p>'
 		html += '</div>'
+
+		# keep the position, the document is updated while the user reads it
+		scroll = self.verticalScrollBar().value()
 		self.setHtml(html)
-		return True
+		self.verticalScrollBar().setValue( scroll )
+		return html
+
+
+	def _cachedHtml(self, item):
+		for cached, html in self._cache:
+			if cached is item:
+				return html
+		return None
+
+	def _cacheHtml(self, item, html):
+		""" keep the document of the item until it's about to change """
+		self._uncache(item)
+		self._cache.append( (item, html) )
+		self.connect(item, SIGNAL('aboutToChange'), self._cachedItemAboutToChange)
+		if len(self._cache) > self.MAX_CACHED_ITEMS:
+			self._uncache( self._cache[0][0] )
+
+	def _uncache(self, item):
+		for i, (cached, html) in enumerate(self._cache):
+			if cached is item:
+				try:
+					self.disconnect(item, SIGNAL('aboutToChange'), self._cachedItemAboutToChange)
+				except RuntimeError:
+					pass	# the item was deleted
+				del self._cache[i]
+				return
+
+	def _cachedItemAboutToChange(self):
+		self._uncache( self.sender() )
 
 
 
@@ -89,7 +89,8 @@ class LayerPreview(QgsMapCanvas):
 
 		if table.geomType:
 			# limit the query result if required
-			if limit and table.rowCount > 1000:
+			rowCount = table.rowCount if table.rowCount != None else table.estimatedRowCount
+			if limit and rowCount > 1000:
 				uniqueField = table.getValidQGisUniqueFields(True)
 				if uniqueField == None:
 					QMessageBox.warning(self, "Sorry", "Unable to find a valid unique field")